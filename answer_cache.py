@@ -0,0 +1,189 @@
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+from config import settings
+
+# --- Cấu hình ---
+KB_VERSION_FILE = settings.kb_version_file
+ANSWER_CACHE_SIZE = settings.answer_cache_size
+ANSWER_CACHE_TTL = settings.answer_cache_ttl  # giây
+ANSWER_CACHE_THRESHOLD = settings.answer_cache_threshold  # cosine
+VERSION_CHECK_INTERVAL = settings.version_check_interval  # giây
+
+
+# === CHUẨN HÓA CÂU HỎI TIẾNG VIỆT ===
+def normalize_question(text: str) -> str:
+    """Bỏ dấu, chữ thường, bỏ dấu câu và gộp khoảng trắng."""
+    text = unicodedata.normalize("NFD", text.lower())
+    text = "".join(c for c in text if unicodedata.category(c) != "Mn")
+    text = text.replace("đ", "d")
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
+
+# === PHIÊN BẢN TRI THỨC ===
+# File phiên bản đổi vài lần mỗi ngày nhưng được tra ở mỗi câu hỏi: mỗi tiến trình chỉ đọc lại file
+# tối đa một lần mỗi VERSION_CHECK_INTERVAL giây, dùng chung cho mọi cache/chỉ mục trong tiến trình
+_versions = {}  # đường dẫn -> (phiên bản, thời điểm đọc)
+_versions_lock = threading.Lock()
+
+
+def _read_version_file(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+
+def read_version(path, max_age=VERSION_CHECK_INTERVAL):
+    """Phiên bản ghi trong `path`; giá trị đọc chưa quá `max_age` giây thì dùng lại, không chạm đĩa."""
+    now = time.monotonic()
+    with _versions_lock:
+        cached = _versions.get(path)
+        if cached is not None and now - cached[1] < max_age:
+            return cached[0]
+    version = _read_version_file(path)
+    with _versions_lock:
+        _versions[path] = (version, now)
+    return version
+
+
+def write_version(path):
+    """Ghi phiên bản mới vào `path`; tiến trình hiện tại thấy ngay, tiến trình khác sau tối đa max_age giây."""
+    version = str(time.time_ns())
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(version)
+    with _versions_lock:
+        _versions[path] = (version, time.monotonic())
+    return version
+
+
+def bump_knowledge_version(path=KB_VERSION_FILE):
+    """Đánh dấu tri thức đã thay đổi để các cache trả lời tự xóa."""
+    return write_version(path)
+
+
+def read_knowledge_version(path=KB_VERSION_FILE):
+    return read_version(path)
+
+
+class AnswerCache:
+    """
+    Cache câu trả lời hai tầng đặt trước RAGChatbot.get_answer.
+    - Tầng 1: khớp chính xác câu hỏi đã chuẩn hóa (bỏ dấu, gộp khoảng trắng).
+    - Tầng 2: khớp gần đúng theo cosine giữa embedding câu hỏi.
+    Cả hai tầng dùng chung LRU + TTL, giới hạn kích thước, và tự xóa
+    khi file phiên bản tri thức thay đổi (phát hiện chậm tối đa VERSION_CHECK_INTERVAL giây).
+    """
+
+    def __init__(self, max_size=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL,
+                 threshold=ANSWER_CACHE_THRESHOLD, version_file=KB_VERSION_FILE):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.threshold = threshold
+        self.version_file = version_file
+        self._version = read_knowledge_version(version_file)
+        self._entries = OrderedDict()  # key -> (answer, vector, expires_at)
+        self._matrix = None  # ma trận embedding đã chuẩn hóa, dựng lại khi cache đổi
+        self._matrix_keys = []
+        self._lock = threading.Lock()
+        self.hits_exact = 0
+        self.hits_semantic = 0
+        self.misses = 0
+
+    # --- Tra cứu ---
+    def get_exact(self, question):
+        key = normalize_question(question)
+        with self._lock:
+            self._check_version()
+            entry = self._entries.get(key)
+            if entry and entry[2] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits_exact += 1
+                return entry[0]
+            if entry:
+                self._remove(key)
+            return None
+
+    def get_semantic(self, vector):
+        with self._lock:
+            self._check_version()
+            if self._matrix is None:
+                self._rebuild_matrix()
+            if not self._matrix_keys:
+                self.misses += 1
+                return None
+            query = self._unit(vector)
+            scores = self._matrix @ query
+            best = int(np.argmax(scores))
+            key = self._matrix_keys[best]
+            entry = self._entries.get(key)
+            if scores[best] >= self.threshold and entry and entry[2] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits_semantic += 1
+                return entry[0]
+            self.misses += 1
+            return None
+
+    def note_miss(self):
+        """Ghi nhận một lần trượt cache khi không đi tới tầng ngữ nghĩa."""
+        with self._lock:
+            self.misses += 1
+
+    # --- Ghi ---
+    def put(self, question, answer, vector=None):
+        key = normalize_question(question)
+        vec = self._unit(vector) if vector is not None else None
+        with self._lock:
+            self._check_version()
+            self._entries[key] = (answer, vec, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            self._matrix = None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+
+    def stats(self):
+        hits = self.hits_exact + self.hits_semantic
+        total = hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits_exact": self.hits_exact,
+            "hits_semantic": self.hits_semantic,
+            "misses": self.misses,
+            "hit_rate": round(hits / total, 4) if total else 0.0,
+        }
+
+    # --- Nội bộ ---
+    def _check_version(self):
+        version = read_knowledge_version(self.version_file)
+        if version != self._version:
+            self._version = version
+            self._entries.clear()
+            self._matrix = None
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        self._matrix = None
+
+    def _rebuild_matrix(self):
+        now = time.monotonic()
+        keys = [k for k, e in self._entries.items() if e[1] is not None and e[2] > now]
+        self._matrix_keys = keys
+        self._matrix = np.stack([self._entries[k][1] for k in keys]) if keys else None
+
+    @staticmethod
+    def _unit(vector):
+        vec = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
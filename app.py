@@ -1,41 +1,129 @@
-from flask import Flask, render_template, request, jsonify
-import json, os, shutil
-from dotenv import load_dotenv
+import time
+_import_started = time.perf_counter()
 
-# THÊM HÀM initialize_vector_store TỪ FILE rag_system
-from rag_system import initialize_vector_store 
+from flask import Flask, Response, g, render_template, request, jsonify, stream_with_context
+import json, os, re, threading, uuid
+from dotenv import load_dotenv
 
-from rag_chatbot import RAGChatbot
+# LangChain/Chroma/OpenAI (rag_system, rag_chatbot) chỉ được import khi cần tới, không phải lúc khởi động
+from chat_history import ChatHistoryStore
+from config import settings
+from ingest_jobs import IngestJobQueue
+from serving import ConcurrencyLimiter, ServerBusy
+from metrics import observe_stage, registry, timed, trace
 
 # 1. Cấu hình Flask và API
 app = Flask(__name__)
 load_dotenv()
 
-# Khởi tạo chatbot ban đầu
-rag_chatbot = RAGChatbot()
+CHATBOT_WARMUP = settings.chatbot_warmup  # dựng chatbot ở thread nền ngay khi khởi động
+KB_WATCH_INTERVAL = settings.kb_watch_interval  # giây giữa hai lần kiểm tra phiên bản tri thức
+
+# Giới hạn số lời gọi LLM đồng thời; vượt quá hàng đợi thì trả 503
+llm_limiter = ConcurrencyLimiter()
+
+# Các hằng số đường dẫn (dùng chung cấu hình với CLI và rag_system, xem config.py)
+CHAT_HISTORY_DB = settings.chat_history_db
+CHAT_HISTORY_FILE = "chat_history.json"  # file cũ, chỉ dùng để migrate
+HISTORY_PAGE_SIZE = 50
+SESSION_COOKIE = "ptit_sid"
+SESSION_COOKIE_MAX_AGE = 30 * 24 * 3600
+INGEST_JOBS_DB = settings.ingest_jobs_db
+NEW_DOCS_DIR = settings.new_docs_dir
+OLD_DOCS_DIR = settings.old_docs_dir
+CHROMA_DB_PATH = settings.chroma_db_path
+EMBEDDING_MODEL = settings.embedding_model
+
+
+# 2. Quản lý lịch sử chat (ghi thêm vào SQLite, không ghi lại toàn bộ file)
+chat_history = ChatHistoryStore(CHAT_HISTORY_DB, CHAT_HISTORY_FILE)
+
+def load_history(session_id, limit=HISTORY_PAGE_SIZE):
+    return chat_history.tail(limit, session_id=session_id)
+
+def save_message(role, text, session_id):
+    with timed("history_write"):
+        chat_history.append(role, text, session_id=session_id)
+
+
+# 2c. Phiên trình duyệt: mỗi trình duyệt có lịch sử và bộ nhớ hội thoại riêng (cookie ptit_sid)
+def current_session():
+    sid = request.cookies.get(SESSION_COOKIE, "")
+    if not re.fullmatch(r"[0-9a-f]{32}", sid):
+        sid = g.get("new_session_id") or uuid.uuid4().hex
+        g.new_session_id = sid
+    return sid
+
+@app.after_request
+def set_session_cookie(response):
+    sid = g.get("new_session_id")
+    if sid:
+        response.set_cookie(SESSION_COOKIE, sid, max_age=SESSION_COOKIE_MAX_AGE, httponly=True, samesite="Lax")
+    return response
+
 
-# Các hằng số đường dẫn
-CHAT_HISTORY_FILE = "chat_history.json"
-OLD_DOCS_DIR = "./old_docs"
-CHROMA_DB_PATH = "./knowledge_base_ptit"
-EMBEDDING_MODEL = "text-embedding-3-small"
+# 2a. Chatbot dùng chung, khởi tạo lười: lần gọi đầu (hoặc thread warmup) mới import và dựng
+_chatbot = None
+_chatbot_lock = threading.Lock()
+startup_stats = {"import_seconds": None, "chatbot_seconds": None, "ready": False}
 
+def get_chatbot():
+    global _chatbot
+    if _chatbot is None:
+        with _chatbot_lock:
+            if _chatbot is None:
+                start = time.perf_counter()
+                from pipeline import build_chatbot
+                _chatbot = build_chatbot(settings, llm_limiter)
+                elapsed = time.perf_counter() - start
+                observe_stage("startup_chatbot", elapsed)
+                startup_stats.update(chatbot_seconds=round(elapsed, 3), ready=True)
+                print(f"🚀 Chatbot sẵn sàng sau {elapsed:.2f}s.")
+    return _chatbot
 
-# 2. Quản lý lịch sử chat (Không đổi)
-# ... (Giữ nguyên các hàm load_history và save_message)
-if not os.path.exists(CHAT_HISTORY_FILE):
-    with open(CHAT_HISTORY_FILE, "w", encoding="utf-8") as f:
-        json.dump([], f, ensure_ascii=False, indent=2)
+def warmup():
+    try:
+        get_chatbot()
+    except Exception as e:
+        print(f"⚠️ Warmup chatbot lỗi, sẽ thử lại ở request đầu tiên: {e}")
+
+def watch_knowledge_base():
+    """
+    Mỗi worker tự theo dõi kb_version.txt: khi tiến trình điều phối công bố phiên bản mới,
+    chatbot của worker nạp snapshot/BM25 mới ngay cả lúc không có request, không cần khởi động lại.
+    """
+    while True:
+        time.sleep(KB_WATCH_INTERVAL)
+        bot = _chatbot
+        if bot is None:
+            continue
+        try:
+            bot.refresh_indexes()
+        except Exception as e:
+            print(f"⚠️ Lỗi khi nạp phiên bản tri thức mới: {e}")
+
+
+# 2b. Hàng đợi nạp tri thức chạy nền (upload trả về ngay, không chặn worker Flask).
+#     Chạy nhiều worker: chỉ tiến trình điều phối (giữ khóa file) thực thi job ghi vào Knowledge Base.
+def run_ingest_job(progress):
+    from rag_system import update_knowledge_base_auto
+    update_knowledge_base_auto(progress)
+    ingest_queue.enqueue([], kind="faq")
+
+def run_rebuild_job(progress):
+    from rag_system import rebuild_knowledge_base
+    os.makedirs(OLD_DOCS_DIR, exist_ok=True)
+    print(f"Bắt đầu dựng lại Knowledge Base từ thư mục: {OLD_DOCS_DIR}")
+    rebuild_knowledge_base(CHROMA_DB_PATH, EMBEDDING_MODEL, OLD_DOCS_DIR)
+    ingest_queue.enqueue([], kind="faq")
 
-def load_history():
-    with open(CHAT_HISTORY_FILE, "r", encoding="utf-8") as f:
-        return json.load(f)
+def run_faq_job(progress):
+    """Tri thức vừa đổi: sinh lại câu trả lời FAQ có đoạn nguồn đã bị sửa/xóa (chạy ở tiến trình điều phối)."""
+    from faq_index import regenerate_stale
+    bot = get_chatbot()
+    regenerate_stale(bot, bot.faq, progress)
 
-def save_message(role, text):
-    history = load_history()
-    history.append({"role": role, "text": text})
-    with open(CHAT_HISTORY_FILE, "w", encoding="utf-8") as f:
-        json.dump(history, f, ensure_ascii=False, indent=2)
+ingest_queue = IngestJobQueue(INGEST_JOBS_DB)
 
 
 # --- CÁC ROUTE CỦA FLASK ---
@@ -43,28 +131,82 @@ def save_message(role, text):
 # 3. Giao diện chính (Không đổi)
 @app.route("/")
 def index():
-    return render_template("index.html", history=load_history())
+    return render_template("index.html", history=load_history(current_session()))
 
 
-# 4. Chat API (Không đổi)
+# 4. Chat API
+NO_DATA_REPLY = "Xin lỗi, tôi chỉ có thể trả lời các thông tin liên quan đến PTIT và hiện chưa có dữ liệu cho câu hỏi này."
+
+def busy_response(e):
+    resp = jsonify({"error": str(e)})
+    resp.headers["Retry-After"] = str(e.retry_after)
+    return resp, 503
+
+def postprocess_reply(rag_reply):
+    if "Tôi không tìm thấy thông tin" in rag_reply or "Lỗi khi truy vấn" in rag_reply:
+        return NO_DATA_REPLY
+    return rag_reply
+
 @app.route("/chat", methods=["POST"])
 def chat():
     user_message = request.json.get("message", "").strip()
     if not user_message:
         return jsonify({"error": "Tin nhắn trống."}), 400
-    save_message("user", user_message)
-    try:
-        rag_reply = rag_chatbot.get_answer(user_message)
-        if "Tôi không tìm thấy thông tin" in rag_reply or "Lỗi khi truy vấn" in rag_reply:
-            bot_reply = "Xin lỗi, tôi chỉ có thể trả lời các thông tin liên quan đến PTIT và hiện chưa có dữ liệu cho câu hỏi này."
-        else:
-            bot_reply = rag_reply
-    except Exception as e:
-        bot_reply = f"Lỗi khi xử lý: {str(e)}"
-    save_message("bot", bot_reply)
+    session_id = current_session()
+    with trace("chat", route="/chat"):
+        try:
+            bot_reply = postprocess_reply(get_chatbot().get_answer(user_message, session_id=session_id))
+        except ServerBusy as e:
+            # Chỉ xảy ra khi câu hỏi thật sự cần gọi LLM mà hàng đợi đã đầy; không ghi lượt này vào lịch sử
+            return busy_response(e)
+        except Exception as e:
+            registry.inc("ptit_errors_total", stage="chat")
+            bot_reply = f"Lỗi khi xử lý: {str(e)}"
+        save_message("user", user_message, session_id)
+        save_message("bot", bot_reply, session_id)
     return jsonify({"reply": bot_reply})
 
 
+# 4b. Chat API dạng stream (Server-Sent Events): gửi từng token ngay khi LLM sinh ra
+def sse_event(data, event=None):
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.route("/chat/stream", methods=["POST"])
+def chat_stream():
+    user_message = request.json.get("message", "").strip()
+    if not user_message:
+        return jsonify({"error": "Tin nhắn trống."}), 400
+    session_id = current_session()
+    save_message("user", user_message, session_id)
+
+    def generate():
+        parts = []
+        with trace("chat_stream", route="/chat/stream"):
+            try:
+                for token in get_chatbot().stream_answer(user_message, session_id=session_id):
+                    parts.append(token)
+                    yield sse_event({"token": token})
+                bot_reply = postprocess_reply("".join(parts).strip())
+            except ServerBusy as e:
+                # Stream đã bắt đầu (status 200) nên không trả 503 được: báo bận trong sự kiện done
+                bot_reply = str(e)
+            except Exception as e:
+                registry.inc("ptit_errors_total", stage="chat_stream")
+                bot_reply = f"Lỗi khi xử lý: {str(e)}"
+            # Lưu câu trả lời đầy đủ khi stream kết thúc; client thay nội dung bằng bản cuối
+            save_message("bot", bot_reply, session_id)
+        yield sse_event({"reply": bot_reply}, event="done")
+
+    response = Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    # Client ngắt kết nối giữa chừng: generator bị đóng, slot LLM (nếu đang giữ) được nhả trong rag_chatbot._stream
+    return response
+
+
 # 5. Giao diện Admin (Không đổi)
 @app.route("/admin")
 def admin_page():
@@ -74,7 +216,7 @@ def admin_page():
     return render_template("admin.html", knowledge_files=knowledge_files)
 
 
-# 6. Upload file (Không đổi)
+# 6. Upload file: lưu file rồi đưa vào hàng đợi, trả về job_id ngay
 @app.route("/upload", methods=["POST"])
 def upload():
     admin_password = os.getenv("ADMIN_PASSWORD")
@@ -87,17 +229,93 @@ def upload():
     if file.filename == "":
         return jsonify({"error": "Tên file không hợp lệ."}), 400
     try:
-        # Import hàm update ở đây để tránh lỗi circular import
-        from rag_system import update_knowledge_base_auto
-        os.makedirs("new_docs", exist_ok=True)
-        path = os.path.join("new_docs", file.filename)
+        os.makedirs(NEW_DOCS_DIR, exist_ok=True)
+        path = os.path.join(NEW_DOCS_DIR, file.filename)
         file.save(path)
-        update_knowledge_base_auto()
-        return jsonify({"success": True, "filename": file.filename})
+        job_id = ingest_queue.enqueue([file.filename])
+        return jsonify({"success": True, "filename": file.filename, "job_id": job_id}), 202
     except Exception as e:
         return jsonify({"error": f"Lỗi khi xử lý file: {str(e)}"}), 500
 
 
+# 6a. Trạng thái job nạp tri thức
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    job = ingest_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Không tìm thấy job."}), 404
+    return jsonify(job)
+
+
+# 6b. Thống kê cache câu trả lời (hit/miss)
+@app.route("/cache-stats")
+def cache_stats():
+    rag_chatbot = _chatbot
+    if rag_chatbot is None:
+        return jsonify({"error": "Chatbot chưa sẵn sàng."}), 503
+    stats = rag_chatbot.answer_cache.stats()
+    stats["lexical_fastpath"] = rag_chatbot.lexical_fastpath
+    stats["query_embeddings"] = rag_chatbot.embeddings.cache.stats()
+    stats["context_packing"] = rag_chatbot.context_stats
+    stats["conversation_memory"] = rag_chatbot.memory.stats()
+    stats["reranker"] = rag_chatbot.reranker.stats()
+    stats["faq"] = rag_chatbot.faq.stats()
+    return jsonify(stats)
+
+
+# 6c. Tình trạng hàng đợi LLM
+@app.route("/serving-stats")
+def serving_stats():
+    stats = llm_limiter.stats()
+    stats["pid"] = os.getpid()
+    stats["ingest_coordinator"] = ingest_queue.is_coordinator
+    return jsonify(stats)
+
+
+# 6d. Số liệu cho Prometheus (độ trễ từng giai đoạn, token, cache, lỗi)
+def collect_runtime_stats():
+    """Số liệu lấy tại thời điểm scrape từ các thành phần đã tự đếm sẵn."""
+    serving = llm_limiter.stats()
+    limiter = [
+        ("ptit_llm_in_flight", "gauge", "Số lời gọi LLM đang chạy", {(): serving["active"]}),
+        ("ptit_llm_waiting", "gauge", "Số request đang chờ slot LLM", {(): serving["waiting"]}),
+        ("ptit_llm_rejected_total", "counter", "Số request bị trả 503", {(): serving["rejected"]}),
+    ]
+    rag_chatbot = _chatbot
+    if rag_chatbot is None:
+        return limiter
+    answers = rag_chatbot.answer_cache.stats()
+    queries = rag_chatbot.embeddings.cache.stats()
+    faq = rag_chatbot.faq.stats()
+    return limiter + [
+        ("ptit_answer_cache_requests_total", "counter", "Tra cache câu trả lời theo kết quả",
+         {(("result", "exact_hit"),): answers["hits_exact"],
+          (("result", "semantic_hit"),): answers["hits_semantic"],
+          (("result", "miss"),): answers["misses"]}),
+        ("ptit_query_embedding_cache_requests_total", "counter", "Tra cache embedding câu hỏi theo kết quả",
+         {(("result", "hit"),): queries["hits"], (("result", "miss"),): queries["misses"]}),
+        ("ptit_lexical_fastpath_total", "counter", "Số câu hỏi trả lời bằng BM25, bỏ qua embedding",
+         {(): rag_chatbot.lexical_fastpath}),
+        ("ptit_faq_requests_total", "counter", "Tra FAQ sinh trước theo kết quả",
+         {(("result", "exact_hit"),): faq["hits_exact"],
+          (("result", "semantic_hit"),): faq["hits_semantic"],
+          (("result", "miss"),): faq["requests"] - faq["hits_exact"] - faq["hits_semantic"]}),
+        ("ptit_faq_entries", "gauge", "Số câu hỏi trong FAQ sinh trước", {(): faq["entries"]}),
+    ]
+
+registry.register_collector(collect_runtime_stats)
+
+@app.route("/metrics")
+def metrics():
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
+
+# 6e. Trạng thái khởi động (dùng cho health check của load balancer)
+@app.route("/health")
+def health():
+    return jsonify(startup_stats), (200 if startup_stats["ready"] else 503)
+
+
 # 7. Endpoint kiểm tra mật khẩu (Không đổi)
 @app.route("/check-admin-password", methods=["POST"])
 def check_admin_password():
@@ -112,48 +330,41 @@ def check_admin_password():
 # 8. HÀM RESET ĐÃ ĐƯỢC SỬA LỖI FILE LOCK
 @app.route("/reset-knowledge", methods=["POST"])
 def reset_knowledge_base():
-    """Xóa và tự động xây dựng lại toàn bộ tri thức từ các file trong old_docs."""
+    """
+    Đưa yêu cầu dựng lại toàn bộ tri thức từ old_docs vào hàng đợi; tiến trình điều phối dựng một phiên bản
+    mới nằm cạnh bản đang phục vụ rồi đổi con trỏ. Chatbot vẫn trả lời từ bản cũ trong lúc dựng.
+    """
     admin_password = os.getenv("ADMIN_PASSWORD")
     submitted_password = request.form.get("password")
 
     if not admin_password or submitted_password != admin_password:
         return jsonify({"error": "Mật khẩu không đúng."}), 403
 
-    global rag_chatbot # 1. Báo cho Python biết ta muốn thay đổi biến global
-
     try:
-        # 2. QUAN TRỌNG: Gỡ bỏ chatbot cũ để giải phóng file lock
-        rag_chatbot = None 
-
-        # 3. Xóa thư mục ChromaDB cũ nếu tồn tại
-        if os.path.exists(CHROMA_DB_PATH):
-            print(f"Đang xóa Knowledge Base cũ tại: {CHROMA_DB_PATH}")
-            shutil.rmtree(CHROMA_DB_PATH)
-        
-        # 4. Gọi hàm để xây dựng lại Knowledge Base từ các file trong old_docs
-        print(f"Bắt đầu xây dựng lại Knowledge Base từ thư mục: {OLD_DOCS_DIR}")
-        if os.path.exists(OLD_DOCS_DIR) and os.listdir(OLD_DOCS_DIR):
-            initialize_vector_store(CHROMA_DB_PATH, EMBEDDING_MODEL, OLD_DOCS_DIR)
-        else:
-            print("Thư mục old_docs rỗng, chỉ tạo một Knowledge Base trống.")
-            from langchain_openai import OpenAIEmbeddings
-            from langchain_chroma import Chroma
-            embeddings = OpenAIEmbeddings(model=EMBEDDING_MODEL)
-            Chroma(embedding_function=embeddings, persist_directory=CHROMA_DB_PATH)
-
-        # 5. Tải lại chatbot để nó dùng DB mới
-        rag_chatbot = RAGChatbot()
-        
-        print("Hoàn tất reset và xây dựng lại Knowledge Base.")
-        return jsonify({"success": True, "message": "Đã reset và tự động nạp lại tri thức thành công."})
+        job_id = ingest_queue.enqueue([], kind="rebuild")
+        return jsonify({"success": True, "job_id": job_id,
+                        "message": "Đã đưa yêu cầu dựng lại tri thức vào hàng đợi."}), 202
 
     except Exception as e:
-        # Trong trường hợp có lỗi, hãy cố gắng khởi tạo lại chatbot để ứng dụng không chết
-        if rag_chatbot is None:
-            rag_chatbot = RAGChatbot()
         print(f"Lỗi khi reset và xây dựng lại: {e}")
         return jsonify({"error": f"Lỗi khi reset: {str(e)}"}), 500
 
 
+def start_background_services():
+    """Hàng đợi nạp tri thức, warmup chatbot và kb-watcher của tiến trình web."""
+    ingest_queue.start({"ingest": run_ingest_job, "rebuild": run_rebuild_job, "faq": run_faq_job})
+    if CHATBOT_WARMUP:
+        threading.Thread(target=warmup, daemon=True, name="chatbot-warmup").start()
+    threading.Thread(target=watch_knowledge_base, daemon=True, name="kb-watcher").start()
+
+
+startup_stats["import_seconds"] = round(time.perf_counter() - _import_started, 3)
+# Khi chạy `python app.py`, tiến trình con của pool nạp tài liệu (spawn/forkserver) nạp lại file này
+# dưới tên __mp_main__: ở đó không được khởi động hàng đợi, warmup hay watcher.
+if __name__ != "__mp_main__":
+    start_background_services()
+
+
 if __name__ == "__main__":
-    app.run(debug=True)
\ No newline at end of file
+    # Chỉ dùng khi phát triển; chạy production xem README (waitress/gunicorn nhiều thread)
+    app.run(debug=True, threaded=True)
\ No newline at end of file
@@ -0,0 +1,235 @@
+"""
+So sánh bộ chia cũ (RecursiveCharacterTextSplitter 1000/200) với bộ chia theo cấu trúc (structured_chunker)
+trên một bộ câu hỏi cố định, chạy hoàn toàn offline (BM25 + HashEmbeddings, gộp RRF như RAGChatbot,
+rồi pack_context như trước khi gọi LLM).
+
+Hai corpus:
+- old_docs: câu hỏi viết tay, mỗi câu kèm đoạn văn bản mà câu trả lời đúng phải có.
+- handbook: sổ tay DOCX tổng hợp (heading, danh sách, bảng phí) với câu hỏi sinh tất định từ nội dung.
+
+Chỉ số cho mỗi bộ chia: số đoạn được index, số đoạn/token trung bình đưa vào prompt,
+và tỉ lệ câu hỏi mà ngữ cảnh chứa đáp án (hit rate, thay cho chất lượng câu trả lời).
+`--rerank` thêm cột lấy dư `rerank_candidates` ứng viên rồi chấm lại + chọn k thích ứng (reranker.py).
+
+Chạy từ thư mục gốc dự án:
+    python benchmarks/chunking_compare.py --sections 200
+    python benchmarks/chunking_compare.py --rerank
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import zipfile
+from datetime import datetime
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from context_packer import format_context, pack_context  # noqa: E402
+from doc_loader import load_text_from_file, split_documents  # noqa: E402
+from embedding_client import HashEmbeddings, count_tokens  # noqa: E402
+from lexical_index import BM25Index, reciprocal_rank_fusion  # noqa: E402
+from reranker import Reranker  # noqa: E402
+from structured_chunker import chunk_blocks, extract_blocks, pop_parents  # noqa: E402
+
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+RETRIEVAL_K = 4
+CANDIDATE_K = 20
+
+# (câu hỏi, đoạn văn bản phải có trong ngữ cảnh)
+OLD_DOCS_QUESTIONS = [
+    ("Trả sách thư viện quá hạn bị phạt bao nhiêu tiền mỗi ngày?", "5.000 VNĐ"),
+    ("Sinh viên được mượn tối đa bao nhiêu cuốn sách?", "5 cuốn"),
+    ("Học phí dự kiến cho ngành Công nghệ thông tin là bao nhiêu?", "35 triệu"),
+    ("Phòng Đào tạo làm việc từ mấy giờ?", "8:00"),
+    ("Hạn chót đăng ký môn học trực tuyến là ngày nào?", "ngày 15"),
+    ("Email liên hệ của Phòng Đào tạo là gì?", "pdaotao@ptit.edu.vn"),
+    ("Cố vấn học tập được quy định theo quyết định số mấy?", "47/QĐ-HV"),
+    ("Cố vấn học tập có nhiệm vụ gì về định hướng nghề nghiệp?", "định hướng nghề nghiệp"),
+    ("Học viện được thành lập theo quyết định nào của Thủ tướng?", "516/TTg"),
+    ("Quyết định công nhận Học viện là cơ sở giáo dục đại học trọng điểm quốc gia?", "452/QĐ-TTg"),
+    ("Giá trị cốt lõi của Học viện là gì?", "Tiên phong"),
+    ("Tầm nhìn của Học viện đến năm nào?", "2030"),
+]
+
+# Sổ tay tổng hợp
+TOPICS = ["học phí", "ký túc xá", "học bổng", "thực tập", "tốt nghiệp", "đăng ký tín chỉ", "thư viện",
+          "ngoại ngữ", "điểm rèn luyện", "bảo hiểm y tế", "thẻ sinh viên", "phúc khảo"]
+SERVICES = ["cấp lại", "gia hạn", "xác nhận", "chuyển đổi", "bổ sung", "hủy"]
+FILLER = ("sinh viên cần thực hiện đúng quy định của học viện trong thời hạn được thông báo trên cổng thông tin "
+          "đào tạo và liên hệ phòng chức năng khi có vướng mắc phát sinh trong quá trình học tập").split()
+
+_W_NS = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/word/document.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/></Types>'
+)
+_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/'
+    'officeDocument" Target="word/document.xml"/></Relationships>'
+)
+
+
+def _xml_escape(text):
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def _p(text, style=None, numbered=False):
+    ppr = ""
+    if style or numbered:
+        ppr = "<w:pPr>" + (f'<w:pStyle w:val="{style}"/>' if style else "")
+        ppr += ('<w:numPr><w:ilvl w:val="0"/><w:numId w:val="1"/></w:numPr>' if numbered else "") + "</w:pPr>"
+    return f"<w:p>{ppr}<w:r><w:t xml:space=\"preserve\">{_xml_escape(text)}</w:t></w:r></w:p>"
+
+
+def _table(rows):
+    cells = lambda row: "".join(f"<w:tc>{_p(c)}</w:tc>" for c in row)  # noqa: E731
+    return "<w:tbl>" + "".join(f"<w:tr>{cells(r)}</w:tr>" for r in rows) + "</w:tbl>"
+
+
+def write_handbook(path, n_sections, seed):
+    """Sổ tay DOCX: chương -> điều (Heading 2) -> đoạn mô tả, danh sách hồ sơ, bảng phí. Trả về bộ câu hỏi."""
+    rng = random.Random(seed)
+    body, questions = [], []
+    for i in range(n_sections):
+        topic = TOPICS[i % len(TOPICS)]
+        code = f"QĐ-{i:04d}"
+        if i % 10 == 0:
+            body.append(_p(f"Chương {i // 10 + 1}. Quy định về {topic}", style="Heading1"))
+        body.append(_p(f"Điều {i + 1}. Thủ tục {topic} theo {code}", style="Heading2"))
+        body.append(_p(f"Quy định {code} hướng dẫn thủ tục {topic}. "
+                       + " ".join(rng.choice(FILLER) for _ in range(80)) + "."))
+        body.append(_p(f"Hồ sơ {topic} theo {code} gồm:"))
+        items = [f"Giấy tờ {topic} mẫu M{i:04d}-{j}" for j in range(1, 4)]
+        body.extend(_p(item, numbered=True) for item in items)
+        fees = [(s, f"{rng.randint(1, 99) * 10}.000 đồng", f"{rng.randint(2, 30)} ngày") for s in SERVICES]
+        body.append(_table([("Dịch vụ", "Mức phí", "Thời hạn")] + fees))
+        service, fee, days = rng.choice(fees)
+        questions.append((f"Mức phí {service} {topic} theo {code} là bao nhiêu?", fee))
+        questions.append((f"Hồ sơ {topic} theo {code} cần giấy tờ mẫu nào?", items[1].split()[-1]))
+    document = (f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?><w:document xmlns:w="{_W_NS}">'
+                f'<w:body>{"".join(body)}</w:body></w:document>')
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as z:
+        z.writestr("[Content_Types].xml", _CONTENT_TYPES)
+        z.writestr("_rels/.rels", _RELS)
+        z.writestr("word/document.xml", document)
+    return questions
+
+
+# === CHIA ĐOẠN ===
+def chunk_recursive(files):
+    chunks = []
+    for name, path in files:
+        chunks.extend(split_documents(load_text_from_file(path), name))
+    return chunks
+
+
+def chunk_structured(files):
+    chunks = []
+    for name, path in files:
+        blocks = extract_blocks(path)
+        chunks.extend(chunk_blocks(blocks, name) if blocks is not None
+                      else split_documents(load_text_from_file(path), name))
+    return chunks
+
+
+# === TRUY HỒI + ĐÁNH GIÁ ===
+def evaluate(chunks, questions, embeddings, token_budget, reranker=None):
+    for i, c in enumerate(chunks):
+        c.id = f"c{i}"
+    # Như khi nạp vào Knowledge Base: mục cha lưu riêng một lần theo parent_id, đoạn con chỉ giữ ID
+    parents = pop_parents(chunks)
+    bm25 = BM25Index()
+    for c in chunks:
+        bm25.add(c.id, c.page_content, c.metadata)
+    matrix = np.array(embeddings.embed_documents([c.page_content for c in chunks]), dtype=np.float32)
+
+    hits, prompt_chunks, prompt_tokens = 0, [], []
+    for question, expected in questions:
+        lexical = [d for d, _ in bm25.search(question, k=CANDIDATE_K)]
+        scores = matrix @ np.array(embeddings.embed_query(question), dtype=np.float32)
+        vector = [chunks[i] for i in np.argsort(-scores)[:CANDIDATE_K]]
+        if reranker is None:
+            docs = reciprocal_rank_fusion([lexical, vector], k=RETRIEVAL_K)
+        else:
+            docs = reranker.rerank(question, reciprocal_rank_fusion([lexical, vector], k=reranker.candidates),
+                                   RETRIEVAL_K)
+        packed, _ = pack_context(docs, token_budget, parents=lambda ids: {i: parents[i] for i in ids if i in parents})
+        context = format_context(packed)
+        hits += expected in context
+        prompt_chunks.append(len(packed))
+        prompt_tokens.append(count_tokens(context))
+    return {
+        "chunks_indexed": len(chunks),
+        "avg_prompt_chunks": round(float(np.mean(prompt_chunks)), 2),
+        "avg_prompt_tokens": round(float(np.mean(prompt_tokens)), 1),
+        "hit_rate": round(hits / len(questions), 3),
+        "questions": len(questions),
+    }
+
+
+def compare(name, files, questions, embeddings, token_budget, rerank=False):
+    result = {"corpus": name}
+    runs = [("recursive", chunk_recursive, False), ("structured", chunk_structured, False)]
+    if rerank:
+        runs += [("recursive+rerank", chunk_recursive, True), ("structured+rerank", chunk_structured, True)]
+    for label, chunker, use_reranker in runs:
+        chunks = chunker(files)
+        reranker = None
+        if use_reranker:
+            bm25 = BM25Index()
+            for i, c in enumerate(chunks):
+                bm25.add(f"idf{i}", c.page_content)
+            reranker = Reranker(mode="lexical", idf=bm25.idf)
+        result[label] = evaluate(chunks, questions, embeddings, token_budget, reranker)
+        if reranker is not None:
+            result[label]["rerank"] = reranker.stats()
+        r = result[label]
+        print(f"  {name:<9} {label:<17} chunks={r['chunks_indexed']:<6} prompt_chunks={r['avg_prompt_chunks']:<5} "
+              f"prompt_tokens={r['avg_prompt_tokens']:<7} hit_rate={r['hit_rate']}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="So sánh bộ chia recursive và structured")
+    parser.add_argument("--docs", default=os.path.join(ROOT, "old_docs"))
+    parser.add_argument("--sections", type=int, default=200, help="số điều trong sổ tay tổng hợp")
+    parser.add_argument("--questions", type=int, default=100, help="số câu hỏi lấy mẫu từ sổ tay")
+    parser.add_argument("--token-budget", type=int, default=1500)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--rerank", action="store_true", help="so sánh thêm khi có bước chấm lại + k thích ứng")
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    embeddings = HashEmbeddings()
+    results = []
+    print("📊 So sánh bộ chia (k=%d, ngân sách %d token)" % (RETRIEVAL_K, args.token_budget))
+    files = [(f, os.path.join(args.docs, f)) for f in sorted(os.listdir(args.docs))]
+    results.append(compare("old_docs", files, OLD_DOCS_QUESTIONS, embeddings, args.token_budget, args.rerank))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "so_tay_sinh_vien.docx")
+        questions = write_handbook(path, args.sections, args.seed)
+        questions = random.Random(args.seed).sample(questions, min(args.questions, len(questions)))
+        results.append(compare("handbook", [("so_tay_sinh_vien.docx", path)], questions, embeddings,
+                               args.token_budget, args.rerank))
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    output = args.output or os.path.join(RESULTS_DIR, f"chunking-{datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({"args": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+    print(f"💾 Đã ghi kết quả: {output}")
+
+
+if __name__ == "__main__":
+    main()
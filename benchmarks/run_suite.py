@@ -0,0 +1,352 @@
+"""
+Bộ benchmark/load-test chạy hoàn toàn offline: embedding và LLM là bản giả lập cục bộ
+(EMBEDDING_BACKEND=local, LLM_BACKEND=local) với độ trễ cấu hình được, nên kết quả lặp lại được.
+
+Với mỗi corpus (old_docs và corpus tổng hợp ở nhiều kích cỡ) bộ đo chạy trong một thư mục tạm riêng:
+1. Nạp tri thức (initialize_vector_store) -> số đoạn/giây và thời gian từng giai đoạn.
+2. Truy hồi của RAGChatbot (BM25 + vector + RRF) -> p50/p95/p99.
+3. Chế độ batch của CLI (pipeline.build_chatbot + answer_batch, như `main.py --batch`) -> p50/p95/p99, câu/giây.
+4. POST /chat của app.py qua server WSGI thật với N client đồng thời -> request/giây, độ trễ, số 503.
+
+Chạy từ thư mục gốc dự án:
+    python benchmarks/run_suite.py --synthetic 1000,10000,100000 --clients 1,8,32
+    python benchmarks/run_suite.py --baseline benchmarks/results/run-A.json   # so sánh với lần chạy trước
+
+Kết quả ghi ra JSON (mặc định benchmarks/results/run-<thời gian>.json).
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+SYNTHETIC_CHUNKS_PER_FILE = 500
+
+# Từ vựng cho corpus tổng hợp: đủ giống văn bản hành chính của PTIT để BM25/embedding có ý nghĩa
+TOPICS = ["học phí", "tuyển sinh", "ký túc xá", "học bổng", "thời khóa biểu", "thực tập", "tốt nghiệp",
+          "đăng ký tín chỉ", "điểm rèn luyện", "chuẩn đầu ra", "ngoại ngữ", "phòng đào tạo", "câu lạc bộ"]
+WORDS = ("sinh viên học viện công nghệ bưu chính viễn thông ngành chương trình đào tạo quy định năm học "
+         "kỳ thi hồ sơ thông báo hạn nộp khoa giảng viên lớp môn học tín chỉ điểm số phòng tầng nhà "
+         "cơ sở hà nội hồ chí minh chất lượng cao liên kết quốc tế kế hoạch lịch trình xét duyệt miễn giảm "
+         "hỗ trợ tài chính thủ tục biểu mẫu email cổng thông tin hướng dẫn điều kiện yêu cầu kết quả").split()
+
+
+def percentile_ms(samples, p):
+    return round(float(np.percentile(samples, p)) * 1000, 3) if samples else None
+
+
+def latency_summary(samples):
+    return {
+        "count": len(samples),
+        "p50_ms": percentile_ms(samples, 50),
+        "p95_ms": percentile_ms(samples, 95),
+        "p99_ms": percentile_ms(samples, 99),
+        "mean_ms": round(float(np.mean(samples)) * 1000, 3) if samples else None,
+    }
+
+
+# === CHUẨN BỊ CORPUS ===
+def synthetic_chunk(rng, i):
+    """Một đoạn ~900 ký tự: đủ ngắn để splitter giữ nguyên thành một chunk, có mã định danh riêng."""
+    topic = TOPICS[i % len(TOPICS)]
+    words = [rng.choice(WORDS) for _ in range(120)]
+    return f"Thông báo {topic} mã TB{i:06d}: " + " ".join(words) + "."
+
+
+def write_synthetic_corpus(docs_dir, n_chunks, seed):
+    rng = random.Random(seed)
+    os.makedirs(docs_dir, exist_ok=True)
+    for start in range(0, n_chunks, SYNTHETIC_CHUNKS_PER_FILE):
+        end = min(n_chunks, start + SYNTHETIC_CHUNKS_PER_FILE)
+        with open(os.path.join(docs_dir, f"synthetic_{start:07d}.txt"), "w", encoding="utf-8") as f:
+            f.write("\n\n".join(synthetic_chunk(rng, i) for i in range(start, end)))
+
+
+def make_questions(vector_store, n, seed):
+    """Câu hỏi lấy từ một cụm từ liên tiếp trong đoạn ngẫu nhiên của Knowledge Base; không trùng nhau."""
+    rng = random.Random(seed)
+    ids = vector_store.get(include=[])["ids"]
+    if not ids:
+        return []
+    picks = [rng.choice(ids) for _ in range(n)]
+    docs = {}
+    for start in range(0, len(picks), 500):
+        res = vector_store.get(ids=list(set(picks[start:start + 500])), include=["documents"])
+        docs.update(zip(res["ids"], res["documents"]))
+    questions = []
+    for i, doc_id in enumerate(picks):
+        words = (docs.get(doc_id) or "").split()
+        span = rng.randint(4, 9)
+        pos = rng.randint(0, max(0, len(words) - span))
+        questions.append(f"{' '.join(words[pos:pos + span])} là gì? (#{i})")
+    return questions
+
+
+# === CÁC PHÉP ĐO (chạy trong tiến trình con, cwd = thư mục tạm của corpus) ===
+def bench_ingestion():
+    from metrics import registry
+    from rag_system import CHROMA_DB_PATH, EMBEDDING_MODEL, OLD_DOCS_DIR, initialize_vector_store
+
+    t0 = time.perf_counter()
+    store = initialize_vector_store(CHROMA_DB_PATH, EMBEDDING_MODEL, OLD_DOCS_DIR)
+    elapsed = time.perf_counter() - t0
+    chunks = len(store.get(include=[])["ids"])
+    return store, {
+        "files": len(os.listdir(OLD_DOCS_DIR)),
+        "chunks": chunks,
+        "seconds": round(elapsed, 3),
+        "chunks_per_second": round(chunks / elapsed, 1) if elapsed else None,
+        "stages": registry.totals("ptit_ingest_stage_seconds"),
+    }
+
+
+def bench_retrieval(questions):
+    from pipeline import build_chatbot
+
+    t0 = time.perf_counter()
+    bot = build_chatbot()
+    startup = time.perf_counter() - t0
+    samples = []
+    for q in questions:
+        bot.answer_cache.clear()  # chỉ đo truy hồi, không để cache câu trả lời cắt ngắn
+        t0 = time.perf_counter()
+        bot._prepare(q)
+        samples.append(time.perf_counter() - t0)
+    result = latency_summary(samples)
+    result["startup_seconds"] = round(startup, 3)
+    result["lexical_fastpath"] = bot.lexical_fastpath
+    result["snapshot"] = bot.snapshot is not None
+    return result
+
+
+def bench_cli_batch(questions, concurrency):
+    import asyncio
+
+    from pipeline import answer_batch, build_chatbot, summarize_batch
+
+    bot = build_chatbot()
+    t0 = time.perf_counter()
+    results = asyncio.run(answer_batch(bot, questions, concurrency))
+    wall = time.perf_counter() - t0
+    summary = summarize_batch(results, wall, bot)
+    result = latency_summary([r["latency_ms"] / 1000 for r in results])
+    result["concurrency"] = concurrency
+    result["seconds"] = summary["wall_seconds"]
+    result["questions_per_second"] = summary["questions_per_second"]
+    result["errors"] = summary["errors"]
+    result["answer_cache_hits"] = summary["answer_cache_hits"]
+    return result
+
+
+def post_chat(base_url, question):
+    req = urllib.request.Request(
+        f"{base_url}/chat",
+        data=json.dumps({"message": question}).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+    )
+    try:
+        with urllib.request.urlopen(req, timeout=120) as resp:
+            resp.read()
+            return resp.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def bench_serving(questions, clients_list, requests_per_client):
+    from werkzeug.serving import make_server
+
+    import app as flask_app
+
+    server = make_server("127.0.0.1", 0, flask_app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    pool = iter(questions)
+    results = {}
+    try:
+        for clients in clients_list:
+            batches = [[next(pool) for _ in range(requests_per_client)] for _ in range(clients)]
+            samples, statuses, lock = [], {}, threading.Lock()
+
+            def client(batch):
+                for q in batch:
+                    t0 = time.perf_counter()
+                    status = post_chat(base_url, q)
+                    with lock:
+                        samples.append(time.perf_counter() - t0)
+                        statuses[status] = statuses.get(status, 0) + 1
+
+            t0 = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=clients) as ex:
+                list(ex.map(client, batches))
+            wall = time.perf_counter() - t0
+            summary = latency_summary(samples)
+            summary["seconds"] = round(wall, 3)
+            summary["requests_per_second"] = round(statuses.get(200, 0) / wall, 2) if wall else None
+            summary["status_codes"] = {str(k): v for k, v in sorted(statuses.items())}
+            results[f"clients={clients}"] = summary
+    finally:
+        server.shutdown()
+    return results
+
+
+def run_corpus(args):
+    """Tiến trình con: đo một corpus trong thư mục tạm đã chuẩn bị sẵn old_docs."""
+    os.chdir(args.workdir)
+    clients_list = [int(c) for c in args.clients.split(",") if c]
+    n_serving = sum(clients_list) * args.requests_per_client
+
+    store, ingestion = bench_ingestion()
+    questions = make_questions(store, args.queries + args.cli_queries + n_serving, args.seed)
+    retrieval_q = questions[:args.queries]
+    cli_q = questions[args.queries:args.queries + args.cli_queries]
+    serving_q = questions[args.queries + args.cli_queries:]
+
+    result = {"ingestion": ingestion}
+    if questions:
+        result["retrieval"] = bench_retrieval(retrieval_q)
+        result["cli_batch"] = bench_cli_batch(cli_q, args.cli_concurrency)
+        result["chat"] = bench_serving(serving_q, clients_list, args.requests_per_client)
+    with open(os.path.join(args.workdir, "result.json"), "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False)
+
+
+# === ĐIỀU PHỐI ===
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def child_env(args, workdir):
+    env = dict(os.environ)
+    env.update({
+        "EMBEDDING_BACKEND": "local",
+        "LLM_BACKEND": "local",
+        "OPENAI_API_KEY": env.get("OPENAI_API_KEY", "offline-benchmark"),
+        "LOCAL_EMBEDDING_LATENCY": str(args.embed_latency),
+        "LOCAL_LLM_LATENCY": str(args.llm_latency),
+        "LOCAL_LLM_TOKEN_DELAY": str(args.token_delay),
+        "TRACE_LOG": "",
+        "PYTHONPATH": ROOT + os.pathsep + env.get("PYTHONPATH", ""),
+    })
+    return env
+
+
+def measure(name, prepare_docs, args):
+    workdir = tempfile.mkdtemp(prefix=f"ptit_bench_{name}_")
+    try:
+        prepare_docs(os.path.join(workdir, "old_docs"))
+        cmd = [sys.executable, os.path.abspath(__file__), "--run-corpus", "--workdir", workdir,
+               "--queries", str(args.queries), "--cli-queries", str(args.cli_queries),
+               "--cli-concurrency", str(args.cli_concurrency),
+               "--clients", args.clients, "--requests-per-client", str(args.requests_per_client),
+               "--seed", str(args.seed)]
+        print(f"⏳ Đang đo corpus '{name}'...")
+        proc = subprocess.run(cmd, env=child_env(args, workdir), capture_output=True, text=True)
+        if proc.returncode != 0:
+            print(proc.stdout[-2000:])
+            print(proc.stderr[-4000:])
+            return {"error": f"tiến trình đo thoát với mã {proc.returncode}"}
+        with open(os.path.join(workdir, "result.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def headline(corpus):
+    """Các chỉ số chính dùng để so sánh hai lần chạy."""
+    out = {}
+    if "ingestion" in corpus:
+        out["ingestion.chunks_per_second"] = corpus["ingestion"]["chunks_per_second"]
+    for key in ("retrieval", "cli_batch"):
+        if key in corpus:
+            out[f"{key}.p95_ms"] = corpus[key]["p95_ms"]
+    for level, stats in corpus.get("chat", {}).items():
+        out[f"chat.{level}.requests_per_second"] = stats["requests_per_second"]
+        out[f"chat.{level}.p95_ms"] = stats["p95_ms"]
+    return out
+
+
+def compare(report, baseline_path):
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"\n📊 So sánh với {baseline_path} (commit {baseline['meta'].get('git_commit')}):")
+    for name, corpus in report["corpora"].items():
+        old = headline(baseline["corpora"].get(name, {}))
+        for metric, value in headline(corpus).items():
+            before = old.get(metric)
+            if before and value is not None:
+                print(f"  {name:>18} {metric:<40} {before:>10} -> {value:>10} ({(value - before) / before:+.1%})")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", default=os.path.join(ROOT, "old_docs"), help="Corpus thật; bỏ trống để bỏ qua")
+    parser.add_argument("--synthetic", default="1000,10000,100000", help="Các kích cỡ corpus tổng hợp (số đoạn)")
+    parser.add_argument("--queries", type=int, default=200, help="Số câu hỏi đo truy hồi")
+    parser.add_argument("--cli-queries", type=int, default=50, help="Số câu hỏi đo chế độ batch của CLI")
+    parser.add_argument("--cli-concurrency", type=int, default=8, help="Số câu trả lời song song ở chế độ batch")
+    parser.add_argument("--clients", default="1,8,32", help="Các mức client đồng thời cho /chat")
+    parser.add_argument("--requests-per-client", type=int, default=10)
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="Độ trễ giả lập mỗi lần gọi embedding (giây)")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="Độ trễ giả lập của LLM trước token đầu (giây)")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="Độ trễ giả lập giữa các token (giây)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="File JSON kết quả")
+    parser.add_argument("--baseline", help="File JSON của lần chạy trước để so sánh")
+    parser.add_argument("--run-corpus", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_corpus:
+        run_corpus(args)
+        return
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "settings": {k: v for k, v in vars(args).items() if k not in ("run_corpus", "workdir", "output", "baseline")},
+        },
+        "corpora": {},
+    }
+    if args.docs and os.path.isdir(args.docs) and os.listdir(args.docs):
+        report["corpora"]["old_docs"] = measure(
+            "old_docs", lambda target: shutil.copytree(args.docs, target), args)
+    for size in [int(s) for s in args.synthetic.split(",") if s]:
+        report["corpora"][f"synthetic_{size}"] = measure(
+            f"synthetic_{size}", lambda target, n=size: write_synthetic_corpus(target, n, args.seed), args)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"run-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(json.dumps({name: headline(c) for name, c in report["corpora"].items()}, ensure_ascii=False, indent=2))
+    print(f"💾 Đã lưu kết quả vào '{output}'.")
+    if args.baseline:
+        compare(report, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
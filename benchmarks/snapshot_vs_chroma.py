@@ -0,0 +1,90 @@
+"""
+So sánh độ trễ tìm kiếm vector: Chroma (SQLite + HNSW) và snapshot NumPy (float32 / int8).
+
+Chạy từ thư mục gốc dự án, sau khi đã có knowledge_base_ptit:
+    python benchmarks/snapshot_vs_chroma.py --queries 200
+
+Câu hỏi giả lập là các vector trong chính Knowledge Base cộng nhiễu, nên không cần gọi API embedding.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_chroma import Chroma  # noqa: E402
+
+from vector_snapshot import VectorSnapshot, build_snapshot  # noqa: E402
+
+
+def percentile_ms(samples, p):
+    return round(float(np.percentile(samples, p)) * 1000, 3)
+
+
+def time_searches(search, queries, k):
+    samples, results = [], []
+    for q in queries:
+        t0 = time.perf_counter()
+        results.append(search(q, k))
+        samples.append(time.perf_counter() - t0)
+    return samples, results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", default="./knowledge_base_ptit")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--noise", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Ghi kết quả JSON ra file")
+    args = parser.parse_args()
+
+    store = Chroma(persist_directory=args.db)
+    # Xuất snapshot vào thư mục tạm để không đụng tới snapshot đang phục vụ
+    snapshot_dir = tempfile.mkdtemp(prefix="kb_snapshot_bench_")
+    build_snapshot(store, snapshot_dir)
+    exact = VectorSnapshot.load_current(snapshot_dir, quantized=False)
+    quant = VectorSnapshot.load_current(snapshot_dir, quantized=True)
+    if not len(exact):
+        print("Knowledge Base rỗng, không có gì để đo.")
+        return
+
+    rng = np.random.default_rng(args.seed)
+    base = np.asarray(exact.matrix)
+    picks = rng.integers(0, len(base), args.queries)
+    queries = base[picks] + rng.normal(0, args.noise, (args.queries, base.shape[1])).astype(np.float32)
+    queries = [q.tolist() for q in queries]
+
+    report = {"chunks": len(exact), "dim": int(base.shape[1]), "queries": args.queries, "results": {}}
+    for k in (3, 4):
+        chroma_t, chroma_r = time_searches(lambda q, k: store.similarity_search_by_vector(q, k=k), queries, k)
+        exact_t, exact_r = time_searches(lambda q, k: [d for d, _ in exact.search(q, k)], queries, k)
+        quant_t, quant_r = time_searches(lambda q, k: [d for d, _ in quant.search(q, k)], queries, k)
+
+        def recall(results):
+            hits = sum(len({d.id for d in r} & {d.id for d in c}) for r, c in zip(results, chroma_r))
+            return round(hits / (k * len(queries)), 4)
+
+        report["results"][f"k={k}"] = {
+            name: {"p50_ms": percentile_ms(t, 50), "p95_ms": percentile_ms(t, 95), "recall_vs_chroma": rec}
+            for name, t, rec in (
+                ("chroma", chroma_t, 1.0),
+                ("snapshot_f32", exact_t, recall(exact_r)),
+                ("snapshot_int8", quant_t, recall(quant_r)),
+            )
+        }
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+from config import settings
+
+# --- Cấu hình ---
+HISTORY_DB = settings.chat_history_db
+LEGACY_HISTORY_FILE = "./chat_history.json"
+DEFAULT_SESSION = "default"  # tin nhắn cũ (trước khi có phiên) và CLI
+
+
+class ChatHistoryStore:
+    """
+    Lưu lịch sử chat theo kiểu chỉ-ghi-thêm (append-only) trên SQLite ở chế độ WAL.
+    - Mỗi tin nhắn là một dòng, ghi thêm O(1), không ghi lại toàn bộ file.
+    - Đọc N tin nhắn gần nhất dựa trên chỉ mục id, không phải parse toàn bộ lịch sử.
+    - Nhiều request/tiến trình ghi đồng thời không làm mất dữ liệu của nhau.
+    - Mỗi tin nhắn gắn với một phiên (session_id), đọc lịch sử theo từng phiên.
+    - File chat_history.json cũ được chuyển sang một lần duy nhất.
+    """
+
+    def __init__(self, db_path=HISTORY_DB, legacy_file=LEGACY_HISTORY_FILE):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                role TEXT NOT NULL,
+                text TEXT NOT NULL,
+                sources TEXT,
+                timestamp TEXT NOT NULL,
+                session_id TEXT NOT NULL DEFAULT 'default'
+            )
+            """
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(messages)")}
+        if "session_id" not in columns:
+            # DB tạo trước khi có phiên: thêm cột, tin nhắn cũ thuộc phiên mặc định
+            self._conn.execute(f"ALTER TABLE messages ADD COLUMN session_id TEXT NOT NULL DEFAULT '{DEFAULT_SESSION}'")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_session ON messages (session_id, id)")
+        # File lịch sử cũ đã chuyển sang (ghi cùng transaction với tin nhắn của file đó)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS migrated_files (path TEXT PRIMARY KEY)")
+        self._conn.commit()
+        if legacy_file:
+            self._migrate_legacy(legacy_file)
+
+    def append(self, role, text, sources=None, session_id=DEFAULT_SESSION):
+        """Ghi thêm một tin nhắn, trả về id của tin nhắn."""
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT INTO messages (role, text, sources, timestamp, session_id) VALUES (?, ?, ?, ?, ?)",
+                (role, text, json.dumps(sources or [], ensure_ascii=False), datetime.now().isoformat(), session_id),
+            )
+            self._conn.commit()
+            return cur.lastrowid
+
+    def tail(self, limit=50, session_id=None):
+        """Lấy `limit` tin nhắn gần nhất (của một phiên, hoặc tất cả nếu không chỉ định), theo thứ tự thời gian tăng dần."""
+        with self._lock:
+            if session_id is None:
+                rows = self._conn.execute(
+                    "SELECT role, text, sources, timestamp FROM messages ORDER BY id DESC LIMIT ?",
+                    (limit,),
+                ).fetchall()
+            else:
+                rows = self._conn.execute(
+                    "SELECT role, text, sources, timestamp FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+                    (session_id, limit),
+                ).fetchall()
+        return [self._row_to_message(r) for r in reversed(rows)]
+
+    def user_messages(self, limit=50000):
+        """Nội dung `limit` tin nhắn gần nhất của người dùng (mọi phiên), dùng để khai thác câu hỏi thường gặp."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT text FROM messages WHERE role = 'user' ORDER BY id DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [r[0] for r in rows]
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+    def clear(self, session_id):
+        """Xóa lịch sử của một phiên (các phiên web khác dùng chung DB không bị ảnh hưởng)."""
+        with self._lock:
+            self._conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    @staticmethod
+    def _row_to_message(row):
+        role, text, sources, timestamp = row
+        return {
+            "role": role,
+            "text": text,
+            "sources": json.loads(sources) if sources else [],
+            "timestamp": timestamp,
+        }
+
+    def _migrate_legacy(self, legacy_file):
+        """Chuyển chat_history.json cũ sang SQLite (chỉ chạy một lần)."""
+        if not os.path.exists(legacy_file):
+            return
+        with self._lock:
+            # Khóa ghi để hai tiến trình không cùng migrate một file
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if not os.path.exists(legacy_file):
+                    self._conn.rollback()
+                    return
+                key = os.path.abspath(legacy_file)
+                if self._conn.execute("SELECT 1 FROM migrated_files WHERE path = ?", (key,)).fetchone():
+                    # Lần trước đã ghi xong nhưng chưa kịp đổi tên file
+                    self._conn.rollback()
+                    self._mark_migrated(legacy_file)
+                    return
+                with open(legacy_file, "r", encoding="utf-8") as f:
+                    legacy = json.load(f)
+                rows = []
+                for msg in legacy:
+                    # app.py dùng "text", main.py dùng "content"
+                    rows.append((
+                        msg.get("role", ""),
+                        msg.get("text", msg.get("content", "")),
+                        json.dumps(msg.get("sources", []), ensure_ascii=False),
+                        msg.get("timestamp", datetime.now().isoformat()),
+                    ))
+                self._conn.executemany(
+                    "INSERT INTO messages (role, text, sources, timestamp) VALUES (?, ?, ?, ?)", rows
+                )
+                self._conn.execute("INSERT INTO migrated_files (path) VALUES (?)", (key,))
+                self._conn.commit()
+            except Exception as e:
+                self._conn.rollback()
+                print(f"⚠ Lỗi khi chuyển lịch sử cũ {legacy_file}: {e}")
+                return
+            # Commit xong mới đổi tên file cũ; sập hoặc lỗi ở bước này thì bảng migrated_files
+            # ngăn chuyển lặp, lần khởi động sau chỉ đổi tên
+            self._mark_migrated(legacy_file)
+        print(f"✅ Đã chuyển {len(rows)} tin nhắn từ '{legacy_file}' sang '{self.db_path}'.")
+
+    @staticmethod
+    def _mark_migrated(legacy_file):
+        try:
+            os.replace(legacy_file, legacy_file + ".migrated")
+        except OSError as e:
+            print(f"⚠ Đã chuyển lịch sử nhưng không đổi tên được {legacy_file}: {e}")
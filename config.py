@@ -0,0 +1,177 @@
+import json
+import os
+from dataclasses import asdict, dataclass, fields, replace
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CONFIG_ENV = "PTIT_CONFIG"  # đường dẫn file cấu hình (.toml hoặc .json), để trống thì chỉ đọc biến môi trường
+
+
+@dataclass(frozen=True)
+class Settings:
+    """
+    Cấu hình dùng chung cho web (app.py), CLI (main.py), nạp tri thức (rag_system.py) và benchmark.
+    Thứ tự ưu tiên: giá trị mặc định < file PTIT_CONFIG < biến môi trường cùng tên viết hoa
+    (ví dụ `retrieval_k` <- RETRIEVAL_K). Các module đọc giá trị từ `settings` thay vì tự đặt hằng số.
+    """
+
+    # --- Đường dẫn ---
+    chroma_db_path: str = "./knowledge_base_ptit"
+    old_docs_dir: str = "./old_docs"
+    new_docs_dir: str = "./new_docs"
+    chat_history_db: str = "./chat_history.db"
+    ingest_jobs_db: str = "./ingest_jobs.db"
+    snapshot_dir: str = "./kb_snapshot"
+    embedding_cache_dir: str = "./embedding_cache"
+    query_cache_db: str = "./query_embedding_cache.db"
+    kb_version_file: str = "./kb_version.txt"
+    kb_write_lock: str = "./kb_write.lock"              # khóa file cho mọi thao tác ghi vào Knowledge Base
+    coordinator_lock: str = "./ingest_coordinator.lock"  # worker giữ khóa này chạy hàng đợi nạp tri thức
+    trace_log: str = ""  # file JSONL trace từng request; để trống thì tắt trace
+
+    # --- Backend (openai hoặc local: giả lập cục bộ, không gọi mạng, dùng cho benchmark/kiểm thử) ---
+    embedding_backend: str = "openai"
+    local_embedding_dim: int = 384
+    local_embedding_latency: float = 0.0  # giây mỗi lần gọi
+    llm_backend: str = "openai"
+    local_llm_latency: float = 0.0        # giây trước token đầu tiên
+    local_llm_token_delay: float = 0.0    # giây giữa hai token
+    local_llm_answer_words: int = 60
+
+    # --- Mô hình ---
+    embedding_model: str = "text-embedding-3-small"
+    llm_model: str = "gpt-4o-mini"
+    llm_temperature: float = 0.3
+    memory_model: str = "gpt-4o-mini"  # viết lại câu hỏi nối tiếp và tóm tắt hội thoại
+
+    # --- Truy hồi ---
+    retrieval_k: int = 4           # số đoạn đưa vào prompt khi không chấm lại (hoặc chấm lại quá hạn)
+    candidate_k: int = 20          # số ứng viên mỗi nguồn (BM25 / vector) trước khi gộp
+    context_token_budget: int = 1500
+    near_dup_threshold: float = 0.8          # Jaccard trên shingle 5 từ
+    parent_merge_min_children: int = 2       # số đoạn con cùng mục cha được chọn thì trả về mục cha
+    parent_expand_max_tokens: int = 300      # mục cha ngắn hơn mức này thì trả về thay cho đoạn con
+    lexical_fastpath_coverage: float = 0.85  # BM25 phủ đủ câu hỏi thì bỏ qua embedding
+    lexical_fastpath_margin: float = 1.5
+
+    # --- Chấm lại (reranker.py) ---
+    reranker: str = "lexical"      # "lexical", "cross-encoder" hoặc "off"
+    rerank_model: str = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"  # đa ngôn ngữ, chạy CPU
+    rerank_candidates: int = 12    # số ứng viên lấy dư trước khi chấm lại
+    rerank_budget_ms: float = 80.0  # quá hạn thì dùng thứ tự truy hồi ban đầu
+    rerank_min_k: int = 1
+    rerank_max_k: int = 6
+    rerank_relative_cutoff: float = 0.6  # bỏ đoạn có điểm < 60% đoạn đầu
+    rerank_gap: float = 0.2              # khoảng rơi điểm (thang 0-1) để cắt
+
+    # --- Chia đoạn (doc_loader.py, structured_chunker.py) ---
+    chunker: str = "recursive"     # "recursive" (1000/200 ký tự) hoặc "structured" (theo heading/bảng/danh sách)
+    child_chunk_size: int = 400    # ký tự: đơn vị nhỏ dùng để so khớp
+    parent_chunk_size: int = 1500  # ký tự: mục cha trả về khi cần ngữ cảnh rộng
+
+    # --- Bộ nhớ hội thoại (conversation_memory.py) ---
+    memory_window_turns: int = 3         # số lượt hỏi-đáp giữ nguyên văn
+    memory_turn_max_tokens: int = 200    # cắt mỗi câu trả lời trong cửa sổ
+    memory_summary_max_tokens: int = 250
+    memory_max_sessions: int = 1000
+    memory_session_ttl: float = 3600.0   # giây không hoạt động thì bỏ phiên
+
+    # --- Snapshot vector (vector_snapshot.py) ---
+    snapshot_quantized: bool = False  # tìm trên ma trận int8
+
+    # --- Cache ---
+    answer_cache_size: int = 512
+    answer_cache_ttl: float = 86400.0  # giây
+    answer_cache_threshold: float = 0.95  # cosine
+    query_cache_size: int = 5000
+    version_check_interval: float = 1.0  # giây giữa hai lần đọc file phiên bản (kb_version.txt, faq_version.txt)
+
+    # --- Đồng thời ---
+    max_concurrent_llm: int = 8    # số lời gọi LLM chạy cùng lúc (mỗi tiến trình web, và mặc định của chế độ batch)
+    max_queued_chats: int = 32
+    queue_timeout: float = 15.0    # giây
+    embed_concurrency: int = 4
+    ingest_workers: int = 0        # 0 = số CPU
+    rerank_workers: int = 2
+
+    # --- Kích thước lô ---
+    embed_max_batch_size: int = 256
+    embed_max_batch_tokens: int = 100000
+    write_batch_size: int = 128    # số đoạn embed + ghi vào Chroma mỗi lô
+    query_batch_max: int = 64
+    query_batch_window_ms: float = 5.0
+    query_embed_timeout: float = 30.0  # giây chờ micro-batcher embed một câu hỏi
+    embed_max_retries: int = 6
+    stream_batch_chars: int = 1000000
+
+    # --- Nạp tri thức (ingest_pipeline.py) ---
+    stream_ingest_min_mb: float = 20.0  # file từ cỡ này (và mọi CSV) được đọc dần
+    ingest_memory_limit_mb: int = 0     # trần RSS khi nạp tri thức, 0 = không giới hạn
+
+    # --- Web (app.py) ---
+    chatbot_warmup: bool = True      # dựng chatbot ở thread nền ngay khi khởi động
+    kb_watch_interval: float = 2.0   # giây giữa hai lần kiểm tra phiên bản tri thức
+
+    # --- FAQ sinh trước (faq_index.py) ---
+    faq_index_db: str = "./faq_index.db"
+    faq_version_file: str = "./faq_version.txt"  # đổi mỗi khi FAQ được dựng/sinh lại để các worker nạp lại
+    faq_min_count: int = 3              # số lần được hỏi tối thiểu để vào FAQ
+    faq_max_entries: int = 300
+    faq_match_threshold: float = 0.92   # cosine giữa câu hỏi và tâm cụm FAQ
+
+    def as_dict(self):
+        return asdict(self)
+
+
+def _read_file(path):
+    if path.endswith(".toml"):
+        import tomllib
+        with open(path, "rb") as f:
+            return tomllib.load(f)
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+_TRUE = {"1", "true", "yes", "on"}
+_FALSE = {"0", "false", "no", "off"}
+
+
+def _coerce(field, value, source):
+    try:
+        if field.type is bool and isinstance(value, str):
+            # bool("0") là True nên chuỗi (biến môi trường) phải đọc theo từ khóa
+            if value.strip().lower() not in _TRUE | _FALSE:
+                raise ValueError(value)
+            return value.strip().lower() in _TRUE
+        return field.type(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Cấu hình '{field.name}' ({source}) không hợp lệ: {value!r}") from None
+
+
+def load_settings(path=None, environ=None) -> Settings:
+    """Đọc cấu hình: mặc định, rồi file `path` (hoặc PTIT_CONFIG), rồi biến môi trường."""
+    environ = os.environ if environ is None else environ
+    path = path or environ.get(CONFIG_ENV, "")
+    by_name = {f.name: f for f in fields(Settings)}
+    values = {}
+    if path:
+        data = _read_file(path)
+        unknown = sorted(set(data) - set(by_name))
+        if unknown:
+            raise ValueError(f"File cấu hình '{path}' có khóa không hỗ trợ: {', '.join(unknown)}")
+        values.update({k: _coerce(by_name[k], v, path) for k, v in data.items()})
+    for name, field in by_name.items():
+        raw = environ.get(name.upper())
+        if raw is not None and raw != "":
+            values[name] = _coerce(field, raw, name.upper())
+    return replace(Settings(), **values)
+
+
+settings = load_settings()
+
+
+if __name__ == "__main__":
+    # In cấu hình đang có hiệu lực: python config.py
+    print(json.dumps(settings.as_dict(), ensure_ascii=False, indent=2))
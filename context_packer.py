@@ -0,0 +1,137 @@
+import re
+import unicodedata
+
+from langchain_core.documents import Document
+
+from config import settings
+from embedding_client import count_tokens
+
+# --- Cấu hình ---
+CONTEXT_TOKEN_BUDGET = settings.context_token_budget
+NEAR_DUP_THRESHOLD = settings.near_dup_threshold  # Jaccard trên shingle 5 từ
+MIN_OVERLAP_CHARS = 30
+# Truy hồi cha/con: trả về mục cha thay cho đoạn con khi nhiều đoạn con cùng cha được chọn,
+# hoặc khi mục cha đủ ngắn để thêm ngữ cảnh mà không tốn nhiều token
+PARENT_MERGE_MIN_CHILDREN = settings.parent_merge_min_children
+PARENT_EXPAND_MAX_TOKENS = settings.parent_expand_max_tokens
+
+
+def _shingles(text: str, n: int = 5):
+    text = unicodedata.normalize("NFD", text.lower())
+    text = "".join(c for c in text if unicodedata.category(c) != "Mn")
+    words = re.findall(r"\w+", text)
+    if len(words) < n:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + n]) for i in range(len(words) - n + 1)}
+
+
+def _overlap(a: str, b: str) -> int:
+    """Độ dài đoạn cuối của `a` trùng với đoạn đầu của `b` (do chunk_overlap của splitter)."""
+    probe = b[:MIN_OVERLAP_CHARS]
+    if len(probe) < MIN_OVERLAP_CHARS:
+        return 0
+    start = max(0, len(a) - len(b) - MIN_OVERLAP_CHARS)
+    pos = a.find(probe, start)
+    while pos != -1:
+        if b.startswith(a[pos:]):
+            return len(a) - pos
+        pos = a.find(probe, pos + 1)
+    return 0
+
+
+def _expand_parents(docs, parents=None):
+    """
+    Thay các đoạn con (có metadata "parent_id") bằng mục cha của chúng khi đáng, mỗi mục cha chỉ giữ một lần.
+    `parents(ids)` trả về {parent_id: nội dung} (kb_sync.ChunkIndex.parents); Knowledge Base dựng trước khi
+    có bảng mục cha vẫn giữ nội dung trong metadata "parent".
+    """
+    counts = {}
+    for doc in docs:
+        pid = doc.metadata.get("parent_id")
+        if pid:
+            counts[pid] = counts.get(pid, 0) + 1
+    stored = parents(list(counts)) if parents and counts else {}
+    expanded, seen = [], set()
+    for doc in docs:
+        pid = doc.metadata.get("parent_id")
+        parent = stored.get(pid) or doc.metadata.get("parent")
+        if not pid or not parent:
+            expanded.append(doc)
+            continue
+        if pid in seen:
+            continue
+        if counts[pid] >= PARENT_MERGE_MIN_CHILDREN or count_tokens(parent) <= PARENT_EXPAND_MAX_TOKENS:
+            seen.add(pid)
+            metadata = {k: v for k, v in doc.metadata.items() if k != "parent"}
+            expanded.append(Document(page_content=parent, metadata=metadata, id=doc.id))
+        else:
+            expanded.append(doc)
+    return expanded
+
+
+def _merge_adjacent(docs):
+    """Nối các đoạn liền kề của cùng file (đoạn sau bắt đầu bằng phần cuối đoạn trước)."""
+    merged = []
+    for doc in docs:
+        text, name = doc.page_content, doc.metadata.get("file_name")
+        for i, kept in enumerate(merged):
+            if name is None or kept.metadata.get("file_name") != name:
+                continue
+            if text in kept.page_content:
+                break
+            ov = _overlap(kept.page_content, text)
+            if ov:
+                merged[i] = Document(page_content=kept.page_content + text[ov:], metadata=kept.metadata, id=kept.id)
+                break
+            ov = _overlap(text, kept.page_content)
+            if ov:
+                merged[i] = Document(page_content=text + kept.page_content[ov:], metadata=kept.metadata, id=kept.id)
+                break
+        else:
+            merged.append(doc)
+    return merged
+
+
+def _drop_near_duplicates(docs, threshold=NEAR_DUP_THRESHOLD):
+    kept, kept_shingles = [], []
+    for doc in docs:
+        sh = _shingles(doc.page_content)
+        if any(len(sh & other) / (len(sh | other) or 1) >= threshold for other in kept_shingles):
+            continue
+        kept.append(doc)
+        kept_shingles.append(sh)
+    return kept
+
+
+def pack_context(docs, token_budget=CONTEXT_TOKEN_BUDGET, parents=None):
+    """
+    Ghép ngữ cảnh trước khi gọi LLM:
+    1. Đoạn con của bộ chia theo cấu trúc được thay bằng mục cha khi đáng (xem _expand_parents, `parents`).
+    2. Nối các đoạn chồng lấn liền kề của cùng file_name.
+    3. Bỏ các đoạn gần trùng (giữ đoạn xếp hạng cao hơn).
+    4. Lấy lần lượt theo độ liên quan cho tới khi hết ngân sách token.
+    Trả về (các Document đã ghép, thống kê token).
+    """
+    original_tokens = sum(count_tokens(d.page_content) for d in docs)
+    candidates = _drop_near_duplicates(_merge_adjacent(_expand_parents(docs, parents)))
+
+    packed, used = [], 0
+    for doc in candidates:
+        n = count_tokens(doc.page_content)
+        if used + n > token_budget and packed:  # luôn giữ ít nhất một đoạn
+            continue
+        packed.append(doc)
+        used += n
+
+    stats = {
+        "chunks_in": len(docs),
+        "chunks_out": len(packed),
+        "tokens_in": original_tokens,
+        "tokens_out": used,
+        "tokens_saved": original_tokens - used,
+    }
+    return packed, stats
+
+
+def format_context(docs):
+    return "\n\n".join(doc.page_content for doc in docs)
@@ -0,0 +1,174 @@
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+from config import Settings, settings
+from embedding_client import count_tokens
+from metrics import timed
+
+# --- Cấu hình ---
+MEMORY_WINDOW_TURNS = settings.memory_window_turns              # số lượt hỏi-đáp giữ nguyên văn
+MEMORY_TURN_MAX_TOKENS = settings.memory_turn_max_tokens        # cắt mỗi câu trả lời trong cửa sổ
+MEMORY_SUMMARY_MAX_TOKENS = settings.memory_summary_max_tokens
+MEMORY_MAX_SESSIONS = settings.memory_max_sessions
+MEMORY_SESSION_TTL = settings.memory_session_ttl                # giây không hoạt động thì bỏ phiên
+
+# Dấu hiệu câu hỏi nối tiếp: đại từ/chỉ từ thay cho chủ thể đã nói ở lượt trước
+FOLLOW_UP_MARKERS = re.compile(
+    r"\b(nó|đó|đấy|này|kia|vậy|họ|còn|thì sao|cái đó|ngành đó|trường đó)\b",
+    re.IGNORECASE,
+)
+# Từ để hỏi chỉ là dấu hiệu nối tiếp khi câu quá ngắn để tự có chủ thể ("bao nhiêu?", "ở đâu vậy?")
+FOLLOW_UP_QUESTION_WORDS = re.compile(r"\b(ở đâu|bao nhiêu|như thế nào|thế nào|khi nào)\b", re.IGNORECASE)
+FOLLOW_UP_MAX_WORDS = 5
+
+REWRITE_PROMPT = """Dựa vào cuộc trò chuyện dưới đây, hãy viết lại câu hỏi cuối của người dùng thành một câu hỏi
+đầy đủ, tự hiểu được mà không cần đọc lại cuộc trò chuyện (thay đại từ bằng đối tượng cụ thể).
+Chỉ trả về câu hỏi đã viết lại, không giải thích.
+
+Tóm tắt trước đó: {summary}
+
+Các lượt gần nhất:
+{window}
+
+Câu hỏi cuối: {question}
+Câu hỏi đầy đủ:"""
+
+SUMMARY_PROMPT = """Cập nhật bản tóm tắt cuộc trò chuyện giữa sinh viên và trợ lý PTIT bằng lượt hỏi-đáp mới.
+Giữ lại các đối tượng, ngành, mốc thời gian, con số người dùng đang quan tâm. Tối đa {max_words} từ.
+
+Tóm tắt hiện tại: {summary}
+
+Lượt mới:
+{turn}
+
+Tóm tắt mới:"""
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    if count_tokens(text) <= max_tokens:
+        return text
+    # Ước lượng theo tỉ lệ ký tự rồi cắt ở khoảng trắng gần nhất
+    cut = text[: max(1, len(text) * max_tokens // count_tokens(text))]
+    return cut.rsplit(" ", 1)[0] + "…"
+
+
+def needs_rewrite(question: str) -> bool:
+    """
+    Chỉ câu có đại từ/chỉ từ, hoặc câu rất ngắn chỉ gồm từ để hỏi, mới coi là câu hỏi nối tiếp;
+    câu ngắn nhưng đầy đủ ("Học phí ngành CNTT?") giữ nguyên, không tốn một lần gọi LLM.
+    """
+    if FOLLOW_UP_MARKERS.search(question):
+        return True
+    return len(question.split()) <= FOLLOW_UP_MAX_WORDS and bool(FOLLOW_UP_QUESTION_WORDS.search(question))
+
+
+class ConversationMemory:
+    """Bộ nhớ của một phiên: vài lượt gần nhất nguyên văn + một bản tóm tắt cập nhật dần cho phần cũ hơn."""
+
+    def __init__(self):
+        self.window = deque()
+        self.summary = ""
+        self.last_active = time.time()
+        self.lock = threading.Lock()
+        self.fold_lock = threading.Lock()  # mỗi phiên chỉ một lần gộp tóm tắt chạy tại một thời điểm
+
+    def render_window(self):
+        return "\n".join(f"Người dùng: {q}\nTrợ lý: {a}" for q, a in self.window)
+
+    @property
+    def empty(self):
+        return not self.window and not self.summary
+
+
+class SessionMemoryStore:
+    """
+    Bộ nhớ hội thoại theo phiên trình duyệt, giới hạn cả số phiên lẫn kích thước mỗi phiên:
+    - Phiên lâu không hoạt động (`memory_session_ttl`) hoặc vượt `memory_max_sessions` bị bỏ theo LRU.
+    - Mỗi phiên chỉ giữ `memory_window_turns` lượt (mỗi câu trả lời cắt còn `memory_turn_max_tokens`)
+      và một bản tóm tắt tối đa `memory_summary_max_tokens`, nên prompt không lớn dần theo độ dài cuộc trò chuyện.
+    Lượt cũ rời cửa sổ được gộp vào tóm tắt ở thread nền, không làm chậm câu trả lời.
+    Bộ nhớ chỉ nằm trong tiến trình (không lưu đĩa, không chia sẻ giữa các worker): chạy nhiều worker thì
+    câu hỏi nối tiếp rơi vào worker khác sẽ mất ngữ cảnh, và khởi động lại thì mọi phiên bắt đầu lại từ đầu.
+    """
+
+    def __init__(self, llm, config: Settings = settings, llm_limiter=None):
+        self.llm = llm
+        self.llm_slot = llm_limiter.slot if llm_limiter is not None else nullcontext  # chỉ cho lượt viết lại câu hỏi
+        self.max_sessions = config.memory_max_sessions
+        self.ttl = config.memory_session_ttl
+        self.window_turns = config.memory_window_turns
+        self.turn_max_tokens = config.memory_turn_max_tokens
+        self.summary_max_tokens = config.memory_summary_max_tokens
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._summarizer = ThreadPoolExecutor(max_workers=2, thread_name_prefix="memory-summary")
+        self.rewrites = 0
+        self.evicted = 0
+
+    def _get(self, session_id, create=False):
+        now = time.time()
+        with self._lock:
+            memory = self._sessions.get(session_id)
+            if memory is None and create:
+                memory = self._sessions[session_id] = ConversationMemory()
+            if memory is not None:
+                memory.last_active = now
+                self._sessions.move_to_end(session_id)
+            self._evict(now)
+            return memory
+
+    def _evict(self, now):
+        while self._sessions:
+            session_id, memory = next(iter(self._sessions.items()))
+            if len(self._sessions) <= self.max_sessions and now - memory.last_active <= self.ttl:
+                break
+            del self._sessions[session_id]
+            self.evicted += 1
+
+    def standalone_question(self, session_id, question):
+        """Viết lại câu hỏi nối tiếp thành câu hỏi độc lập để truy hồi; phiên mới hoặc câu đầy đủ thì giữ nguyên."""
+        memory = self._get(session_id)
+        if memory is None or memory.empty or not needs_rewrite(question):
+            return question
+        with memory.lock:
+            prompt = REWRITE_PROMPT.format(
+                summary=memory.summary or "(chưa có)", window=memory.render_window(), question=question
+            )
+        with self.llm_slot(), timed("rewrite_question"):
+            rewritten = self.llm.invoke(prompt).content.strip()
+        self.rewrites += 1
+        return rewritten.splitlines()[0].strip() if rewritten else question
+
+    def add_turn(self, session_id, question, answer):
+        memory = self._get(session_id, create=True)
+        with memory.lock:
+            memory.window.append((question, _truncate(answer, self.turn_max_tokens)))
+            overflow = []
+            while len(memory.window) > self.window_turns:
+                overflow.append(memory.window.popleft())
+        if overflow:
+            self._summarizer.submit(self._fold, memory, overflow)
+
+    def _fold(self, memory, turns):
+        turn_text = "\n".join(f"Người dùng: {q}\nTrợ lý: {a}" for q, a in turns)
+        with memory.fold_lock:
+            with memory.lock:
+                summary = memory.summary
+            try:
+                with timed("summarize_memory"):
+                    new_summary = self.llm.invoke(SUMMARY_PROMPT.format(
+                        summary=summary or "(chưa có)", turn=turn_text, max_words=self.summary_max_tokens // 2,
+                    )).content.strip()
+            except Exception as e:
+                print(f"⚠️ Lỗi khi tóm tắt hội thoại: {e}")
+                return
+            with memory.lock:
+                memory.summary = _truncate(new_summary, self.summary_max_tokens)
+
+    def stats(self):
+        with self._lock:
+            return {"sessions": len(self._sessions), "evicted": self.evicted, "rewrites": self.rewrites}
@@ -0,0 +1,141 @@
+import os
+
+from langchain_community.document_loaders import (
+    TextLoader, PyPDFLoader, Docx2txtLoader, CSVLoader
+)
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
+
+from config import settings
+from embedding_cache import compute_hash
+from structured_chunker import (
+    Block, CHILD_CHUNK_SIZE, PARENT_CHUNK_SIZE, chunk_blocks, extract_blocks, iter_block_groups
+)
+
+# --- Cấu hình ---
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+CHUNKER = settings.chunker  # "recursive" hoặc "structured" (theo heading/bảng/danh sách)
+# Ghi vào manifest: đổi bộ chia/kích thước thì các file được chia lại ở lần đồng bộ sau
+CHUNKER_ID = (f"structured-{CHILD_CHUNK_SIZE}-{PARENT_CHUNK_SIZE}" if CHUNKER == "structured"
+              else f"recursive-{CHUNK_SIZE}-{CHUNK_OVERLAP}")
+
+STREAM_BATCH_CHARS = settings.stream_batch_chars  # văn bản thô tối đa mỗi lô khi đọc dần file lớn
+
+text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+
+
+# === LOAD FILE ĐA ĐỊNH DẠNG ===
+def _make_loader(file_path: str):
+    ext = os.path.splitext(file_path)[1].lower()
+    if ext == ".txt":
+        return TextLoader(file_path, encoding="utf-8")
+    if ext == ".pdf":
+        return PyPDFLoader(file_path)
+    if ext == ".docx":
+        return Docx2txtLoader(file_path)
+    if ext == ".csv":
+        # Chỉ dùng nếu CSV chứa văn bản (không phải dữ liệu bảng)
+        return CSVLoader(file_path)
+    return None
+
+
+def load_text_from_file(file_path: str):
+    try:
+        loader = _make_loader(file_path)
+        if loader is None:
+            print(f"❌ Bỏ qua file không hỗ trợ: {file_path}")
+            return []
+        return loader.load()
+    except Exception as e:
+        print(f"⚠️ Lỗi đọc file {file_path}: {e}")
+        return []
+
+
+# === XỬ LÝ VĂN BẢN ===
+def split_documents(docs, filename: str):
+    """Chia nhỏ tài liệu của một file, gắn tên file và hash vào metadata từng đoạn"""
+    for d in docs:
+        d.metadata["file_name"] = filename
+    chunks = text_splitter.split_documents(docs) if docs else []
+    for c in chunks:
+        c.metadata["hash"] = compute_hash(c.page_content)
+    return chunks
+
+
+def _hash_chunks(chunks):
+    for c in chunks:
+        c.metadata["hash"] = compute_hash(c.page_content)
+    return chunks
+
+
+def parse_file(path: str):
+    """Đọc một file: danh sách Block khi dùng bộ chia theo cấu trúc và định dạng hỗ trợ, ngược lại danh sách Document"""
+    if CHUNKER == "structured":
+        blocks = extract_blocks(path)
+        if blocks is not None:
+            return blocks
+    return load_text_from_file(path)
+
+
+def split_parsed(parsed, filename: str):
+    """Chia nhỏ kết quả của parse_file"""
+    if not parsed or not isinstance(parsed[0], Block):
+        return split_documents(parsed, filename)
+    return _hash_chunks(chunk_blocks(parsed, filename))
+
+
+def load_and_split_file(path: str, filename: str):
+    """Đọc & chia nhỏ một file"""
+    return split_parsed(parse_file(path), filename)
+
+
+
+# === ĐỌC DẦN FILE LỚN ===
+def _iter_documents(path: str, max_chars: int):
+    """
+    PDF theo trang, CSV theo dòng (lazy_load của loader), TXT theo nhóm dòng ~max_chars ký tự:
+    cắt ở dòng trống, hoặc cắt cứng ở 2 * max_chars nếu file không có dòng trống (như structured_chunker).
+    """
+    if os.path.splitext(path)[1].lower() == ".txt":
+        lines, size = [], 0
+        with open(path, "r", encoding="utf-8") as f:
+            # readline có giới hạn: một dòng dài bất thường cũng chỉ đọc từng phần max_chars ký tự
+            for line in iter(lambda: f.readline(max_chars), ""):
+                lines.append(line)
+                size += len(line)
+                if (size >= max_chars and not line.strip()) or size >= 2 * max_chars:
+                    yield Document(page_content="".join(lines), metadata={"source": path})
+                    lines, size = [], 0
+        if lines:
+            yield Document(page_content="".join(lines), metadata={"source": path})
+        return
+    loader = _make_loader(path)
+    if loader is None:
+        print(f"❌ Bỏ qua file không hỗ trợ: {path}")
+        return
+    yield from loader.lazy_load()
+
+
+def iter_split_file(path: str, filename: str, max_chars: int = STREAM_BATCH_CHARS):
+    """
+    Đọc & chia nhỏ một file theo từng lô thay vì nạp cả file: mỗi lô ứng với khoảng `max_chars`
+    ký tự văn bản thô, nên file PDF hàng nghìn trang hay CSV hàng triệu dòng không làm tràn bộ nhớ.
+    Lỗi đọc file được ném ra cho nơi gọi (có thể đã xử lý xong một phần các lô).
+    """
+    if CHUNKER == "structured":
+        groups = iter_block_groups(path, max_chars)
+        if groups is not None:
+            headings = []
+            for blocks in groups:
+                yield _hash_chunks(chunk_blocks(blocks, filename, headings))
+            return
+    docs, size = [], 0
+    for doc in _iter_documents(path, max_chars):
+        docs.append(doc)
+        size += len(doc.page_content)
+        if size >= max_chars:
+            yield split_documents(docs, filename)
+            docs, size = [], 0
+    if docs:
+        yield split_documents(docs, filename)
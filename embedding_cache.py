@@ -0,0 +1,132 @@
+import hashlib
+import json
+import os
+import re
+import threading
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from config import settings
+
+# --- Cấu hình ---
+EMBEDDING_CACHE_DIR = settings.embedding_cache_dir
+
+
+def compute_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Cache embedding trên đĩa, khóa theo (model, hash của đoạn văn).
+    Mỗi model có một thư mục gồm:
+    - vectors.f32: ma trận float32 liên tục, chỉ ghi thêm, đọc qua memory-map.
+    - index.txt: mỗi dòng một hash, dòng thứ i ứng với hàng thứ i của ma trận.
+    - meta.json: số chiều của vector.
+    """
+
+    def __init__(self, model: str, cache_dir=EMBEDDING_CACHE_DIR):
+        self.model = model
+        self.dir = os.path.join(cache_dir, re.sub(r"[^\w.-]", "_", model))
+        os.makedirs(self.dir, exist_ok=True)
+        self.vectors_path = os.path.join(self.dir, "vectors.f32")
+        self.index_path = os.path.join(self.dir, "index.txt")
+        self.meta_path = os.path.join(self.dir, "meta.json")
+        self._lock = threading.Lock()
+        self._index = {}
+        self._rows = 0  # số hàng trong vectors.f32 (có thể lớn hơn len(_index) nếu index.txt có hash trùng)
+        self._dim = None
+        self._matrix = None
+        self._load()
+
+    def __len__(self):
+        return len(self._index)
+
+    def get_many(self, hashes):
+        """Trả về dict hash -> vector (list float) cho các hash đã có trong cache."""
+        with self._lock:
+            found = {h: self._index[h] for h in hashes if h in self._index}
+            if not found:
+                return {}
+            matrix = self._map()
+            return {h: matrix[row].tolist() for h, row in found.items()}
+
+    def put_many(self, items):
+        """Ghi thêm các cặp (hash, vector) chưa có trong cache."""
+        with self._lock:
+            new = [(h, v) for h, v in items if h not in self._index]
+            if not new:
+                return
+            if self._dim is None:
+                self._dim = len(new[0][1])
+                with open(self.meta_path, "w", encoding="utf-8") as f:
+                    json.dump({"model": self.model, "dim": self._dim}, f)
+            data = np.asarray([v for _, v in new], dtype=np.float32)
+            # Ghi vector trước, index sau: nếu sập giữa chừng thì index không trỏ tới dữ liệu thiếu
+            with open(self.vectors_path, "ab") as f:
+                f.write(data.tobytes())
+            with open(self.index_path, "a", encoding="utf-8") as f:
+                for h, _ in new:
+                    f.write(h + "\n")
+            for i, (h, _) in enumerate(new):
+                self._index[h] = self._rows + i
+            self._rows += len(new)
+            self._matrix = None
+
+    # --- Nội bộ ---
+    def _load(self):
+        if not os.path.exists(self.meta_path):
+            return
+        with open(self.meta_path, "r", encoding="utf-8") as f:
+            self._dim = json.load(f)["dim"]
+        size = os.path.getsize(self.vectors_path) if os.path.exists(self.vectors_path) else 0
+        lines = []
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                lines = f.readlines()
+        # Chỉ giữ các hàng có cả vector lẫn dòng index ghi trọn vẹn
+        hashes = [line.strip() for line in lines if line.endswith("\n")][: size // (4 * self._dim)]
+        self._rows = len(hashes)
+        # Sập giữa lúc ghi vector và ghi index để lại hàng thừa ở cuối file: cắt đi,
+        # nếu không các hàng ghi thêm sau này sẽ lệch số thứ tự so với index.txt
+        if size != self._rows * self._dim * 4:
+            with open(self.vectors_path, "r+b") as f:
+                f.truncate(self._rows * self._dim * 4)
+        if len(lines) != self._rows:
+            with open(self.index_path, "w", encoding="utf-8") as f:
+                f.writelines(h + "\n" for h in hashes)
+        for row, h in enumerate(hashes):
+            self._index.setdefault(h, row)
+
+    def _map(self):
+        if self._matrix is None:
+            rows = os.path.getsize(self.vectors_path) // (4 * self._dim)
+            self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(rows, self._dim))
+        return self._matrix
+
+
+class CachedEmbeddings(Embeddings):
+    """Bọc một model embedding, chỉ gọi API cho những đoạn văn chưa từng được embed."""
+
+    def __init__(self, underlying: Embeddings, model: str, cache_dir=EMBEDDING_CACHE_DIR):
+        self.underlying = underlying
+        self.cache = EmbeddingCache(model, cache_dir)
+
+    def embed_documents(self, texts):
+        hashes = [compute_hash(t) for t in texts]
+        cached = self.cache.get_many(hashes)
+        missing = {}
+        for h, t in zip(hashes, texts):
+            if h not in cached and h not in missing:
+                missing[h] = t
+        if missing:
+            print(f"🧮 Embed {len(missing)}/{len(texts)} đoạn (còn lại lấy từ cache).")
+            vectors = self.underlying.embed_documents(list(missing.values()))
+            fresh = list(zip(missing.keys(), vectors))
+            self.cache.put_many(fresh)
+            cached.update(fresh)
+        return [cached[h] for h in hashes]
+
+    def embed_query(self, text):
+        return self.underlying.embed_query(text)
@@ -0,0 +1,229 @@
+import asyncio
+import hashlib
+import math
+import random
+import re
+import threading
+import time
+import unicodedata
+
+from langchain_core.embeddings import Embeddings
+
+from config import settings
+
+# --- Cấu hình ---
+EMBEDDING_BACKEND = settings.embedding_backend  # "openai" hoặc "local"
+LOCAL_EMBEDDING_DIM = settings.local_embedding_dim
+LOCAL_EMBEDDING_LATENCY = settings.local_embedding_latency  # giây mỗi lần gọi
+EMBED_MAX_BATCH_TOKENS = settings.embed_max_batch_tokens
+EMBED_MAX_BATCH_SIZE = settings.embed_max_batch_size
+EMBED_CONCURRENCY = settings.embed_concurrency
+EMBED_MAX_RETRIES = settings.embed_max_retries
+
+
+# === ƯỚC LƯỢNG SỐ TOKEN ===
+_encoding = None
+
+def count_tokens(text: str) -> int:
+    """Đếm token bằng tiktoken nếu có, nếu không thì ước lượng theo số ký tự."""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return max(1, len(text) // 3)
+
+
+# === EMBEDDER CỤC BỘ (KHÔNG GỌI MẠNG) ===
+class HashEmbeddings(Embeddings):
+    """
+    Embedder tất định chạy cục bộ, dùng cho test/benchmark offline.
+    Băm từng từ (đã bỏ dấu) vào `dim` chiều có dấu +/-, rồi chuẩn hóa độ dài:
+    câu có nhiều từ chung sẽ có cosine cao.
+    """
+
+    def __init__(self, dim: int = LOCAL_EMBEDDING_DIM, latency: float = 0.0):
+        self.dim = dim
+        self.latency = latency  # giả lập độ trễ mạng (giây) mỗi lần gọi
+
+    def _embed(self, text: str):
+        text = unicodedata.normalize("NFD", text.lower())
+        text = "".join(c for c in text if unicodedata.category(c) != "Mn").replace("đ", "d")
+        vec = [0.0] * self.dim
+        for token in re.findall(r"\w+", text):
+            h = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+            vec[h % self.dim] += 1.0 if (h >> 63) & 1 else -1.0
+        norm = math.sqrt(sum(v * v for v in vec))
+        return [v / norm for v in vec] if norm else vec
+
+    def embed_documents(self, texts):
+        if self.latency:
+            time.sleep(self.latency)
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text):
+        if self.latency:
+            time.sleep(self.latency)
+        return self._embed(text)
+
+    async def aembed_documents(self, texts):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return [self._embed(t) for t in texts]
+
+    async def aembed_query(self, text):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._embed(text)
+
+
+def _is_rate_limit(e: Exception) -> bool:
+    return getattr(e, "status_code", None) == 429 or type(e).__name__ == "RateLimitError"
+
+
+def _is_transient(e: Exception) -> bool:
+    return _is_rate_limit(e) or type(e).__name__ in ("APIConnectionError", "APITimeoutError", "InternalServerError")
+
+
+class BatchedEmbeddings(Embeddings):
+    """
+    Lớp embedding gom lô và chạy song song cho quá trình nạp tri thức.
+    - Bỏ trùng các đoạn văn giống hệt nhau trong cùng một lần gọi.
+    - Gom đoạn văn thành lô giới hạn theo số token và số phần tử.
+    - Chạy tối đa `concurrency` lô cùng lúc bằng asyncio.
+    - Khi gặp 429: giảm một nửa số lô song song và chờ lùi theo cấp số nhân
+      (toàn bộ các lô cùng chờ); mỗi lô thành công lại tăng dần giới hạn lên.
+    - `on_batch(số đoạn)` (nếu đặt) được gọi sau mỗi lô embed thành công, dùng để báo tiến độ thật.
+    """
+
+    def __init__(self, underlying: Embeddings, max_batch_tokens: int = EMBED_MAX_BATCH_TOKENS,
+                 max_batch_size: int = EMBED_MAX_BATCH_SIZE, concurrency: int = EMBED_CONCURRENCY,
+                 max_retries: int = EMBED_MAX_RETRIES, on_batch=None):
+        self.underlying = underlying
+        self.on_batch = on_batch
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.rate_limited = 0  # tổng số lần bị 429, để theo dõi
+
+    # --- Chia lô ---
+    def make_batches(self, texts):
+        batches, current, current_tokens = [], [], 0
+        for text in texts:
+            n = count_tokens(text)
+            if current and (current_tokens + n > self.max_batch_tokens or len(current) >= self.max_batch_size):
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(text)
+            current_tokens += n
+        if current:
+            batches.append(current)
+        return batches
+
+    # --- Async ---
+    async def aembed_documents(self, texts):
+        unique = list(dict.fromkeys(texts))
+        if not unique:
+            return []
+        batches = self.make_batches(unique)
+
+        limit = [min(self.concurrency, len(batches))]
+        active = [0]
+        backoff_until = [0.0]
+        cond = asyncio.Condition()
+
+        async def run_batch(batch):
+            delay = 1.0
+            for attempt in range(self.max_retries + 1):
+                async with cond:
+                    await cond.wait_for(lambda: active[0] < limit[0])
+                    active[0] += 1
+                wait = backoff_until[0] - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                try:
+                    vectors = await self.underlying.aembed_documents(batch)
+                except Exception as e:
+                    async with cond:
+                        active[0] -= 1
+                        if _is_rate_limit(e):
+                            self.rate_limited += 1
+                            limit[0] = max(1, limit[0] // 2)
+                        cond.notify_all()
+                    if not _is_transient(e) or attempt == self.max_retries:
+                        raise
+                    pause = delay * (1 + random.random())
+                    backoff_until[0] = max(backoff_until[0], time.monotonic() + pause)
+                    delay = min(delay * 2, 60.0)
+                    continue
+                async with cond:
+                    active[0] -= 1
+                    limit[0] = min(self.concurrency, limit[0] + 1)
+                    cond.notify_all()
+                if self.on_batch is not None:
+                    self.on_batch(len(batch))
+                return vectors
+
+        results = await asyncio.gather(*(run_batch(b) for b in batches))
+        by_text = {}
+        for batch, vectors in zip(batches, results):
+            by_text.update(zip(batch, vectors))
+        return [by_text[t] for t in texts]
+
+    async def aembed_query(self, text):
+        return await self.underlying.aembed_query(text)
+
+    # --- Sync (dùng từ Chroma/rag_system) ---
+    def embed_documents(self, texts):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self.aembed_documents(texts))
+        # Đang ở trong event loop: asyncio.run không lồng được, nên chạy ở thread riêng
+        result = {}
+
+        def runner():
+            try:
+                result["value"] = asyncio.run(self.aembed_documents(texts))
+            except Exception as e:
+                result["error"] = e
+
+        t = threading.Thread(target=runner)
+        t.start()
+        t.join()
+        if "error" in result:
+            raise result["error"]
+        return result["value"]
+
+    def embed_query(self, text):
+        delay = 0.5
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self.underlying.embed_query(text)
+            except Exception as e:
+                if not _is_transient(e) or attempt == self.max_retries:
+                    raise
+                time.sleep(delay * (1 + random.random()))
+                delay = min(delay * 2, 10.0)
+
+
+# === FACTORY ===
+def embedding_cache_key(model: str) -> str:
+    """Khóa dùng cho cache embedding: embedder cục bộ không được dùng chung cache với OpenAI."""
+    return f"local-hash-{LOCAL_EMBEDDING_DIM}" if EMBEDDING_BACKEND == "local" else model
+
+
+def make_embeddings(model: str) -> BatchedEmbeddings:
+    """Tạo embedding theo EMBEDDING_BACKEND ("openai" mặc định, "local" cho test offline)."""
+    if EMBEDDING_BACKEND == "local":
+        backend = HashEmbeddings(latency=LOCAL_EMBEDDING_LATENCY)
+    else:
+        from langchain_openai import OpenAIEmbeddings
+        # Tắt retry của client để lớp gom lô tự điều tiết khi bị 429
+        backend = OpenAIEmbeddings(model=model, max_retries=0)
+    return BatchedEmbeddings(backend)
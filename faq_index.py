@@ -0,0 +1,323 @@
+import argparse
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+import numpy as np
+
+from answer_cache import normalize_question, read_version, write_version
+from config import settings
+
+# --- Cấu hình ---
+FAQ_INDEX_DB = settings.faq_index_db
+FAQ_VERSION_FILE = settings.faq_version_file  # đổi mỗi khi FAQ được dựng/sinh lại để các worker nạp lại
+FAQ_MIN_COUNT = settings.faq_min_count
+FAQ_MAX_ENTRIES = settings.faq_max_entries
+FAQ_MATCH_THRESHOLD = settings.faq_match_threshold
+FAQ_MIN_WORDS = 3           # bỏ lời chào, câu cụt
+FAQ_HISTORY_LIMIT = 50000   # số tin nhắn người dùng gần nhất dùng để khai thác
+
+# Câu hỏi phụ thuộc ngữ cảnh lượt trước ("còn nó thì sao?") không đứng một mình được, không đưa vào FAQ
+_CONTEXT_DEPENDENT = re.compile(r"\b(nó|đó|đấy|kia|họ|thì sao|cái đó|ngành đó|trường đó)\b", re.IGNORECASE)
+_ERROR_PREFIX = "Lỗi khi truy vấn RAG"
+_SELECT = ("SELECT id, question, variants, count, answer, source_ids, vector, embedding_key, generated_at "
+           "FROM faq ORDER BY count DESC")
+
+
+def _unit(vector):
+    vec = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else vec
+
+
+class FAQIndex:
+    """
+    Câu trả lời sinh trước cho các câu hỏi thường gặp, lưu trên SQLite và nạp vào bộ nhớ để tra O(1).
+    - Tra chính xác: mọi cách hỏi (đã chuẩn hóa) trong cụm trỏ tới cùng một câu trả lời (dict).
+    - Tra gần đúng: cosine giữa embedding câu hỏi và tâm cụm, trên ma trận tối đa FAQ_MAX_ENTRIES dòng.
+    - Mỗi câu trả lời nhớ ID các đoạn nguồn; `is_valid(source_ids)` do chatbot truyền vào, đoạn nguồn
+      không còn trong Knowledge Base thì không phục vụ (chờ tiến trình điều phối sinh lại).
+    - File FAQ_VERSION_FILE đổi thì nạp lại (dựng bằng CLI hoặc sinh lại ở tiến trình khác); file chỉ được
+      đọc lại tối đa mỗi `version_check_interval` giây và ngoài khóa, không phải ở mỗi câu hỏi.
+    """
+
+    def __init__(self, db_path=FAQ_INDEX_DB, embedding_key=None, threshold=FAQ_MATCH_THRESHOLD,
+                 version_file=FAQ_VERSION_FILE):
+        self.db_path = db_path
+        self.embedding_key = embedding_key
+        self.threshold = threshold
+        self.version_file = version_file
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS faq (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                question TEXT NOT NULL,
+                variants TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                answer TEXT NOT NULL,
+                source_ids TEXT NOT NULL,
+                vector BLOB,
+                embedding_key TEXT,
+                generated_at TEXT NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+        self._version = None
+        self._by_key = {}       # câu hỏi đã chuẩn hóa -> entry
+        self._entries = []
+        self._matrix = None     # tâm cụm đã chuẩn hóa, cùng thứ tự với _entries
+        self.requests = 0
+        self.hits_exact = 0
+        self.hits_semantic = 0
+        self.skipped_stale = 0
+
+    # --- Tra cứu ---
+    def lookup(self, question, is_valid=None):
+        """Tra chính xác theo câu hỏi đã chuẩn hóa. Mỗi câu hỏi gọi đúng một lần (dùng để đếm tỉ lệ phục vụ)."""
+        key = normalize_question(question)
+        self._check_version()
+        with self._lock:
+            self.requests += 1
+            entry = self._by_key.get(key)
+            if entry is None or not self._usable(entry, is_valid):
+                return None
+            self.hits_exact += 1
+            return entry["answer"]
+
+    def match(self, vector, is_valid=None):
+        """Tra gần đúng theo embedding câu hỏi (chỉ khi FAQ được dựng bằng cùng embedding)."""
+        with self._lock:
+            if self._matrix is None:
+                return None
+            scores = self._matrix @ _unit(vector)
+            best = int(np.argmax(scores))
+            entry = self._entries[best]
+            if scores[best] < self.threshold or not self._usable(entry, is_valid):
+                return None
+            self.hits_semantic += 1
+            return entry["answer"]
+
+    def _usable(self, entry, is_valid):
+        if is_valid is None or is_valid(entry["source_ids"]):
+            return True
+        self.skipped_stale += 1
+        return False
+
+    def stats(self):
+        with self._lock:
+            hits = self.hits_exact + self.hits_semantic
+            return {
+                "entries": len(self._entries),
+                "requests": self.requests,
+                "hits_exact": self.hits_exact,
+                "hits_semantic": self.hits_semantic,
+                "skipped_stale": self.skipped_stale,
+                "traffic_share": round(hits / self.requests, 4) if self.requests else 0.0,
+            }
+
+    # --- Ghi (CLI dựng FAQ, tiến trình điều phối sinh lại) ---
+    def all_entries(self):
+        with self._lock:
+            rows = self._conn.execute(_SELECT).fetchall()
+        return [self._row_to_entry(r) for r in rows]
+
+    def replace_all(self, entries):
+        """Thay toàn bộ FAQ bằng `entries` (dict: question, variants, count, answer, source_ids, vector)."""
+        now = datetime.now().isoformat()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.execute("DELETE FROM faq")
+            self._conn.executemany(
+                "INSERT INTO faq (question, variants, count, answer, source_ids, vector, embedding_key, generated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(e["question"], json.dumps(e["variants"], ensure_ascii=False), e["count"], e["answer"],
+                  json.dumps(e["source_ids"]), _unit(e["vector"]).tobytes() if e.get("vector") is not None else None,
+                  self.embedding_key, now) for e in entries],
+            )
+            self._conn.commit()
+        self._bump_version()
+
+    def update_answer(self, entry_id, answer, source_ids):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE faq SET answer = ?, source_ids = ?, generated_at = ? WHERE id = ?",
+                (answer, json.dumps(source_ids), datetime.now().isoformat(), entry_id),
+            )
+            self._conn.commit()
+
+    def publish(self):
+        """Báo cho mọi tiến trình nạp lại FAQ sau một loạt update_answer."""
+        self._bump_version()
+
+    # --- Nội bộ ---
+    def _bump_version(self):
+        write_version(self.version_file)
+
+    def _check_version(self):
+        version = read_version(self.version_file)
+        if version == self._version:
+            return
+        with self._lock:
+            if version != self._version:
+                self._load()
+                self._version = version
+
+    def _load(self):
+        rows = self._conn.execute(_SELECT).fetchall()
+        self._entries = [self._row_to_entry(r) for r in rows]
+        self._by_key = {}
+        for entry in self._entries:
+            for variant in entry["variants"]:
+                self._by_key.setdefault(variant, entry)
+        # Vector tạo bằng embedding khác (đổi model/backend) không so được với câu hỏi hiện tại
+        vectors = [e["vector"] for e in self._entries]
+        usable = bool(vectors) and all(v is not None for v in vectors) and all(
+            e["embedding_key"] == self.embedding_key for e in self._entries)
+        self._matrix = np.stack(vectors) if usable and self.embedding_key else None
+
+    @staticmethod
+    def _row_to_entry(row):
+        entry_id, question, variants, count, answer, source_ids, vector, embedding_key, generated_at = row
+        return {
+            "id": entry_id,
+            "question": question,
+            "variants": json.loads(variants),
+            "count": count,
+            "answer": answer,
+            "source_ids": json.loads(source_ids),
+            "vector": np.frombuffer(vector, dtype=np.float32) if vector else None,
+            "embedding_key": embedding_key,
+            "generated_at": generated_at,
+        }
+
+
+# === KHAI THÁC CÂU HỎI THƯỜNG GẶP TỪ LỊCH SỬ CHAT ===
+def mine_clusters(questions, embeddings, min_count=FAQ_MIN_COUNT, max_entries=FAQ_MAX_ENTRIES,
+                  threshold=FAQ_MATCH_THRESHOLD):
+    """
+    Gom câu hỏi trùng sau chuẩn hóa, embed mỗi câu một lần rồi gom cụm tham lam theo tần suất:
+    câu hỏi nhập vào cụm có tâm gần nhất nếu cosine >= `threshold`, nếu không thì mở cụm mới.
+    Trả về tối đa `max_entries` cụm được hỏi ít nhất `min_count` lần, cụm hỏi nhiều nhất trước.
+    """
+    counts, wordings = Counter(), {}
+    for text in questions:
+        text = " ".join(text.split())
+        key = normalize_question(text)
+        if len(key.split()) < FAQ_MIN_WORDS or _CONTEXT_DEPENDENT.search(text):
+            continue
+        counts[key] += 1
+        wordings.setdefault(key, Counter())[text] += 1
+    if not counts:
+        return []
+
+    keys = [k for k, _ in counts.most_common()]
+    vectors = np.stack([_unit(v) for v in embeddings.embed_documents([wordings[k].most_common(1)[0][0] for k in keys])])
+    clusters, sums = [], []
+    for key, vec in zip(keys, vectors):
+        if sums:
+            centroids = np.stack([_unit(s) for s in sums])
+            scores = centroids @ vec
+            best = int(np.argmax(scores))
+            if scores[best] >= threshold:
+                clusters[best]["variants"].append(key)
+                clusters[best]["count"] += counts[key]
+                sums[best] = sums[best] + vec * counts[key]
+                continue
+        # Câu hỏi đầu tiên của cụm là câu được hỏi nhiều nhất: dùng cách viết phổ biến nhất làm câu hỏi chuẩn
+        clusters.append({"question": wordings[key].most_common(1)[0][0], "variants": [key], "count": counts[key]})
+        sums.append(vec * counts[key])
+    for cluster, s in zip(clusters, sums):
+        cluster["vector"] = _unit(s)
+    frequent = [c for c in clusters if c["count"] >= min_count]
+    frequent.sort(key=lambda c: -c["count"])
+    return frequent[:max_entries]
+
+
+# === SINH CÂU TRẢ LỜI ===
+def _generate(chatbot, question):
+    """Câu trả lời có căn cứ (prompt của RAGChatbot) và ID đoạn nguồn; None nếu lỗi hoặc không có nguồn."""
+    try:
+        answer, docs = chatbot.answer_with_sources(question)
+    except Exception as e:
+        print(f"⚠️ Lỗi khi sinh câu trả lời FAQ cho '{question}': {e}")
+        return None, []
+    source_ids = [d.id for d in docs if d.id]
+    if not source_ids or answer.startswith(_ERROR_PREFIX):
+        return None, []
+    return answer, source_ids
+
+
+def build_faq(chatbot, history, faq, min_count=FAQ_MIN_COUNT, max_entries=FAQ_MAX_ENTRIES):
+    """Khai thác lịch sử chat, gom cụm, sinh trước câu trả lời cho từng cụm rồi thay toàn bộ FAQ."""
+    start = time.perf_counter()
+    clusters = mine_clusters(history.user_messages(FAQ_HISTORY_LIMIT), chatbot.embeddings,
+                             min_count, max_entries, faq.threshold)
+    print(f"🧩 {len(clusters)} cụm câu hỏi được hỏi từ {min_count} lần trở lên.")
+    entries = []
+    for i, cluster in enumerate(clusters, 1):
+        answer, source_ids = _generate(chatbot, cluster["question"])
+        if answer is None:
+            print(f"⚠️ Bỏ qua (không có nguồn): {cluster['question']}")
+            continue
+        entries.append({**cluster, "answer": answer, "source_ids": source_ids})
+        if i % 20 == 0:
+            print(f"⏳ Đã sinh {i}/{len(clusters)} câu trả lời...")
+    faq.replace_all(entries)
+    print(f"✅ FAQ có {len(entries)} câu trả lời sinh trước ({time.perf_counter() - start:.1f}s).")
+    return len(entries)
+
+
+def regenerate_stale(chatbot, faq, progress=None):
+    """
+    Sinh lại câu trả lời có đoạn nguồn không còn trong Knowledge Base (file bị sửa/xóa, dựng lại).
+    ID đoạn gồm hash nội dung nên đoạn bị sửa cũng đổi ID. Gọi sau mỗi lượt nạp tri thức.
+    """
+    chatbot.refresh_indexes()
+    stale = [e for e in faq.all_entries() if not chatbot.has_chunks(e["source_ids"])]
+    if not stale:
+        return 0
+    print(f"♻️ Sinh lại {len(stale)} câu trả lời FAQ có nguồn đã thay đổi...")
+    regenerated = 0
+    for entry in stale:
+        answer, source_ids = _generate(chatbot, entry["question"])
+        if answer is None:
+            # Không còn nguồn nào: giữ bản cũ, is_valid tiếp tục chặn nên không bị phục vụ
+            continue
+        faq.update_answer(entry["id"], answer, source_ids)
+        regenerated += 1
+        if progress:
+            progress("faq_regenerated", 1)
+    faq.publish()
+    print(f"✅ Đã sinh lại {regenerated}/{len(stale)} câu trả lời FAQ.")
+    return regenerated
+
+
+# === CLI ===
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Dựng / sinh lại FAQ từ lịch sử chat")
+    parser.add_argument("command", choices=["build", "refresh", "stats"],
+                        help="build: khai thác lịch sử và sinh lại toàn bộ; refresh: chỉ sinh lại câu có nguồn đổi; "
+                             "stats: liệt kê FAQ hiện có")
+    parser.add_argument("--min-count", type=int, default=FAQ_MIN_COUNT)
+    parser.add_argument("--max-entries", type=int, default=FAQ_MAX_ENTRIES)
+    args = parser.parse_args()
+
+    if args.command == "stats":
+        for e in FAQIndex().all_entries():
+            print(f"{e['count']:>6}  {e['question']}  ({len(e['variants'])} cách hỏi, {len(e['source_ids'])} nguồn)")
+    else:
+        from chat_history import ChatHistoryStore
+        from pipeline import build_chatbot
+        bot = build_chatbot()
+        if args.command == "build":
+            build_faq(bot, ChatHistoryStore(), bot.faq, args.min_count, args.max_entries)
+        else:
+            regenerate_stale(bot, bot.faq)
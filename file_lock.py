@@ -0,0 +1,82 @@
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class FileLock:
+    """
+    Khóa liên tiến trình dựa trên file (flock trên Linux/macOS, msvcrt.locking trên Windows).
+    - Cùng tiến trình: re-entrant theo thread (giống RLock), thread khác phải chờ.
+    - Khác tiến trình: chỉ một tiến trình giữ khóa; tiến trình chết thì hệ điều hành tự nhả khóa.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._rlock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def acquire(self, blocking=True):
+        if not self._rlock.acquire(blocking):
+            return False
+        if self._depth == 0:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if not _lock_fd(fd, blocking):
+                    os.close(fd)
+                    self._rlock.release()
+                    return False
+            except BaseException:
+                os.close(fd)
+                self._rlock.release()
+                raise
+            self._fd = fd
+        self._depth += 1
+        return True
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            _unlock_fd(self._fd)
+            os.close(self._fd)
+            self._fd = None
+        self._rlock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def _lock_fd(fd, blocking):
+    if fcntl is not None:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            return True
+        except BlockingIOError:
+            return False
+    mode = msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK
+    os.lseek(fd, 0, os.SEEK_SET)
+    while True:
+        try:
+            msvcrt.locking(fd, mode, 1)
+            return True
+        except OSError:
+            # LK_LOCK chỉ thử lại 10 lần rồi báo lỗi; khi chờ thì tiếp tục thử
+            if not blocking:
+                return False
+
+
+def _unlock_fd(fd):
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
@@ -0,0 +1,173 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from config import settings
+from file_lock import FileLock
+
+# --- Cấu hình ---
+JOBS_DB = settings.ingest_jobs_db
+POLL_INTERVAL = 1.0  # giây
+BATCH_WINDOW = 2.0  # chờ thêm để gom các upload liên tiếp vào cùng một lượt
+COORDINATOR_LOCK = settings.coordinator_lock
+JOB_KINDS = ("ingest", "rebuild", "faq")  # thứ tự chạy trong một lượt: nạp file mới, dựng lại, rồi sinh lại FAQ
+
+
+class IngestJobQueue:
+    """
+    Hàng đợi nạp tri thức chạy nền, lưu trên SQLite nên không mất khi khởi động lại.
+    - enqueue() trả về job_id ngay, /upload không phải chờ parse/embed.
+    - Worker gom mọi job đang chờ thành một lượt cập nhật (batch nhiều lần upload).
+    - Chạy nhiều worker (nhiều tiến trình): chỉ một tiến trình giữ khóa điều phối và thực thi job,
+      các tiến trình khác chỉ enqueue; tiến trình điều phối chết thì tiến trình khác tự nhận thay.
+    - Job đang chạy dở khi tiến trình điều phối chết sẽ được đưa lại vào hàng đợi.
+    """
+
+    def __init__(self, db_path=JOBS_DB, coordinator_lock=COORDINATOR_LOCK):
+        self.db_path = db_path
+        self.coordinator = FileLock(coordinator_lock)
+        self.is_coordinator = False
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                files TEXT NOT NULL,
+                kind TEXT NOT NULL DEFAULT 'ingest',
+                progress TEXT NOT NULL,
+                error TEXT,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            )
+            """
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        if "kind" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN kind TEXT NOT NULL DEFAULT 'ingest'")
+        self._conn.commit()
+
+    # --- API cho Flask ---
+    def enqueue(self, files, kind="ingest"):
+        job_id = uuid.uuid4().hex
+        now = datetime.now().isoformat()
+        progress = {"files_parsed": 0, "chunks_embedded": 0, "chunks_written": 0}
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, files, kind, progress, created_at, updated_at) "
+                "VALUES (?, 'queued', ?, ?, ?, ?, ?)",
+                (job_id, json.dumps(files, ensure_ascii=False), kind, json.dumps(progress), now, now),
+            )
+            self._conn.commit()
+        self._wakeup.set()
+        return job_id
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, status, files, progress, error, created_at, updated_at, kind FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "job_id": row[0],
+            "status": row[1],
+            "files": json.loads(row[2]),
+            "progress": json.loads(row[3]),
+            "error": row[4],
+            "created_at": row[5],
+            "updated_at": row[6],
+            "kind": row[7],
+        }
+
+    # --- Worker ---
+    def start(self, runners):
+        """
+        Chạy worker nền. `runners` là {loại_job: runner}; `runner(progress)` thực hiện một lượt cập nhật
+        tri thức, gọi progress(tên_bộ_đếm, số_lượng) mỗi khi xử lý xong một phần.
+        Worker chỉ thực thi job khi tiến trình này giành được khóa điều phối.
+        """
+        if self._thread is not None:
+            return
+        if callable(runners):
+            runners = {"ingest": runners}
+        self._thread = threading.Thread(target=self._loop, args=(runners,), daemon=True, name="ingest-worker")
+        self._thread.start()
+
+    def _become_coordinator(self):
+        if self.is_coordinator:
+            return True
+        if not self.coordinator.acquire(blocking=False):
+            return False
+        self.is_coordinator = True
+        # Vừa nhận quyền điều phối: job "running" còn sót lại là của tiến trình điều phối trước đã chết
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET status = 'queued' WHERE status = 'running'")
+            self._conn.commit()
+        print(f"👑 Tiến trình {os.getpid()} nhận vai trò điều phối nạp tri thức.")
+        return True
+
+    def _loop(self, runners):
+        while True:
+            if self._wakeup.wait(POLL_INTERVAL):
+                time.sleep(BATCH_WINDOW)
+            self._wakeup.clear()
+            if not self._become_coordinator():
+                continue
+            for kind in JOB_KINDS:
+                batch = self._claim_queued(kind)
+                if batch:
+                    self._run_batch(batch, runners[kind])
+
+    def _claim_queued(self, kind):
+        """Nhận mọi job đang chờ của một loại một cách nguyên tử (an toàn khi có nhiều tiến trình)."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            ids = [r[0] for r in self._conn.execute(
+                "SELECT id FROM jobs WHERE status = 'queued' AND kind = ? ORDER BY created_at", (kind,)
+            )]
+            if ids:
+                self._conn.executemany(
+                    "UPDATE jobs SET status = 'running', updated_at = ? WHERE id = ?",
+                    [(datetime.now().isoformat(), i) for i in ids],
+                )
+            self._conn.commit()
+        return ids
+
+    def _run_batch(self, ids, runner):
+        counters = {"files_parsed": 0, "chunks_embedded": 0, "chunks_written": 0}
+        last_flush = [0.0]
+
+        def progress(name, n=1):
+            counters[name] = counters.get(name, 0) + n
+            # Ghi tiến độ tối đa 2 lần/giây để không làm chậm quá trình nạp
+            if time.monotonic() - last_flush[0] > 0.5:
+                last_flush[0] = time.monotonic()
+                self._update(ids, "running", counters)
+
+        print(f"⏳ Bắt đầu nạp tri thức cho {len(ids)} job...")
+        try:
+            runner(progress)
+            self._update(ids, "done", counters)
+            print(f"✅ Hoàn tất {len(ids)} job nạp tri thức.")
+        except Exception as e:
+            self._update(ids, "failed", counters, str(e))
+            print(f"⚠️ Lỗi khi nạp tri thức: {e}")
+
+    def _update(self, ids, status, progress, error=None):
+        now = datetime.now().isoformat()
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE jobs SET status = ?, progress = ?, error = ?, updated_at = ? WHERE id = ?",
+                [(status, json.dumps(progress), error, now, i) for i in ids],
+            )
+            self._conn.commit()
@@ -0,0 +1,157 @@
+import gc
+import multiprocessing
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import contextmanager
+
+from config import settings
+from doc_loader import parse_file, split_parsed
+from metrics import observe_stage
+
+# --- Cấu hình ---
+INGEST_WORKERS = settings.ingest_workers or (os.cpu_count() or 1)
+STREAM_INGEST_MIN_MB = settings.stream_ingest_min_mb      # file từ cỡ này (và mọi CSV) được đọc dần
+INGEST_MEMORY_LIMIT_MB = settings.ingest_memory_limit_mb  # trần RSS khi nạp tri thức, 0 = không giới hạn
+
+# Tiến trình con của pool: trên POSIX dùng forkserver (fork từ một tiến trình sạch đã nạp sẵn doc_loader và
+# các thư viện đọc PDF/DOCX, không phải import lại cho từng con); không dùng fork trực tiếp vì tiến trình web
+# có nhiều thread đang giữ khóa. Windows chỉ có spawn. Với cả hai cách, module __main__ vẫn được chạy lại
+# trong mỗi con dưới tên __mp_main__, nên script chính phải để side effect sau guard (xem cuối app.py).
+POOL_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+
+class StageTimer:
+    """Cộng dồn thời gian (giây) của từng giai đoạn nạp tri thức, đồng thời ghi vào /metrics."""
+
+    def __init__(self):
+        self.totals = defaultdict(float)
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        self.totals[name] += seconds
+        observe_stage(name, seconds, metric="ptit_ingest_stage_seconds")
+
+    def report(self):
+        return " | ".join(f"{name}: {sec:.2f}s" for name, sec in self.totals.items())
+
+
+def rss_mb():
+    """Bộ nhớ thường trú hiện tại của tiến trình (MB), None nếu hệ điều hành không cho đọc (/proc chỉ có trên Linux)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1 << 20)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class MemoryGuard:
+    """
+    Trần bộ nhớ cho việc nạp tri thức: kiểm tra sau mỗi file/lô, vượt trần thì thu gom rác rồi kiểm tra lại,
+    vẫn vượt thì dừng bằng MemoryError. Các lô đã ghi được giữ theo checkpoint nên lần chạy sau đi tiếp.
+    """
+
+    def __init__(self, limit_mb: int = INGEST_MEMORY_LIMIT_MB):
+        self.limit_mb = limit_mb
+        self.peak_mb = 0.0
+
+    def check(self, context: str = ""):
+        rss = rss_mb()
+        if rss is None:
+            return
+        self.peak_mb = max(self.peak_mb, rss)
+        if not self.limit_mb or rss <= self.limit_mb:
+            return
+        gc.collect()
+        rss = rss_mb()
+        if rss > self.limit_mb:
+            raise MemoryError(
+                f"Bộ nhớ nạp tri thức {rss:.0f} MB vượt INGEST_MEMORY_LIMIT_MB={self.limit_mb} ({context}). "
+                "Giảm STREAM_BATCH_CHARS/WRITE_BATCH_SIZE hoặc STREAM_INGEST_MIN_MB rồi chạy lại."
+            )
+
+
+def should_stream(path: str) -> bool:
+    """File lớn và CSV (mỗi dòng một Document) được đọc theo trang/dòng thay vì nạp cả file."""
+    if os.path.splitext(path)[1].lower() == ".csv":
+        return True
+    return os.path.getsize(path) >= STREAM_INGEST_MIN_MB * (1 << 20)
+
+
+def partition_stream_files(files):
+    """Tách (file đọc dần ở tiến trình chính, file nhỏ đọc song song trên pool)."""
+    streamed, pooled = [], []
+    for filename, path in files:
+        (streamed if should_stream(path) else pooled).append((filename, path))
+    return streamed, pooled
+
+
+def list_doc_files(docs_dir: str):
+    """Liệt kê (tên file, đường dẫn) một lần duy nhất để danh sách xử lý nhất quán."""
+    if not os.path.exists(docs_dir):
+        return []
+    files = []
+    for filename in sorted(os.listdir(docs_dir)):
+        path = os.path.join(docs_dir, filename)
+        if os.path.isfile(path):
+            files.append((filename, path))
+    return files
+
+
+def _parse_and_split(filename: str, path: str):
+    """Chạy trong tiến trình con: đọc + chia nhỏ một file, đo thời gian từng bước."""
+    t0 = time.perf_counter()
+    parsed = parse_file(path)
+    t1 = time.perf_counter()
+    chunks = split_parsed(parsed, filename)
+    t2 = time.perf_counter()
+    return filename, path, chunks, t1 - t0, t2 - t1
+
+
+def iter_file_chunks(files, workers: int = INGEST_WORKERS, timer: StageTimer = None):
+    """
+    Đọc và chia nhỏ các file song song trên nhiều tiến trình,
+    yield (tên file, đường dẫn, các đoạn) ngay khi từng file xong.
+    Số file đang xử lý cùng lúc bị giới hạn nên bộ nhớ không tăng theo kích thước kho tài liệu.
+    """
+    timer = timer or StageTimer()
+    files = list(files)
+    if workers <= 1 or len(files) <= 1:
+        for filename, path in files:
+            name, p, chunks, parse_s, split_s = _parse_and_split(filename, path)
+            timer.add("parse", parse_s)
+            timer.add("split", split_s)
+            yield name, p, chunks
+        return
+
+    max_in_flight = workers * 2
+    pending = iter(files)
+    ctx = multiprocessing.get_context(POOL_START_METHOD)
+    if POOL_START_METHOD == "forkserver":
+        ctx.set_forkserver_preload(["ingest_pipeline", "doc_loader"])
+    with ProcessPoolExecutor(max_workers=min(workers, len(files)), mp_context=ctx) as pool:
+        in_flight = set()
+        for filename, path in pending:
+            in_flight.add(pool.submit(_parse_and_split, filename, path))
+            if len(in_flight) >= max_in_flight:
+                break
+        while in_flight:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                name, p, chunks, parse_s, split_s = future.result()
+                # Thời gian parse/split là tổng CPU trên các tiến trình con
+                timer.add("parse", parse_s)
+                timer.add("split", split_s)
+                nxt = next(pending, None)
+                if nxt is not None:
+                    in_flight.add(pool.submit(_parse_and_split, *nxt))
+                yield name, p, chunks
+
@@ -0,0 +1,379 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+from config import settings
+from doc_loader import CHUNKER_ID, STREAM_BATCH_CHARS
+from embedding_cache import compute_hash
+from structured_chunker import pop_parents
+
+# --- Cấu hình ---
+MANIFEST_FILE = "sync_manifest.json"
+CHUNK_INDEX_FILE = "chunk_index.sqlite3"
+WRITE_BATCH_SIZE = settings.write_batch_size  # số đoạn embed + ghi vào Chroma mỗi lô
+LEGACY_CHUNKER_ID = "recursive-1000-200"  # manifest cũ chưa ghi bộ chia
+
+
+def manifest_path_for(db_path: str) -> str:
+    """Manifest nằm cạnh dữ liệu Chroma để luôn đi cùng Knowledge Base."""
+    return os.path.join(db_path, MANIFEST_FILE)
+
+
+def open_chunk_index(db_path: str) -> "ChunkIndex":
+    """Chỉ mục đoạn của một thư mục Knowledge Base (chatbot dùng để tra mục cha)."""
+    return ChunkIndex(os.path.join(db_path, CHUNK_INDEX_FILE))
+
+
+def file_fingerprint(path: str):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+def file_content_hash(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def stream_signature(path: str) -> str:
+    """Checkpoint chỉ dùng lại được khi nội dung file và cách chia lô không đổi."""
+    return f"{file_content_hash(path)}:{CHUNKER_ID}:{STREAM_BATCH_CHARS}"
+
+
+def make_chunk_ids(file_name: str, chunks):
+    """
+    ID ổn định cho từng đoạn: hash(tên file) + hash(nội dung) (+ số thứ tự nếu trùng trong file).
+    Đoạn không đổi giữ nguyên ID, nên sửa một file chỉ thêm/xóa những đoạn thực sự thay đổi.
+    """
+    prefix = compute_hash(file_name)[:16]
+    ids, seen = [], {}
+    for chunk in chunks:
+        h = chunk.metadata.get("hash") or compute_hash(chunk.page_content)
+        chunk.metadata["hash"] = h
+        n = seen.get(h, 0)
+        seen[h] = n + 1
+        ids.append(f"{prefix}-{h[:32]}" + (f"-{n}" if n else ""))
+    return ids
+
+
+def _id_hash(chunk_id: str) -> str:
+    """Phần hash nội dung (32 ký tự hex) trong chunk ID."""
+    return chunk_id.split("-")[1]
+
+
+class ChunkIndex:
+    """
+    Chỉ mục đoạn trên đĩa (SQLite, WAL) nằm cạnh manifest, đi cùng từng phiên bản Knowledge Base:
+    - chunks: chunk ID -> file nguồn, hash nội dung. Kiểm tra trùng lặp theo hash mà không phải
+      tải metadata từ Chroma, và danh sách đoạn của file lớn không phải giữ trong bộ nhớ.
+    - checkpoints: số lô đã ghi của file đang nạp dở, để lần chạy sau tiếp tục thay vì làm lại từ đầu.
+    - parents: parent_id -> nội dung mục cha của bộ chia theo cấu trúc, lưu một lần thay vì lặp lại
+      trong metadata của từng đoạn con. Mục cha là nội dung bất biến (ID là hash) nên không bị xóa
+      theo file; dựng lại Knowledge Base (phiên bản mới) sẽ bỏ các mục cha không còn dùng.
+    Cột `run` đánh dấu lần nạp gần nhất chạm tới mỗi đoạn; đoạn không được chạm là đoạn cũ cần xóa.
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS chunks (
+                chunk_id TEXT PRIMARY KEY,
+                file_name TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                run INTEGER NOT NULL DEFAULT 0
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_hash ON chunks (hash)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_file ON chunks (file_name, run)")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS checkpoints (
+                file_name TEXT PRIMARY KEY,
+                signature TEXT NOT NULL,
+                batches_done INTEGER NOT NULL,
+                run INTEGER NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS parents (parent_id TEXT PRIMARY KEY, text TEXT NOT NULL)")
+        self._conn.commit()
+
+    def _select_in(self, sql, values, params=(), batch_size=500):
+        """Chạy `sql` (chứa {marks}) theo từng lô giá trị để không vượt giới hạn tham số của SQLite."""
+        rows = []
+        for i in range(0, len(values), batch_size):
+            batch = values[i:i + batch_size]
+            marks = ",".join("?" * len(batch))
+            rows.extend(self._conn.execute(sql.format(marks=marks), (*batch, *params)).fetchall())
+        return rows
+
+    # --- Đoạn ---
+    def file_ids(self, name: str):
+        with self._lock:
+            return {r[0] for r in self._conn.execute("SELECT chunk_id FROM chunks WHERE file_name = ?", (name,))}
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def runs_of(self, chunk_ids):
+        """dict chunk ID -> run cho các ID đã có trong chỉ mục."""
+        with self._lock:
+            return dict(self._select_in("SELECT chunk_id, run FROM chunks WHERE chunk_id IN ({marks})", list(chunk_ids)))
+
+    def existing_hashes(self, hashes, exclude_file: str = None):
+        """Các hash (so theo 32 ký tự đầu, như trong chunk ID) đã có trong file khác `exclude_file`."""
+        prefixes = list({h[:32] for h in hashes})
+        with self._lock:
+            rows = self._select_in(
+                "SELECT DISTINCT hash FROM chunks WHERE hash IN ({marks}) AND file_name != ?",
+                prefixes, (exclude_file or "",),
+            )
+        return {r[0] for r in rows}
+
+    def put(self, name: str, chunk_ids, run: int = 0):
+        with self._lock:
+            self._put(name, chunk_ids, run)
+            self._conn.commit()
+
+    def _put(self, name, chunk_ids, run):
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO chunks (chunk_id, file_name, hash, run) VALUES (?, ?, ?, ?)",
+            [(cid, name, _id_hash(cid), run) for cid in chunk_ids],
+        )
+
+    def delete(self, chunk_ids):
+        with self._lock:
+            ids = list(chunk_ids)
+            for i in range(0, len(ids), 500):
+                batch = ids[i:i + 500]
+                self._conn.execute(f"DELETE FROM chunks WHERE chunk_id IN ({','.join('?' * len(batch))})", batch)
+            self._conn.commit()
+
+    def iter_stale_ids(self, name: str, run: int = None, batch_size: int = 1000):
+        """
+        Lần lượt từng lô chunk ID của file không thuộc lần nạp `run` (mọi đoạn của file nếu run=None).
+        Nơi gọi phải xóa lô vừa nhận khỏi chỉ mục trước khi lấy lô tiếp theo.
+        """
+        while True:
+            with self._lock:
+                if run is None:
+                    rows = self._conn.execute(
+                        "SELECT chunk_id FROM chunks WHERE file_name = ? LIMIT ?", (name, batch_size)
+                    ).fetchall()
+                else:
+                    rows = self._conn.execute(
+                        "SELECT chunk_id FROM chunks WHERE file_name = ? AND run != ? LIMIT ?", (name, run, batch_size)
+                    ).fetchall()
+            if not rows:
+                return
+            yield [r[0] for r in rows]
+
+    # --- Mục cha ---
+    def put_parents(self, parents):
+        with self._lock:
+            self._conn.executemany("INSERT OR IGNORE INTO parents (parent_id, text) VALUES (?, ?)", parents.items())
+            self._conn.commit()
+
+    def parents(self, parent_ids):
+        """dict parent_id -> nội dung mục cha cho các ID đã lưu."""
+        with self._lock:
+            return dict(self._select_in("SELECT parent_id, text FROM parents WHERE parent_id IN ({marks})",
+                                        list(parent_ids)))
+
+    # --- Checkpoint ---
+    def next_run(self) -> int:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MAX(r) FROM (SELECT MAX(run) AS r FROM chunks UNION ALL SELECT MAX(run) FROM checkpoints)"
+            ).fetchone()
+        return (row[0] or 0) + 1
+
+    def checkpoint(self, name: str):
+        """(signature, số lô đã ghi, run) của file đang nạp dở, hoặc None."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT signature, batches_done, run FROM checkpoints WHERE file_name = ?", (name,)
+            ).fetchone()
+
+    def commit_batch(self, name: str, chunk_ids, run: int, signature: str, batches_done: int):
+        """Đánh dấu các đoạn của một lô và tiến checkpoint trong cùng một transaction."""
+        with self._lock:
+            self._put(name, chunk_ids, run)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO checkpoints (file_name, signature, batches_done, run) VALUES (?, ?, ?, ?)",
+                (name, signature, batches_done, run),
+            )
+            self._conn.commit()
+
+    def clear_checkpoint(self, name: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM checkpoints WHERE file_name = ?", (name,))
+            self._conn.commit()
+
+
+class SyncManifest:
+    """
+    Manifest các file nguồn đã nạp vào Knowledge Base.
+    Mỗi file: size, mtime, hash nội dung và bộ chia đã dùng; danh sách chunk ID nằm trong ChunkIndex.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.exists = os.path.exists(path)
+        self.files = {}
+        self.chunks = ChunkIndex(os.path.join(os.path.dirname(path), CHUNK_INDEX_FILE))
+        if self.exists:
+            with open(path, "r", encoding="utf-8") as f:
+                self.files = json.load(f).get("files", {})
+            # Manifest cũ giữ chunk_ids trong JSON: chuyển sang chỉ mục trên đĩa một lần
+            for name, entry in self.files.items():
+                if "chunk_ids" in entry:
+                    self.chunks.put(name, entry.pop("chunk_ids"))
+
+    def is_unchanged(self, name: str, path: str) -> bool:
+        """So size + mtime trước (rẻ), chỉ hash nội dung khi cần."""
+        entry = self.files.get(name)
+        if not entry or entry.get("chunker", LEGACY_CHUNKER_ID) != CHUNKER_ID:
+            return False
+        size, mtime = file_fingerprint(path)
+        if entry["size"] == size and entry["mtime"] == mtime:
+            return True
+        if entry["size"] == size and entry["content_hash"] == file_content_hash(path):
+            entry["mtime"] = mtime  # chỉ bị "touch", nội dung không đổi
+            return True
+        return False
+
+    def record(self, name: str, path: str):
+        size, mtime = file_fingerprint(path)
+        self.files[name] = {
+            "size": size,
+            "mtime": mtime,
+            "content_hash": file_content_hash(path),
+            "chunker": CHUNKER_ID,
+        }
+
+    def forget(self, name: str):
+        return self.files.pop(name, None)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"files": self.files}, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+        self.exists = True
+
+
+class SourceReadError(Exception):
+    """Lỗi khi đọc/parse file nguồn (khác với lỗi embed hoặc ghi vào Chroma)."""
+
+
+def _read_batches(batches):
+    """Chuyển lỗi phát sinh trong lúc đọc các lô thành SourceReadError để nơi gọi phân biệt được."""
+    it = iter(batches)
+    while True:
+        try:
+            chunks = next(it)
+        except StopIteration:
+            return
+        except Exception as e:
+            raise SourceReadError(str(e)) from e
+        yield chunks
+
+
+# === ÁP DỤNG THAY ĐỔI CỦA MỘT FILE ===
+def _write(vector_store, index: ChunkIndex, pairs, batch_size):
+    for i in range(0, len(pairs), batch_size):
+        batch = pairs[i:i + batch_size]
+        # Mục cha ghi trước đoạn con để đoạn con đã có trong Chroma luôn tra được mục cha
+        parents = pop_parents([c for _, c in batch])
+        if parents:
+            index.put_parents(parents)
+        vector_store.add_documents([c for _, c in batch], ids=[cid for cid, _ in batch])
+
+
+def apply_file_chunks(vector_store, manifest: SyncManifest, name: str, path: str, chunks,
+                      batch_size: int = WRITE_BATCH_SIZE):
+    """Thay các đoạn của một file bằng `chunks`. Trả về (số đoạn thêm, số đoạn xóa)."""
+    new_ids = make_chunk_ids(name, chunks)
+    old_ids = manifest.chunks.file_ids(name)
+
+    to_delete = list(old_ids - set(new_ids))
+    to_add = [(cid, c) for cid, c in zip(new_ids, chunks) if cid not in old_ids]
+
+    if to_delete:
+        vector_store.delete(ids=to_delete)
+        manifest.chunks.delete(to_delete)
+    _write(vector_store, manifest.chunks, to_add, batch_size)
+    manifest.chunks.put(name, new_ids)
+    manifest.record(name, path)
+    return len(to_add), len(to_delete)
+
+
+def apply_file_stream(vector_store, manifest: SyncManifest, name: str, path: str, batches, signature: str,
+                      skip_duplicates: bool = False, on_batch=None, batch_size: int = WRITE_BATCH_SIZE):
+    """
+    Như apply_file_chunks nhưng nhận các đoạn theo từng lô (doc_loader.iter_split_file), ghi từng lô vào Chroma
+    rồi lưu checkpoint. Chạy lại với cùng `signature` (hash nội dung + cách chia) thì bỏ qua các lô đã ghi.
+    - Đoạn đã có của chính file này được giữ nguyên; đoạn cũ không còn xuất hiện bị xóa khi file nạp xong.
+    - `skip_duplicates=True`: bỏ các đoạn có nội dung đã tồn tại trong file khác (dùng cho file upload).
+    - `on_batch(số đoạn thêm)` được gọi sau mỗi lô (tiến độ, kiểm tra bộ nhớ).
+    Lỗi đọc file được ném ra dưới dạng SourceReadError; lỗi embed/ghi giữ nguyên kiểu và checkpoint
+    vẫn trỏ tới lô cuối đã ghi xong. Trả về (số đoạn thêm, số đoạn xóa).
+    """
+    index = manifest.chunks
+    checkpoint = index.checkpoint(name)
+    if checkpoint and checkpoint[0] == signature:
+        _, done, run = checkpoint
+        print(f"⏯️ {name}: tiếp tục từ lô {done + 1} (checkpoint)")
+    else:
+        done, run = 0, index.next_run()
+
+    added = 0
+    for i, chunks in enumerate(_read_batches(batches)):
+        if i < done:
+            continue
+        ids = make_chunk_ids(name, chunks)
+        runs = index.runs_of(ids)
+        # ID đã gặp trong lần nạp này = đoạn trùng nội dung với một lô trước của cùng file
+        fresh = [(cid, c) for cid, c in zip(ids, chunks) if cid not in runs]
+        if skip_duplicates and fresh:
+            dup = index.existing_hashes([_id_hash(cid) for cid, _ in fresh], name)
+            fresh = [(cid, c) for cid, c in fresh if _id_hash(cid) not in dup]
+        _write(vector_store, index, fresh, batch_size)
+        keep = [cid for cid in ids if cid in runs] + [cid for cid, _ in fresh]
+        index.commit_batch(name, keep, run, signature, i + 1)
+        added += len(fresh)
+        if on_batch:
+            on_batch(len(fresh))
+
+    deleted = 0
+    for stale in index.iter_stale_ids(name, run):
+        vector_store.delete(ids=stale)
+        index.delete(stale)
+        deleted += len(stale)
+    index.clear_checkpoint(name)
+    manifest.record(name, path)
+    return added, deleted
+
+
+def remove_file_chunks(vector_store, manifest: SyncManifest, name: str):
+    manifest.forget(name)
+    manifest.chunks.clear_checkpoint(name)
+    removed = 0
+    for ids in manifest.chunks.iter_stale_ids(name):
+        vector_store.delete(ids=ids)
+        manifest.chunks.delete(ids)
+        removed += len(ids)
+    return removed
@@ -0,0 +1,82 @@
+import os
+import shutil
+import time
+
+# --- Cấu hình ---
+KB_POINTER = "CURRENT"   # file chứa tên thư mục phiên bản đang phục vụ
+KEEP_KB_VERSIONS = 2     # giữ bản trước đó cho các request/tiến trình còn đang đọc
+
+
+def resolve_kb_path(root: str) -> str:
+    """
+    Đường dẫn Chroma đang phục vụ bên trong `root`.
+    `root/CURRENT` trỏ tới một thư mục phiên bản; chưa có con trỏ (DB kiểu cũ) thì dùng chính `root`.
+    """
+    try:
+        with open(os.path.join(root, KB_POINTER), "r", encoding="utf-8") as f:
+            name = f.read().strip()
+    except OSError:
+        return root
+    return os.path.join(root, name) if name else root
+
+
+def new_kb_version(root: str, seed_from: str = None) -> str:
+    """
+    Tạo thư mục phiên bản mới nằm cạnh bản đang chạy (chưa được phục vụ cho tới khi kích hoạt).
+    `seed_from`: sao chép dữ liệu của phiên bản đó (Chroma, sync_manifest.json, chunk_index.sqlite3) sang trước,
+    để lần đồng bộ tiếp theo chỉ áp dụng các file đã đổi thay vì đọc và embed lại cả kho.
+    Bản sao được ghi vào thư mục tạm rồi mới đổi tên, nên sập giữa chừng không để lại phiên bản thiếu dữ liệu.
+    """
+    path = os.path.join(root, f"v{time.time_ns()}")
+    if not seed_from or not os.path.isdir(seed_from):
+        os.makedirs(path)
+        return path
+    for name in os.listdir(root):
+        if name.endswith(".tmp") and os.path.isdir(os.path.join(root, name)):
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)  # bản sao dở của lần trước
+    tmp = path + ".tmp"
+    # DB kiểu cũ (chưa có con trỏ) nằm ngay trong `root`: bỏ qua các thư mục phiên bản và con trỏ
+    legacy = os.path.abspath(seed_from) == os.path.abspath(root)
+    shutil.copytree(seed_from, tmp, ignore=lambda d, names: _version_entries(names) if legacy and d == seed_from else [])
+    os.replace(tmp, path)
+    return path
+
+
+def _version_entries(names):
+    return [n for n in names if n.startswith(KB_POINTER) or n.endswith(".tmp") or (n.startswith("v") and n[1:].isdigit())]
+
+
+def unfinished_kb_version(root: str):
+    """
+    Phiên bản dựng dở mới hơn bản đang phục vụ (tiến trình dựng bị dừng giữa chừng), hoặc None.
+    Dựng lại sẽ đi tiếp trên thư mục này nhờ manifest/checkpoint thay vì bắt đầu từ đầu.
+    """
+    if not os.path.isdir(root):
+        return None
+    active = os.path.basename(resolve_kb_path(root))
+    active_ns = int(active[1:]) if active.startswith("v") and active[1:].isdigit() else 0
+    newer = [int(d[1:]) for d in os.listdir(root) if d.startswith("v") and d[1:].isdigit() and int(d[1:]) > active_ns]
+    return os.path.join(root, f"v{max(newer)}") if newer else None
+
+
+def activate_kb_version(root: str, path: str):
+    """Đổi con trỏ sang phiên bản `path` bằng os.replace: người đọc thấy bản cũ hoặc bản mới, không có trạng thái dở."""
+    tmp = os.path.join(root, KB_POINTER + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(os.path.basename(path))
+    os.replace(tmp, os.path.join(root, KB_POINTER))
+    _cleanup(root, path)
+    print(f"🔀 Knowledge Base đang phục vụ: '{path}'.")
+
+
+def discard_kb_version(root: str, path: str):
+    """Bỏ một phiên bản dựng dở (không bao giờ xóa bản đang được con trỏ trỏ tới)."""
+    if os.path.abspath(path) != os.path.abspath(resolve_kb_path(root)):
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def _cleanup(root, active):
+    versions = sorted(d for d in os.listdir(root) if d.startswith("v") and d[1:].isdigit())
+    for old in versions[:-KEEP_KB_VERSIONS]:
+        if old != os.path.basename(active):
+            shutil.rmtree(os.path.join(root, old), ignore_errors=True)
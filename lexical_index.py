@@ -0,0 +1,180 @@
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter, defaultdict
+
+from langchain_core.documents import Document
+
+from config import settings
+
+# --- Cấu hình ---
+BM25_K1 = 1.5
+BM25_B = 0.75
+RRF_K = 60
+LEXICAL_FASTPATH_COVERAGE = settings.lexical_fastpath_coverage
+LEXICAL_FASTPATH_MARGIN = settings.lexical_fastpath_margin
+
+
+# === TÁCH TỪ TIẾNG VIỆT ===
+def _fold(token: str) -> str:
+    token = unicodedata.normalize("NFD", token)
+    return "".join(c for c in token if unicodedata.category(c) != "Mn").replace("đ", "d")
+
+
+def tokenize(text: str):
+    """
+    Tách âm tiết tiếng Việt thành token cho BM25.
+    - Giữ bản có dấu (phân biệt "học" / "hóc") và thêm bản bỏ dấu để người gõ không dấu vẫn khớp.
+    - Thêm bigram âm tiết (bỏ dấu) vì từ tiếng Việt thường gồm 2 âm tiết ("học phí", "tuyển sinh").
+    - Mã môn, số phòng ("INT1340", "A2") là một token nhờ \\w+.
+    """
+    syllables = re.findall(r"\w+", unicodedata.normalize("NFC", text.lower()))
+    folded = [_fold(s) for s in syllables]
+    tokens = list(syllables)
+    tokens.extend(f for f, s in zip(folded, syllables) if f != s)
+    tokens.extend(f"{a}_{b}" for a, b in zip(folded, folded[1:]))
+    return tokens
+
+
+class BM25Index:
+    """
+    Chỉ mục ngược BM25 trong bộ nhớ, dựng từ chính các đoạn lưu trong Chroma.
+    Thêm/xóa từng đoạn theo ID nên cập nhật tăng dần khi Knowledge Base thay đổi.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.docs = {}                       # id -> Document
+        self.doc_len = {}                    # id -> số token
+        self.postings = defaultdict(dict)    # token -> {id: tần suất}
+        self.total_len = 0
+
+    def __len__(self):
+        return len(self.docs)
+
+    def __contains__(self, doc_id):
+        return doc_id in self.docs
+
+    # --- Cập nhật ---
+    def add(self, doc_id, text, metadata=None):
+        with self._lock:
+            if doc_id in self.docs:
+                self.remove(doc_id)
+            counts = Counter(tokenize(text))
+            self.docs[doc_id] = Document(page_content=text, metadata=metadata or {}, id=doc_id)
+            self.doc_len[doc_id] = sum(counts.values())
+            self.total_len += self.doc_len[doc_id]
+            for token, tf in counts.items():
+                self.postings[token][doc_id] = tf
+
+    def remove(self, doc_id):
+        with self._lock:
+            doc = self.docs.pop(doc_id, None)
+            if doc is None:
+                return
+            self.total_len -= self.doc_len.pop(doc_id)
+            for token in set(tokenize(doc.page_content)):
+                plist = self.postings.get(token)
+                if plist is not None:
+                    plist.pop(doc_id, None)
+                    if not plist:
+                        del self.postings[token]
+
+    def sync_from_store(self, vector_store):
+        """
+        Đồng bộ với Chroma: chỉ tải nội dung các đoạn mới, bỏ các đoạn đã bị xóa.
+        Không gọi embedding, chỉ đọc dữ liệu cục bộ.
+        """
+        store_ids = set(vector_store.get(include=[])["ids"])
+        with self._lock:
+            stale = [i for i in self.docs if i not in store_ids]
+            for doc_id in stale:
+                self.remove(doc_id)
+            new_ids = [i for i in store_ids if i not in self.docs]
+        for start in range(0, len(new_ids), 500):
+            batch = new_ids[start:start + 500]
+            res = vector_store.get(ids=batch, include=["documents", "metadatas"])
+            for doc_id, text, meta in zip(res["ids"], res["documents"], res["metadatas"]):
+                self.add(doc_id, text or "", meta)
+        return len(new_ids), len(stale)
+
+    def sync_from_snapshot(self, snapshot):
+        """
+        Đồng bộ từ snapshot memory-map (docs.json) thay vì Chroma: khi chạy nhiều worker,
+        tiến trình phục vụ chỉ đọc snapshot dùng chung, không mở cơ sở dữ liệu đang được ghi.
+        """
+        rows = {i: (t, m) for i, t, m in zip(snapshot.ids, snapshot.documents, snapshot.metadatas)}
+        with self._lock:
+            stale = [i for i in self.docs if i not in rows]
+            for doc_id in stale:
+                self.remove(doc_id)
+            new_ids = [i for i in rows if i not in self.docs]
+            for doc_id in new_ids:
+                text, meta = rows[doc_id]
+                self.add(doc_id, text or "", meta)
+        return len(new_ids), len(stale)
+
+    # --- Tìm kiếm ---
+    def _idf(self, token):
+        n = len(self.docs)
+        df = len(self.postings.get(token, ()))
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def idf(self, token):
+        with self._lock:
+            return self._idf(token)
+
+    def search(self, query, k=20):
+        """Trả về danh sách (Document, điểm BM25) giảm dần."""
+        with self._lock:
+            if not self.docs:
+                return []
+            avg_len = self.total_len / len(self.docs)
+            scores = defaultdict(float)
+            for token in set(tokenize(query)):
+                plist = self.postings.get(token)
+                if not plist:
+                    continue
+                idf = self._idf(token)
+                for doc_id, tf in plist.items():
+                    norm = 1 - BM25_B + BM25_B * self.doc_len[doc_id] / avg_len
+                    scores[doc_id] += idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * norm)
+            top = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:k]
+            return [(self.docs[i], s) for i, s in top]
+
+    def is_confident(self, query, results):
+        """
+        Kết quả BM25 đủ chắc để bỏ qua embedding khi:
+        - đoạn đứng đầu chứa phần lớn (theo idf) các token của câu hỏi, và
+        - điểm của nó vượt trội đoạn thứ hai.
+        """
+        if not results:
+            return False
+        with self._lock:
+            tokens = set(tokenize(query))
+            total = sum(self._idf(t) for t in tokens)
+            if not total:
+                return False
+            top_id = results[0][0].id
+            matched = sum(self._idf(t) for t in tokens if top_id in self.postings.get(t, ()))
+        coverage = matched / total
+        second = results[1][1] if len(results) > 1 else 0.0
+        return coverage >= LEXICAL_FASTPATH_COVERAGE and results[0][1] >= LEXICAL_FASTPATH_MARGIN * second
+
+
+# === GỘP KẾT QUẢ (RECIPROCAL RANK FUSION) ===
+def doc_key(doc):
+    return doc.id or doc.metadata.get("hash") or doc.page_content
+
+
+def reciprocal_rank_fusion(result_lists, k=4, rrf_k=RRF_K):
+    """Gộp nhiều danh sách Document đã xếp hạng: điểm = tổng 1 / (rrf_k + hạng)."""
+    scores, docs = defaultdict(float), {}
+    for results in result_lists:
+        for rank, doc in enumerate(results, 1):
+            key = doc_key(doc)
+            scores[key] += 1.0 / (rrf_k + rank)
+            docs.setdefault(key, doc)
+    ranked = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [docs[key] for key in ranked]
@@ -0,0 +1,68 @@
+import asyncio
+import re
+import time
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from config import settings
+
+# --- Cấu hình ---
+LLM_BACKEND = settings.llm_backend  # "openai" hoặc "local"
+LOCAL_LLM_LATENCY = settings.local_llm_latency          # giây trước token đầu tiên
+LOCAL_LLM_TOKEN_DELAY = settings.local_llm_token_delay  # giây giữa hai token
+LOCAL_LLM_ANSWER_WORDS = settings.local_llm_answer_words
+
+
+# === MÔ HÌNH CHAT CỤC BỘ (KHÔNG GỌI MẠNG) ===
+class LocalChatModel(BaseChatModel):
+    """
+    Mô hình chat tất định dùng cho test/benchmark offline.
+    Câu trả lời là một đoạn cố định số từ lấy từ giữa prompt (thường rơi vào phần ngữ cảnh),
+    nên cùng prompt luôn cho cùng kết quả; độ trễ mạng và tốc độ sinh token giả lập được.
+    """
+
+    latency: float = LOCAL_LLM_LATENCY
+    token_delay: float = LOCAL_LLM_TOKEN_DELAY
+    answer_words: int = LOCAL_LLM_ANSWER_WORDS
+
+    @property
+    def _llm_type(self) -> str:
+        return "local-fake-chat"
+
+    def _answer_tokens(self, messages):
+        prompt = "\n".join(str(m.content) for m in messages)
+        words = re.findall(r"\S+", prompt)
+        start = max(0, len(words) // 2 - self.answer_words // 2)
+        picked = words[start:start + self.answer_words]
+        return ["Theo tài liệu PTIT:"] + [f" {w}" for w in picked]
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        tokens = self._answer_tokens(messages)
+        time.sleep(self.latency + self.token_delay * len(tokens))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(tokens)))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        tokens = self._answer_tokens(messages)
+        await asyncio.sleep(self.latency + self.token_delay * len(tokens))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(tokens)))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        for token in self._answer_tokens(messages):
+            if self.token_delay:
+                time.sleep(self.token_delay)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+
+# === FACTORY ===
+def make_llm(model: str, temperature: float):
+    """Tạo mô hình chat theo LLM_BACKEND ("openai" mặc định, "local" cho test/benchmark offline)."""
+    if LLM_BACKEND == "local":
+        return LocalChatModel()
+    from langchain_openai import ChatOpenAI
+    return ChatOpenAI(model=model, temperature=temperature)
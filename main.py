@@ -1,14 +1,11 @@
+import argparse
 import os
 import getpass
-import json
-from datetime import datetime
 from dotenv import load_dotenv
 
-from langchain_community.vectorstores import Chroma
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from langchain.prompts import ChatPromptTemplate
-from langchain.schema.runnable import RunnablePassthrough
-from langchain.schema.output_parser import StrOutputParser
+from chat_history import DEFAULT_SESSION, ChatHistoryStore
+from config import settings
+from pipeline import build_chatbot, run_batch
 
 # --- Cấu hình và Tải API Key ---
 load_dotenv()
@@ -16,67 +13,41 @@ if "OPENAI_API_KEY" not in os.environ:
     print("Không tìm thấy API key. Vui lòng nhập:")
     os.environ["OPENAI_API_KEY"] = getpass.getpass()
 
-LLM_MODEL = "gpt-4.1-nano"
-EMBEDDING_MODEL = "text-embedding-3-small"
-CHROMA_DB_PATH = "./knowledge_base_ptit"
-HISTORY_FILE = "./chat_history.json"
+# Đường dẫn, mô hình, k... lấy từ config.settings (biến môi trường hoặc file PTIT_CONFIG), giống app.py
+HISTORY_DB = settings.chat_history_db
+HISTORY_FILE = "./chat_history.json"  # file cũ, chỉ dùng để migrate
 
 
 # --- Lớp Quản lý Lịch sử Chat ---
 class ChatHistoryManager:
-    """Quản lý và lưu trữ lịch sử cuộc trò chuyện vào file JSON."""
-    def __init__(self, history_file=HISTORY_FILE):
-        self.history_file = history_file
-        self.history = self._load_history()
+    """Quản lý lịch sử cuộc trò chuyện, lưu kiểu ghi thêm qua ChatHistoryStore."""
+    def __init__(self, history_db=HISTORY_DB, legacy_file=HISTORY_FILE):
+        self.store = ChatHistoryStore(history_db, legacy_file)
 
     def add_message(self, role, content, sources=None):
-        self.history.append({
-            "role": role,
-            "content": content,
-            "sources": sources or [],
-            "timestamp": datetime.now().isoformat()
-        })
-        self._save_history()
+        try:
+            self.store.append(role, content, sources, session_id=DEFAULT_SESSION)
+        except Exception as e:
+            print(f"⚠ Lỗi khi lưu lịch sử: {e}")
 
     def show(self, limit=10):
-        if not self.history:
+        # Chỉ đọc các tin nhắn gần nhất
+        recent = self.store.tail(limit, session_id=DEFAULT_SESSION)
+        if not recent:
             return "Lịch sử trò chuyện trống."
-        # Lấy các tin nhắn gần nhất
-        recent = self.history[-limit:]
         result = []
         for i, msg in enumerate(recent, 1):
             timestamp = msg.get("timestamp", "")
             role = msg["role"].capitalize()
-            content = msg["content"][:80] # Giới hạn độ dài nội dung
+            content = msg["text"][:80] # Giới hạn độ dài nội dung
             result.append(f"{i}. [{timestamp[:16]}] {role}: {content}...")
         return "\n".join(result)
 
     def clear(self):
-        self.history = []
-        self._save_history()
+        self.store.clear(DEFAULT_SESSION)
         print("Đã xóa lịch sử trò chuyện.")
 
-    def _save_history(self):
-        try:
-            with open(self.history_file, "w", encoding="utf-8") as f:
-                json.dump(self.history, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"⚠ Lỗi khi lưu lịch sử: {e}")
-
-    def _load_history(self):
-        if os.path.exists(self.history_file):
-            try:
-                with open(self.history_file, "r", encoding="utf-8") as f:
-                    return json.load(f)
-            except (json.JSONDecodeError, IOError) as e:
-                print(f"Lỗi khi tải lịch sử: {e}")
-        return []
-
 # --- Các Hàm Tiện Ích ---
-def format_docs(docs):
-    """Nối nội dung các tài liệu thành một chuỗi duy nhất."""
-    return "\n\n".join(doc.page_content for doc in docs)
-
 def display_menu():
     """Hiển thị menu các lệnh có thể sử dụng."""
     print("\n" + "=" * 60)
@@ -84,66 +55,38 @@ def display_menu():
     print("=" * 60)
     print("  'thoát' / 'exit'     - Kết thúc phiên trò chuyện")
     print("  'history'            - Xem 10 tin nhắn gần nhất")
-    print("  'clear'              - Xóa toàn bộ lịch sử chat")
+    print("  'clear'              - Xóa lịch sử chat của CLI (không ảnh hưởng phiên web)")
     print("  'help'               - Hiển thị menu này")
     print("=" * 60 + "\n")
 
-# --- Hàm tạo RAG Chain ---
-def create_rag_chain():
-    """Tạo chuỗi RAG để xử lý và trả lời câu hỏi."""
-    try:
-        # 1. Khởi tạo embedding model
-        embeddings = OpenAIEmbeddings(model=EMBEDDING_MODEL)
-
-        # 2. Tải vector store từ ổ đĩa
-        vector_store = Chroma(persist_directory=CHROMA_DB_PATH, embedding_function=embeddings)
-
-        # 3. Tạo retriever để tìm kiếm tài liệu
-        retriever = vector_store.as_retriever(search_kwargs={"k": 3})
-
-        # 4. Định nghĩa prompt template cho AI
-        template = """
-        Bạn là một trợ lý ảo hỗ trợ sinh viên tại Học viện Công nghệ Bưu chính Viễn thông (PTIT).
-        Trả lời câu hỏi của người dùng cách chuyên nghiệp, ngắn gọn và chỉ dựa vào BỐI CẢNH được cung cấp.
-        Nếu thông tin không có trong bối cảnh, hãy nói: "Xin lỗi, mình chưa có thông tin về vấn đề này trong tài liệu tham khảo."
-        Luôn trả lời bằng tiếng Việt và bắt đầu bằng lời chào thân thiện.
-
-        BỐI CẢNH:
-        {context}
-
-        CÂU HỎI:
-        {question}
-        """
-        prompt = ChatPromptTemplate.from_template(template)
-
-        # 5. Khởi tạo mô hình ngôn ngữ
-        llm = ChatOpenAI(model=LLM_MODEL, temperature=0.7)
-
-        # 6. Xây dựng RAG chain bằng LCEL
-        rag_chain = (
-                {"context": retriever, "question": RunnablePassthrough()}
-                | prompt
-                | llm
-                | StrOutputParser()
-        )
-        print("✅ Trợ lý ảo đã sẵn sàng!")
-        return rag_chain
-
-    except Exception as e:
-        print(f"Lỗi nghiêm trọng khi khởi tạo RAG chain: {e}")
-        return None
-
 # --- Hàm Chính ---
+def parse_args():
+    parser = argparse.ArgumentParser(description="Trợ lý ảo PTIT trên dòng lệnh")
+    parser.add_argument("--batch", metavar="FILE",
+                        help="trả lời cả file câu hỏi (.txt mỗi dòng một câu, hoặc .jsonl có trường question) rồi thoát")
+    parser.add_argument("--output", metavar="FILE", help="ghi kết quả batch ra file JSONL")
+    parser.add_argument("--concurrency", type=int, default=settings.max_concurrent_llm,
+                        help="số câu hỏi xử lý cùng lúc ở chế độ batch")
+    return parser.parse_args()
+
 def main():
     """Hàm chính để chạy ứng dụng chatbot."""
-    if not os.path.exists(CHROMA_DB_PATH):
-        print(f"Lỗi: Không tìm thấy 'thư viện' kiến thức tại '{CHROMA_DB_PATH}'.")
-        print("Vui lòng chạy file `build_database.py` để tạo 'thư viện' trước.")
+    args = parse_args()
+    if not os.path.exists(settings.chroma_db_path):
+        print(f"Lỗi: Không tìm thấy 'thư viện' kiến thức tại '{settings.chroma_db_path}'.")
+        print("Vui lòng chạy `python rag_system.py` để tạo 'thư viện' trước.")
         return
 
-    rag_chain = create_rag_chain()
-    if rag_chain is None:
+    if args.batch:
+        run_batch(args.batch, args.output, args.concurrency)
+        return
+
+    try:
+        chatbot = build_chatbot()
+    except Exception as e:
+        print(f"Lỗi nghiêm trọng khi khởi tạo chatbot: {e}")
         return
+    print("✅ Trợ lý ảo đã sẵn sàng!")
 
     history_manager = ChatHistoryManager()
 
@@ -173,7 +116,7 @@ def main():
                 print("\n--------------------------\n")
                 continue
             if user_input.lower() == "clear":
-                confirm = input("Bạn có chắc chắn muốn xóa toàn bộ lịch sử? (yes/no): ")
+                confirm = input("Bạn có chắc chắn muốn xóa lịch sử chat của CLI? (yes/no): ")
                 if confirm.lower() == "yes":
                     history_manager.clear()
                 else:
@@ -182,7 +125,7 @@ def main():
 
             # Xử lý câu hỏi thông thường
             print("Trợ lý PTIT: Đang tìm kiếm câu trả lời...")
-            response = rag_chain.invoke(user_input)
+            response = chatbot.get_answer(user_input, session_id=DEFAULT_SESSION)
             print(f"Trợ lý PTIT: {response}\n")
 
             # Lưu vào lịch sử
@@ -0,0 +1,181 @@
+import contextvars
+import json
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import datetime
+
+from config import settings
+
+# --- Cấu hình ---
+TRACE_LOG = settings.trace_log  # đường dẫn file JSONL; để trống thì tắt trace
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=None):
+    items = list(key) + (list(extra) if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+class Registry:
+    """
+    Bộ đếm/histogram tối giản trong tiến trình, xuất theo định dạng văn bản của Prometheus.
+    Mỗi lần ghi chỉ là một phép cộng dưới khóa, đủ rẻ để bật thường trực ở production.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help = {}
+        self._counters = {}     # name -> {label_key: value}
+        self._histograms = {}   # name -> {label_key: [bucket_counts, sum, count]}
+        self._collectors = []   # hàm trả về [(name, type, help, {label_key: value})]
+
+    def describe(self, name, help_text):
+        self._help[name] = help_text
+
+    def inc(self, name, value=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = _label_key(labels)
+        idx = bisect_left(LATENCY_BUCKETS, value)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            hist = series.get(key)
+            if hist is None:
+                hist = series[key] = [[0] * (len(LATENCY_BUCKETS) + 1), 0.0, 0]
+            hist[0][idx] += 1
+            hist[1] += value
+            hist[2] += 1
+
+    def totals(self, name):
+        """Tổng thời gian và số lần đo của một histogram theo nhãn stage (dùng cho benchmark)."""
+        with self._lock:
+            series = self._histograms.get(name, {})
+            return {dict(key).get("stage", ""): {"seconds": round(h[1], 4), "count": h[2]} for key, h in series.items()}
+
+    def register_collector(self, fn):
+        """Đăng ký hàm lấy số liệu lúc scrape (ví dụ thống kê cache)."""
+        self._collectors.append(fn)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            counters = {n: dict(s) for n, s in self._counters.items()}
+            histograms = {n: {k: (list(h[0]), h[1], h[2]) for k, h in s.items()} for n, s in self._histograms.items()}
+        for name, series in sorted(counters.items()):
+            lines.append(f"# HELP {name} {self._help.get(name, name)}")
+            lines.append(f"# TYPE {name} counter")
+            for key, value in series.items():
+                lines.append(f"{name}{_format_labels(key)} {value}")
+        for name, series in sorted(histograms.items()):
+            lines.append(f"# HELP {name} {self._help.get(name, name)}")
+            lines.append(f"# TYPE {name} histogram")
+            for key, (buckets, total, count) in series.items():
+                cumulative = 0
+                for bound, n in zip(LATENCY_BUCKETS + (float("inf"),), buckets):
+                    cumulative += n
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{name}_bucket{_format_labels(key, [('le', le)])} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(key)} {total}")
+                lines.append(f"{name}_count{_format_labels(key)} {count}")
+        for fn in self._collectors:
+            try:
+                for name, kind, help_text, series in fn():
+                    lines.append(f"# HELP {name} {help_text}")
+                    lines.append(f"# TYPE {name} {kind}")
+                    for key, value in series.items():
+                        lines.append(f"{name}{_format_labels(key)} {value}")
+            except Exception as e:
+                lines.append(f"# collector lỗi: {e}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+registry.describe("ptit_stage_seconds", "Thời gian từng giai đoạn xử lý câu hỏi (giây)")
+registry.describe("ptit_ingest_stage_seconds", "Thời gian từng giai đoạn nạp tri thức (giây)")
+registry.describe("ptit_tokens_total", "Số token theo loại (prompt, completion, saved)")
+registry.describe("ptit_errors_total", "Số lỗi theo giai đoạn")
+registry.describe("ptit_ingest_chunks_total", "Số đoạn được thêm/xóa khi nạp tri thức")
+
+
+# === TRACE THEO REQUEST ===
+_current_trace = contextvars.ContextVar("ptit_trace", default=None)
+
+
+@contextmanager
+def trace(name, **attrs):
+    """Bao một request; nếu đặt TRACE_LOG thì ghi các span của request ra file JSONL."""
+    if not TRACE_LOG:
+        start = time.perf_counter()
+        try:
+            yield None
+        finally:
+            registry.observe("ptit_stage_seconds", time.perf_counter() - start, stage=name)
+        return
+    record = {"trace_id": uuid.uuid4().hex, "name": name, "start": datetime.now().isoformat(),
+              "attrs": attrs, "spans": []}
+    token = _current_trace.set(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    except Exception as e:
+        record["error"] = str(e)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        _current_trace.reset(token)
+        registry.observe("ptit_stage_seconds", elapsed, stage=name)
+        record["duration_ms"] = round(elapsed * 1000, 3)
+        _write_trace(record)
+
+
+_trace_lock = threading.Lock()
+
+def _write_trace(record):
+    line = json.dumps(record, ensure_ascii=False)
+    with _trace_lock:
+        with open(TRACE_LOG, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+def annotate(**attrs):
+    """Gắn thêm thông tin (số token, cache hit...) vào trace hiện tại, nếu có."""
+    record = _current_trace.get()
+    if record is not None:
+        record["attrs"].update(attrs)
+
+
+@contextmanager
+def timed(stage, metric="ptit_stage_seconds"):
+    """Đo một giai đoạn: ghi histogram, đếm lỗi, và thêm span vào trace hiện tại."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        registry.inc("ptit_errors_total", stage=stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        registry.observe(metric, elapsed, stage=stage)
+        record = _current_trace.get()
+        if record is not None:
+            record["spans"].append({"stage": stage, "ms": round(elapsed * 1000, 3)})
+
+
+def observe_stage(stage, seconds, metric="ptit_stage_seconds"):
+    registry.observe(metric, seconds, stage=stage)
+    record = _current_trace.get()
+    if record is not None:
+        record["spans"].append({"stage": stage, "ms": round(seconds * 1000, 3)})
@@ -0,0 +1,108 @@
+import asyncio
+import json
+import time
+
+from config import Settings, settings
+from metrics import trace
+
+
+# === FACTORY DÙNG CHUNG ===
+def build_chatbot(config: Settings = settings, llm_limiter=None):
+    """
+    Dựng pipeline hỏi-đáp (RAGChatbot) theo `config`. app.py, main.py và benchmark đều đi qua đây
+    nên web và CLI dùng cùng vector store, truy hồi lai, chấm lại, cache và prompt.
+    `llm_limiter` (serving.ConcurrencyLimiter, web truyền vào) giới hạn các lời gọi LLM đồng bộ.
+    LangChain/Chroma chỉ được import khi gọi hàm này.
+    """
+    from rag_chatbot import RAGChatbot
+    return RAGChatbot(config, llm_limiter)
+
+
+# === CHẾ ĐỘ BATCH ===
+def read_questions(path: str):
+    """File .jsonl (mỗi dòng một object có trường "question") hoặc văn bản thường (mỗi dòng một câu hỏi)."""
+    questions = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            questions.append(json.loads(line)["question"] if path.endswith(".jsonl") else line)
+    return questions
+
+
+async def answer_batch(chatbot, questions, concurrency: int = settings.max_concurrent_llm, on_result=None):
+    """
+    Trả lời `questions` song song (tối đa `concurrency` câu cùng lúc) bằng aget_answer.
+    Mỗi câu là một trace riêng; kết quả giữ đúng thứ tự đầu vào. `on_result` được gọi ngay khi có từng kết quả.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def answer_one(index, question):
+        async with semaphore:
+            start = time.perf_counter()
+            with trace("batch", route="batch", question_index=index):
+                answer = await chatbot.aget_answer(question)
+            result = {
+                "index": index,
+                "question": question,
+                "answer": answer,
+                "latency_ms": round((time.perf_counter() - start) * 1000, 1),
+            }
+        if on_result is not None:
+            on_result(result)
+        return result
+
+    return await asyncio.gather(*(answer_one(i, q) for i, q in enumerate(questions)))
+
+
+def summarize_batch(results, wall_seconds: float, chatbot):
+    """Thông lượng, phân vị độ trễ và tỉ lệ cache của một lượt batch."""
+    latencies = sorted(r["latency_ms"] for r in results)
+
+    def pct(p):
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))] if latencies else 0.0
+
+    cache = chatbot.answer_cache.stats()
+    return {
+        "questions": len(results),
+        "errors": sum(r["answer"].startswith("Lỗi khi truy vấn RAG") for r in results),
+        "wall_seconds": round(wall_seconds, 3),
+        "questions_per_second": round(len(results) / wall_seconds, 2) if wall_seconds else 0.0,
+        "p50_ms": pct(0.50),
+        "p95_ms": pct(0.95),
+        "answer_cache_hits": cache["hits_exact"] + cache["hits_semantic"],
+        "faq_share": chatbot.faq.stats()["traffic_share"],
+        "lexical_fastpath": chatbot.lexical_fastpath,
+        "context_tokens": chatbot.context_stats["tokens_out"],
+        "reranker": chatbot.reranker.stats(),
+    }
+
+
+def run_batch(input_path: str, output_path: str = None, concurrency: int = settings.max_concurrent_llm,
+              config: Settings = settings):
+    """
+    Trả lời cả file câu hỏi, ghi từng kết quả ra JSONL (nếu có `output_path`) và trả về bản tóm tắt.
+    Dùng để đánh giá offline hoặc làm nóng các cache lưu trên đĩa (embedding câu hỏi) trước giờ cao điểm.
+    """
+    questions = read_questions(input_path)
+    chatbot = build_chatbot(config)
+    out = open(output_path, "w", encoding="utf-8") if output_path else None
+
+    def write(result):
+        if out is not None:
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            out.flush()
+
+    print(f"📦 Trả lời {len(questions)} câu hỏi, tối đa {concurrency} câu cùng lúc...")
+    start = time.perf_counter()
+    try:
+        results = asyncio.run(answer_batch(chatbot, questions, concurrency, on_result=write))
+    finally:
+        if out is not None:
+            out.close()
+    summary = summarize_batch(results, time.perf_counter() - start, chatbot)
+    print(f"✅ {summary['questions']} câu trong {summary['wall_seconds']}s "
+          f"({summary['questions_per_second']} câu/s, p50 {summary['p50_ms']} ms, p95 {summary['p95_ms']} ms, "
+          f"{summary['errors']} lỗi).")
+    return summary
@@ -0,0 +1,195 @@
+import asyncio
+import queue
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from config import settings
+from embedding_client import embedding_cache_key, make_embeddings
+
+# --- Cấu hình ---
+QUERY_CACHE_DB = settings.query_cache_db
+QUERY_CACHE_SIZE = settings.query_cache_size
+QUERY_BATCH_WINDOW_MS = settings.query_batch_window_ms
+QUERY_BATCH_MAX = settings.query_batch_max
+QUERY_EMBED_TIMEOUT = settings.query_embed_timeout  # giây chờ tối đa một lần embed câu hỏi
+
+
+def normalize_query_key(text: str) -> str:
+    """Chữ thường + gộp khoảng trắng, giữ dấu vì embedding của "học" và "hóc" khác nhau."""
+    return " ".join(unicodedata.normalize("NFC", text.lower()).split())
+
+
+class QueryEmbeddingCache:
+    """
+    Cache LRU giới hạn cho embedding câu hỏi, lưu xuống SQLite để dùng lại sau khi khởi động lại.
+    Trong bộ nhớ là OrderedDict; khi khởi động chỉ nạp `max_size` dòng dùng gần nhất.
+    """
+
+    def __init__(self, model: str, db_path=QUERY_CACHE_DB, max_size=QUERY_CACHE_SIZE):
+        self.model = model
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS query_embeddings (
+                model TEXT NOT NULL,
+                key TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, key)
+            )
+            """
+        )
+        self._conn.commit()
+        rows = self._conn.execute(
+            "SELECT key, vector FROM query_embeddings WHERE model = ? ORDER BY last_used DESC LIMIT ?",
+            (model, max_size),
+        ).fetchall()
+        for key, blob in reversed(rows):
+            self._entries[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+
+    def get(self, text):
+        key = normalize_query_key(text)
+        with self._lock:
+            vec = self._entries.get(key)
+            if vec is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return vec
+
+    def put(self, text, vector):
+        key = normalize_query_key(text)
+        with self._lock:
+            self._entries[key] = list(vector)
+            self._entries.move_to_end(key)
+            evicted = []
+            while len(self._entries) > self.max_size:
+                evicted.append(self._entries.popitem(last=False)[0])
+            self._conn.execute(
+                "INSERT OR REPLACE INTO query_embeddings (model, key, vector, last_used) VALUES (?, ?, ?, ?)",
+                (self.model, key, np.asarray(vector, dtype=np.float32).tobytes(), time.time()),
+            )
+            if evicted:
+                self._conn.executemany(
+                    "DELETE FROM query_embeddings WHERE model = ? AND key = ?",
+                    [(self.model, k) for k in evicted],
+                )
+            self._conn.commit()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+class QueryMicroBatcher:
+    """
+    Gom các câu hỏi đến gần như cùng lúc (trong `window_ms`) từ nhiều request
+    thành một lần gọi embed_documents, giảm số round-trip mạng khi tải cao.
+    """
+
+    def __init__(self, embeddings: Embeddings, window_ms=QUERY_BATCH_WINDOW_MS, max_batch=QUERY_BATCH_MAX):
+        self.embeddings = embeddings
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self.batches = 0
+        self.queries = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, daemon=True, name="query-embed-batcher")
+        self._thread.start()
+
+    def submit(self, text) -> Future:
+        future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def _loop(self):
+        while True:
+            items = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(items) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    items.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self._run_batch(items)
+            except BaseException as e:
+                # Không để một lô lỗi (kể cả lỗi ngoài dự kiến) làm chết luồng gom lô
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _run_batch(self, items):
+        # Bỏ các future đã bị hủy (client ngắt kết nối, hết thời gian chờ); các future còn lại
+        # chuyển sang trạng thái chạy nên không thể bị hủy giữa chừng nữa
+        items = [(t, f) for t, f in items if f.set_running_or_notify_cancel()]
+        if not items:
+            return
+        texts = list(dict.fromkeys(t for t, _ in items))
+        self.batches += 1
+        self.queries += len(items)
+        try:
+            vectors = dict(zip(texts, self.embeddings.embed_documents(texts)))
+        except Exception as e:
+            for _, future in items:
+                future.set_exception(e)
+            return
+        for text, future in items:
+            if not future.done():
+                future.set_result(vectors[text])
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """Embedding câu hỏi: tra cache LRU trước, trượt thì đi qua micro-batcher."""
+
+    def __init__(self, underlying: Embeddings, model: str, db_path=QUERY_CACHE_DB):
+        self.underlying = underlying
+        self.cache = QueryEmbeddingCache(model, db_path)
+        self.batcher = QueryMicroBatcher(underlying)
+
+    def embed_query(self, text):
+        vec = self.cache.get(text)
+        if vec is None:
+            vec = self.batcher.submit(text).result(timeout=QUERY_EMBED_TIMEOUT)
+            self.cache.put(text, vec)
+        return vec
+
+    async def aembed_query(self, text):
+        vec = self.cache.get(text)
+        if vec is None:
+            vec = await asyncio.wait_for(asyncio.wrap_future(self.batcher.submit(text)), QUERY_EMBED_TIMEOUT)
+            self.cache.put(text, vec)
+        return vec
+
+    def embed_documents(self, texts):
+        return self.underlying.embed_documents(texts)
+
+    async def aembed_documents(self, texts):
+        return await self.underlying.aembed_documents(texts)
+
+
+def make_query_embeddings(model: str) -> CachedQueryEmbeddings:
+    """Embedding dùng cho truy vấn (chatbot/CLI): có cache và gom lô câu hỏi."""
+    return CachedQueryEmbeddings(make_embeddings(model), embedding_cache_key(model))
@@ -1,31 +1,69 @@
+import asyncio
 import os
+import threading
+import time
+from contextlib import nullcontext
 from dotenv import load_dotenv
 from langchain_chroma import Chroma
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
 from langchain.prompts import PromptTemplate
 from langchain.chains import RetrievalQA
 
-load_dotenv()
+from answer_cache import AnswerCache, read_knowledge_version
+from query_embedding import make_query_embeddings
+from lexical_index import BM25Index, reciprocal_rank_fusion
+from vector_snapshot import VectorSnapshot
+from kb_versions import resolve_kb_path
+from kb_sync import open_chunk_index
+from context_packer import format_context, pack_context
+from embedding_client import count_tokens, embedding_cache_key
+from llm_client import make_llm
+from conversation_memory import SessionMemoryStore
+from reranker import Reranker
+from faq_index import FAQIndex
+from serving import ServerBusy
+from metrics import annotate, observe_stage, registry, timed
+from config import Settings, settings
 
-EMBEDDING_MODEL = "text-embedding-3-small"
-CHROMA_DB_PATH = "./knowledge_base_ptit"
-os.makedirs(CHROMA_DB_PATH, exist_ok=True)
+load_dotenv()
 
 
 class RAGChatbot:
-    def __init__(self):
-        self.embeddings = OpenAIEmbeddings(model=EMBEDDING_MODEL)
+    """
+    Pipeline hỏi-đáp dùng chung cho web và CLI (tạo qua pipeline.build_chatbot).
+    Đường dẫn, mô hình, k và cache câu trả lời lấy từ `config`; kích thước lô/cache và giới hạn đồng thời
+    của các module còn lại đọc từ config.settings.
+    `llm_limiter` (tùy chọn) chỉ bọc lời gọi LLM của get_answer/stream_answer và lượt viết lại câu hỏi;
+    hết slot thì ném ServerBusy. Đường async (aget_answer, chế độ batch) tự giới hạn bằng `concurrency`.
+    """
+
+    def __init__(self, config: Settings = settings, llm_limiter=None):
+        self.config = config
+        self.llm_slot = llm_limiter.slot if llm_limiter is not None else nullcontext
+        os.makedirs(config.chroma_db_path, exist_ok=True)
+        self.embeddings = make_query_embeddings(config.embedding_model)
+        self.kb_path = resolve_kb_path(config.chroma_db_path)
         self.vector_store = Chroma(
-            persist_directory=CHROMA_DB_PATH,
+            persist_directory=self.kb_path,
             embedding_function=self.embeddings
         )
-        self.llm = ChatOpenAI(
-            model="gpt-4o-mini",
-            temperature=0.3
-        )
+        self.chunk_index = open_chunk_index(self.kb_path)  # mục cha của đoạn con (bộ chia theo cấu trúc)
+        self.answer_cache = AnswerCache(config.answer_cache_size, config.answer_cache_ttl,
+                                        config.answer_cache_threshold)
+        self.lexical_index = BM25Index()
+        self.faq = FAQIndex(config.faq_index_db, embedding_cache_key(config.embedding_model),
+                            config.faq_match_threshold)
+        self.reranker = Reranker(idf=self.lexical_index.idf, config=config)
+        self.lexical_fastpath = 0  # số câu hỏi đi đường tắt BM25, không gọi embedding
+        self.context_stats = {"requests": 0, "tokens_in": 0, "tokens_out": 0, "tokens_saved": 0}
+        self._stats_lock = threading.Lock()
+        self.snapshot = None       # snapshot vector memory-map; None thì dùng Chroma
+        self._index_lock = threading.Lock()
+        self._index_version = None
+        self.llm = make_llm(config.llm_model, temperature=config.llm_temperature)
+        self.memory = SessionMemoryStore(make_llm(config.memory_model, temperature=0), config, llm_limiter)
 
         self.retriever = self.vector_store.as_retriever(
-            search_kwargs={"k": 4}  # lấy 4 đoạn liên quan nhất
+            search_kwargs={"k": config.retrieval_k}  # lấy k đoạn liên quan nhất
         )
 
         template = """
@@ -48,6 +86,7 @@ class RAGChatbot:
             input_variables=["context", "question"],
             template=template
         )
+        self.prompt = prompt
 
         self.qa_chain = RetrievalQA.from_chain_type(
             llm=self.llm,
@@ -55,11 +94,307 @@ class RAGChatbot:
             chain_type="stuff",
             chain_type_kwargs={"prompt": prompt}
         )
+        self.refresh_indexes()
+
+    # === TRUY HỒI LAI: BM25 CỤC BỘ + VECTOR (RRF) ===
+    def refresh_indexes(self):
+        """
+        Khi Knowledge Base đổi phiên bản: chuyển sang thư mục Chroma mà con trỏ đang trỏ tới
+        (nếu vừa dựng lại), cập nhật tăng dần chỉ mục BM25 và nạp snapshot vector mới (nếu có).
+        Request đang chạy giữ tham chiếu cũ tới hết; request sau dùng bản mới.
+        Gọi ở đầu mỗi câu hỏi và định kỳ từ thread theo dõi của app.py; file phiên bản chỉ được đọc lại
+        tối đa mỗi `version_check_interval` giây (answer_cache.read_version).
+        """
+        version = read_knowledge_version()
+        if version == self._index_version:
+            return
+        with self._index_lock:
+            if version != self._index_version:
+                with timed("index_refresh"):
+                    self._switch_store(resolve_kb_path(self.config.chroma_db_path))
+                    snapshot = VectorSnapshot.load_current(quantized=self.config.snapshot_quantized)
+                    # Có snapshot thì BM25 và tìm vector đều đọc từ snapshot dùng chung, không chạm vào Chroma
+                    if snapshot is not None:
+                        added, removed = self.lexical_index.sync_from_snapshot(snapshot)
+                    else:
+                        added, removed = self.lexical_index.sync_from_store(self.vector_store)
+                    self.snapshot = snapshot
+                self._index_version = version
+                print(f"🔤 Chỉ mục BM25: +{added} / -{removed} đoạn (tổng {len(self.lexical_index)}).")
+
+    def _switch_store(self, path):
+        if path == self.kb_path:
+            return
+        store = Chroma(persist_directory=path, embedding_function=self.embeddings)
+        retriever = store.as_retriever(search_kwargs={"k": self.config.retrieval_k})
+        self.vector_store, self.retriever, self.kb_path = store, retriever, path
+        self.chunk_index = open_chunk_index(path)
+        self.qa_chain.retriever = retriever
+        print(f"🔀 Chatbot chuyển sang Knowledge Base '{path}'.")
+
+    def _dense_search(self, query_vector, k):
+        """Tìm vector trên snapshot NumPy trong tiến trình; chưa có snapshot thì hỏi Chroma."""
+        if self.snapshot is not None:
+            return [doc for doc, _ in self.snapshot.search(query_vector, k)]
+        return self.vector_store.similarity_search_by_vector(query_vector, k=k)
+
+    def _lexical_candidates(self, question: str):
+        """Tìm BM25. Trả về (ứng viên, True nếu đủ chắc để bỏ qua embedding)."""
+        self.refresh_indexes()
+        with timed("lexical_search"):
+            lexical = self.lexical_index.search(question, self.config.candidate_k)
+            confident = self.lexical_index.is_confident(question, lexical)
+        if confident:
+            with self._stats_lock:
+                self.lexical_fastpath += 1
+            self.answer_cache.note_miss()
+            annotate(lexical_fastpath=True)
+            return [doc for doc, _ in lexical], True
+        return [doc for doc, _ in lexical], False
+
+    def has_chunks(self, chunk_ids):
+        """Mọi đoạn trong `chunk_ids` còn trong Knowledge Base đang phục vụ (dùng để kiểm tra nguồn của FAQ)."""
+        return all(chunk_id in self.lexical_index for chunk_id in chunk_ids)
+
+    def _select(self, question: str, candidates):
+        """Chấm lại các ứng viên đã gộp và chọn k thích ứng (tắt chấm lại thì lấy retrieval_k đoạn đầu)."""
+        k = self.config.retrieval_k
+        return self.reranker.rerank(question, candidates[:self.reranker.candidates or k], k)
+
+    def _pack(self, docs):
+        """
+        Gộp đoạn chồng lấn, bỏ đoạn gần trùng, cắt theo ngân sách token; ghi nhận token tiết kiệm.
+        Số token của từng request đi vào trace (annotate), chatbot chỉ giữ tổng cộng dồn.
+        """
+        with timed("pack_context"):
+            packed, stats = pack_context(docs, parents=self.chunk_index.parents)
+        registry.inc("ptit_tokens_total", stats["tokens_out"], kind="context")
+        registry.inc("ptit_tokens_total", stats["tokens_saved"], kind="saved")
+        annotate(context_tokens=stats["tokens_out"], tokens_saved=stats["tokens_saved"])
+        with self._stats_lock:
+            self.context_stats["requests"] += 1
+            for key in ("tokens_in", "tokens_out", "tokens_saved"):
+                self.context_stats[key] += stats[key]
+        return packed
+
+    def _faq_exact(self, question: str):
+        with timed("faq_lookup"):
+            answer = self.faq.lookup(question, self.has_chunks)
+        if answer is not None:
+            annotate(cache="faq")
+        return answer
+
+    def _faq_semantic(self, query_vector):
+        with timed("faq_lookup"):
+            answer = self.faq.match(query_vector, self.has_chunks)
+        if answer is not None:
+            annotate(cache="faq")
+        return answer
+
+    def _prepare(self, question: str):
+        """Tra FAQ và cache rồi truy hồi. Trả về (câu trả lời có sẵn, các đoạn tài liệu, vector câu hỏi)."""
+        # Tầng 0: câu hỏi thường gặp đã sinh trước câu trả lời (faq_index.py)
+        cached = self._faq_exact(question)
+        if cached is not None:
+            return cached, None, None
+
+        # Tầng 1: câu hỏi giống hệt (sau chuẩn hóa) -> không tốn embedding/LLM
+        with timed("cache_exact"):
+            cached = self.answer_cache.get_exact(question)
+        if cached is not None:
+            annotate(cache="exact")
+            return cached, None, None
+
+        # Đường tắt từ vựng: BM25 đủ chắc chắn -> không cần gọi API embedding
+        lexical, confident = self._lexical_candidates(question)
+        if confident:
+            return None, self._select(question, lexical), None
+
+        # Tầng 2: câu hỏi gần giống -> chỉ tốn một lần embedding
+        with timed("embed_query"):
+            query_vector = self.embeddings.embed_query(question)
+        cached = self._faq_semantic(query_vector)
+        if cached is not None:
+            return cached, None, query_vector
+        with timed("cache_semantic"):
+            cached = self.answer_cache.get_semantic(query_vector)
+        if cached is not None:
+            annotate(cache="semantic")
+            return cached, None, query_vector
+
+        # Dùng lại vector vừa tính để tìm kiếm, tránh embed câu hỏi lần hai
+        with timed("vector_search"):
+            dense = self._dense_search(query_vector, self.config.candidate_k)
+        fused = reciprocal_rank_fusion([dense, lexical], k=self.reranker.candidates or self.config.retrieval_k)
+        return None, self._select(question, fused), query_vector
+
+    async def _aprepare(self, question: str):
+        """Bản async của _prepare"""
+        cached = self._faq_exact(question)
+        if cached is not None:
+            return cached, None, None
+
+        with timed("cache_exact"):
+            cached = self.answer_cache.get_exact(question)
+        if cached is not None:
+            annotate(cache="exact")
+            return cached, None, None
 
-    def get_answer(self, question: str):
-        """Truy vấn câu hỏi qua RAG"""
+        lexical, confident = self._lexical_candidates(question)
+        if confident:
+            return None, await asyncio.to_thread(self._select, question, lexical), None
+
+        with timed("embed_query"):
+            query_vector = await self.embeddings.aembed_query(question)
+        cached = self._faq_semantic(query_vector)
+        if cached is not None:
+            return cached, None, query_vector
+        with timed("cache_semantic"):
+            cached = self.answer_cache.get_semantic(query_vector)
+        if cached is not None:
+            annotate(cache="semantic")
+            return cached, None, query_vector
+
+        with timed("vector_search"):
+            if self.snapshot is not None:
+                dense = self._dense_search(query_vector, self.config.candidate_k)
+            else:
+                dense = await self.vector_store.asimilarity_search_by_vector(query_vector, k=self.config.candidate_k)
+        fused = reciprocal_rank_fusion([dense, lexical], k=self.reranker.candidates or self.config.retrieval_k)
+        return None, await asyncio.to_thread(self._select, question, fused), query_vector
+
+    def answer_with_sources(self, question: str):
+        """
+        Sinh câu trả lời mới bằng đúng truy hồi và prompt của chatbot nhưng bỏ qua FAQ và cache câu trả lời.
+        Trả về (câu trả lời, các đoạn nguồn đã chọn). Dùng khi sinh trước / sinh lại FAQ.
+        """
+        self.refresh_indexes()
+        lexical = self.lexical_index.search(question, self.config.candidate_k)
+        candidates = [doc for doc, _ in lexical]
+        if not self.lexical_index.is_confident(question, lexical):
+            dense = self._dense_search(self.embeddings.embed_query(question), self.config.candidate_k)
+            candidates = reciprocal_rank_fusion([dense, candidates],
+                                                k=self.reranker.candidates or self.config.retrieval_k)
+        docs = self._select(question, candidates)
+        packed, _ = pack_context(docs, parents=self.chunk_index.parents)
+        response = self.qa_chain.combine_documents_chain.invoke({"input_documents": packed, "question": question})
+        return response["output_text"].strip(), docs
+
+    # === BỘ NHỚ HỘI THOẠI THEO PHIÊN ===
+    def _standalone(self, question: str, session_id):
+        """Câu hỏi nối tiếp ("còn học phí của nó?") được viết lại thành câu hỏi đầy đủ trước khi truy hồi."""
+        if session_id is None:
+            return question
+        try:
+            standalone = self.memory.standalone_question(session_id, question)
+        except ServerBusy:
+            raise
+        except Exception as e:
+            registry.inc("ptit_errors_total", stage="rewrite_question")
+            print(f"⚠️ Không viết lại được câu hỏi, dùng nguyên văn: {e}")
+            return question
+        if standalone != question:
+            annotate(rewritten_question=standalone)
+        return standalone
+
+    def _remember(self, session_id, question: str, answer: str):
+        """Chỉ gọi cho câu trả lời thành công: lỗi (kể cả lỗi giữa chừng khi stream) không vào bộ nhớ hội thoại."""
+        if session_id is not None:
+            self.memory.add_turn(session_id, question, answer)
+
+    async def aget_answer(self, question: str, session_id=None):
+        """Bản async của get_answer: embedding, tìm kiếm và LLM đều không chặn event loop"""
+        standalone = await asyncio.to_thread(self._standalone, question, session_id)
+        answer, ok = await self._aanswer(standalone)
+        if ok:
+            self._remember(session_id, question, answer)
+        return answer
+
+    async def _aanswer(self, question: str):
+        try:
+            cached, docs, query_vector = await self._aprepare(question)
+            if cached is not None:
+                return cached, True
+
+            packed = self._pack(docs)
+            with timed("llm"):
+                response = await self.qa_chain.combine_documents_chain.ainvoke(
+                    {"input_documents": packed, "question": question}
+                )
+            answer = response["output_text"].strip()
+            registry.inc("ptit_tokens_total", count_tokens(answer), kind="completion")
+            self.answer_cache.put(question, answer, query_vector)
+            return answer, True
+        except Exception as e:
+            registry.inc("ptit_errors_total", stage="get_answer")
+            return f"Lỗi khi truy vấn RAG: {str(e)}", False
+
+    def get_answer(self, question: str, session_id=None):
+        """
+        Truy vấn câu hỏi qua RAG (có cache câu trả lời phía trước).
+        Có `session_id` thì dùng bộ nhớ hội thoại của phiên đó để hiểu câu hỏi nối tiếp.
+        """
+        answer, ok = self._answer(self._standalone(question, session_id))
+        if ok:
+            self._remember(session_id, question, answer)
+        return answer
+
+    def _answer(self, question: str):
         try:
-            response = self.qa_chain.invoke({"query": question})
-            return response["result"].strip()
+            cached, docs, query_vector = self._prepare(question)
+            if cached is not None:
+                return cached, True
+
+            packed = self._pack(docs)
+            with self.llm_slot(), timed("llm"):
+                response = self.qa_chain.combine_documents_chain.invoke(
+                    {"input_documents": packed, "question": question}
+                )
+            answer = response["output_text"].strip()
+            registry.inc("ptit_tokens_total", count_tokens(answer), kind="completion")
+            self.answer_cache.put(question, answer, query_vector)
+            return answer, True
+        except ServerBusy:
+            raise
+        except Exception as e:
+            registry.inc("ptit_errors_total", stage="get_answer")
+            return f"Lỗi khi truy vấn RAG: {str(e)}", False
+
+    def stream_answer(self, question: str, session_id=None):
+        """Giống get_answer nhưng yield từng token ngay khi LLM sinh ra"""
+        parts, status = [], {"failed": False}
+        for token in self._stream(self._standalone(question, session_id), status):
+            parts.append(token)
+            yield token
+        if not status["failed"]:
+            self._remember(session_id, question, "".join(parts).strip())
+
+    def _stream(self, question: str, status):
+        """Yield từng token; lỗi (trước hoặc giữa chừng) thì yield thông báo lỗi và đặt status["failed"]."""
+        try:
+            cached, docs, query_vector = self._prepare(question)
+            if cached is not None:
+                yield cached
+                return
+
+            context = format_context(self._pack(docs))
+            parts = []
+            # Slot được giữ tới khi stream xong (hoặc client ngắt kết nối và generator bị đóng)
+            with self.llm_slot():
+                start = time.perf_counter()
+                for chunk in self.llm.stream(self.prompt.format(context=context, question=question)):
+                    if chunk.content:
+                        if not parts:
+                            observe_stage("llm_first_token", time.perf_counter() - start)
+                        parts.append(chunk.content)
+                        yield chunk.content
+                observe_stage("llm", time.perf_counter() - start)
+            answer = "".join(parts).strip()
+            registry.inc("ptit_tokens_total", count_tokens(answer), kind="completion")
+            self.answer_cache.put(question, answer, query_vector)
+        except ServerBusy:
+            raise
         except Exception as e:
-            return f"Lỗi khi truy vấn RAG: {str(e)}"
+            status["failed"] = True
+            registry.inc("ptit_errors_total", stage="get_answer")
+            yield f"Lỗi khi truy vấn RAG: {str(e)}"
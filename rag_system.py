@@ -1,170 +1,351 @@
 import glob
 import os
 import shutil
-import hashlib
+from contextlib import contextmanager
 from dotenv import load_dotenv
-from langchain_community.document_loaders import (
-    DirectoryLoader, TextLoader, PyPDFLoader, Docx2txtLoader, CSVLoader
-)
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_chroma import Chroma
-from langchain_openai import OpenAIEmbeddings
+
+from answer_cache import bump_knowledge_version
+from config import settings
+from embedding_cache import CachedEmbeddings, compute_hash
+from embedding_client import EMBEDDING_BACKEND, BatchedEmbeddings, embedding_cache_key, make_embeddings
+from doc_loader import iter_split_file
+from metrics import registry
+from ingest_pipeline import MemoryGuard, StageTimer, iter_file_chunks, list_doc_files, partition_stream_files
+from vector_snapshot import build_snapshot, current_snapshot_path
+from file_lock import FileLock
+from kb_versions import (
+    activate_kb_version, discard_kb_version, new_kb_version, resolve_kb_path, unfinished_kb_version
+)
+from kb_sync import (
+    SourceReadError, SyncManifest, manifest_path_for, apply_file_chunks, apply_file_stream, remove_file_chunks,
+    stream_signature
+)
 
 # --- Load OpenAI API key ---
 load_dotenv()
-if "OPENAI_API_KEY" not in os.environ:
-    print("Lỗi: OPENAI_API_KEY chưa được thiết lập. Vui lòng tạo file .env và thêm key vào.")
-    exit()
-
-# --- Cấu hình ---
-EMBEDDING_MODEL = "text-embedding-3-small"
-CHROMA_DB_PATH = "./knowledge_base_ptit"
-OLD_DOCS_DIR = "./old_docs"
-NEW_DOCS_DIR = "./new_docs"
-
-# === TIỆN ÍCH HASH ĐỂ PHÁT HIỆN TRÙNG LẶP ===
-def compute_hash(text: str) -> str:
-    return hashlib.sha256(text.encode("utf-8")).hexdigest()
-
-# === LOAD FILE ĐA ĐỊNH DẠNG ===
-def load_text_from_file(file_path: str):
-    ext = os.path.splitext(file_path)[1].lower()
+# Không exit(): module này còn được import trong thread nạp tri thức của app.py, lỗi phải đi về job
+if EMBEDDING_BACKEND != "local" and "OPENAI_API_KEY" not in os.environ:
+    raise RuntimeError("OPENAI_API_KEY chưa được thiết lập. Vui lòng tạo file .env và thêm key vào.")
+
+# --- Cấu hình (config.py, dùng chung với app.py và main.py) ---
+EMBEDDING_MODEL = settings.embedding_model
+CHROMA_DB_PATH = settings.chroma_db_path
+OLD_DOCS_DIR = settings.old_docs_dir
+NEW_DOCS_DIR = settings.new_docs_dir
+
+KB_WRITE_LOCK = settings.kb_write_lock
+
+# Mọi thao tác ghi vào Knowledge Base (upload, dựng lại, chạy tay từ CLI) đi lần lượt qua khóa file này,
+# kể cả khi chúng nằm ở các tiến trình khác nhau
+_kb_write_lock = FileLock(KB_WRITE_LOCK)
+
+# === EMBEDDING CÓ CACHE THEO HASH ĐOẠN VĂN ===
+# compute_hash (SHA-256 của đoạn văn) dùng chung cho phát hiện trùng lặp và cache embedding
+def get_embeddings(embedding_model: str):
+    """Embedding gom lô/song song, bọc cache đĩa: rebuild/upload lại chỉ embed đoạn văn mới."""
+    return CachedEmbeddings(make_embeddings(embedding_model), embedding_cache_key(embedding_model))
+
+@contextmanager
+def report_embedded(vector_store: Chroma, progress):
+    """
+    Trong khối này, mỗi lô embed thành công của `vector_store` được báo qua progress("chunks_embedded", n).
+    Chỉ đếm đoạn thực sự gửi đi embed: đoạn đã có trong cache embedding đĩa được ghi mà không embed lại.
+    """
+    embeddings = getattr(vector_store.embeddings, "underlying", None)
+    if not isinstance(embeddings, BatchedEmbeddings):
+        yield
+        return
+    embeddings.on_batch = lambda n: progress("chunks_embedded", n)
     try:
-        if ext == ".txt":
-            loader = TextLoader(file_path, encoding="utf-8")
-        elif ext == ".pdf":
-            loader = PyPDFLoader(file_path)
-        elif ext == ".docx":
-            loader = Docx2txtLoader(file_path)
-        elif ext == ".csv":
-            # Chỉ dùng nếu CSV chứa văn bản (không phải dữ liệu bảng)
-            loader = CSVLoader(file_path)
-        else:
-            print(f"❌ Bỏ qua file không hỗ trợ: {file_path}")
-            return []
-        return loader.load()
-    except Exception as e:
-        print(f"⚠️ Lỗi đọc file {file_path}: {e}")
-        return []
+        yield
+    finally:
+        embeddings.on_batch = None
+
+# === CÔNG BỐ THAY ĐỔI TRI THỨC ===
+def publish_knowledge_update(vector_store: Chroma):
+    """Xuất lại snapshot vector rồi tăng phiên bản tri thức để cache/chỉ mục tự làm mới."""
+    build_snapshot(vector_store)
+    bump_knowledge_version()
 
 # === XỬ LÝ VĂN BẢN ===
 def load_and_process_documents(docs_dir: str):
-    """Đọc & chia nhỏ tài liệu"""
-    documents = []
-    for filename in os.listdir(docs_dir):
-        path = os.path.join(docs_dir, filename)
-        if os.path.isfile(path):
-            docs = load_text_from_file(path)
-            for d in docs:
-                d.metadata["file_name"] = filename
-            documents.extend(docs)
-
-    if not documents:
-        return [], []
-
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-    chunks = text_splitter.split_documents(documents)
-    return chunks, [os.path.join(docs_dir, f) for f in os.listdir(docs_dir)]
+    """Đọc & chia nhỏ tài liệu (song song qua pipeline, gom kết quả thành list)"""
+    files = list_doc_files(docs_dir)
+    chunks = []
+    for _, _, file_chunks in iter_file_chunks(files):
+        chunks.extend(file_chunks)
+    return chunks, [path for _, path in files]
+
+# === ĐỒNG BỘ TĂNG DẦN THEO TỪNG FILE ===
+def sync_docs_directory(vector_store: Chroma, docs_dir: str, db_path: str = CHROMA_DB_PATH, publish: bool = True):
+    """
+    Đồng bộ Knowledge Base với thư mục tài liệu theo manifest.
+    Chỉ file mới/thay đổi mới bị đọc lại; file bị xóa thì xóa các đoạn của nó.
+    `publish=False` khi đang dựng một phiên bản chưa được kích hoạt.
+    """
+    manifest = SyncManifest(manifest_path_for(resolve_kb_path(db_path)))
+    if not manifest.exists:
+        # DB cũ (tạo trước khi có manifest) dùng ID ngẫu nhiên -> dọn một lần rồi nạp lại theo ID ổn định
+        legacy_ids = vector_store.get(include=[])["ids"]
+        if legacy_ids:
+            print(f"♻️ Dọn {len(legacy_ids)} đoạn cũ chưa có manifest...")
+            vector_store.delete(ids=legacy_ids)
+
+    files = list_doc_files(docs_dir)
+    current = dict(files)
+    timer = StageTimer()
+
+    added = deleted = changed_files = 0
+    with timer.stage("delete"):
+        for filename in list(manifest.files):
+            if filename not in current:
+                deleted += remove_file_chunks(vector_store, manifest, filename)
+                changed_files += 1
+                print(f"🗑️ Đã gỡ tri thức của file bị xóa: {filename}")
+
+    with timer.stage("scan"):
+        changed = [(f, p) for f, p in files if not manifest.is_unchanged(f, p)]
+
+    streamed, pooled = partition_stream_files(changed)
+    guard = MemoryGuard()
+
+    # File nhỏ: đọc + chia nhỏ song song, embed + ghi từng file ngay khi file đó xong
+    for filename, path, chunks in iter_file_chunks(pooled, timer=timer):
+        with timer.stage("embed+write"):
+            a, d = apply_file_chunks(vector_store, manifest, filename, path, chunks)
+        manifest.save()
+        guard.check(filename)
+        added += a
+        deleted += d
+        changed_files += 1
+        print(f"🔄 {filename}: +{a} / -{d} đoạn")
+
+    # File lớn/CSV: đọc dần theo trang/dòng, ghi theo lô có checkpoint
+    for filename, path in streamed:
+        try:
+            with timer.stage("stream"):
+                a, d = apply_file_stream(vector_store, manifest, filename, path, iter_split_file(path, filename),
+                                         stream_signature(path), on_batch=lambda n, f=filename: guard.check(f))
+        except MemoryError:
+            raise
+        except Exception as e:
+            print(f"⚠️ Lỗi khi nạp dần {filename}: {e} (giữ checkpoint, lần sau chạy tiếp)")
+            continue
+        manifest.save()
+        added += a
+        deleted += d
+        changed_files += 1
+        print(f"🔄 {filename} (đọc dần): +{a} / -{d} đoạn")
+
+    manifest.save()
+    if changed_files and publish:
+        publish_knowledge_update(vector_store)
+    registry.inc("ptit_ingest_chunks_total", added, op="added")
+    registry.inc("ptit_ingest_chunks_total", deleted, op="deleted")
+    print(f"✅ Đồng bộ xong: {changed_files} file thay đổi, +{added} / -{deleted} đoạn.")
+    print(f"⏱️ {timer.report()}")
+    return added, deleted
 
 # === KHỞI TẠO VECTOR STORE ===
 def initialize_vector_store(db_path: str, embedding_model: str, docs_dir: str):
-    embeddings = OpenAIEmbeddings(model=embedding_model)
-
-    if os.path.exists(db_path):
-        print(f"Đang load Knowledge Base từ '{db_path}'...")
-        vector_store = Chroma(persist_directory=db_path, embedding_function=embeddings)
-    else:
-        print(f"Tạo mới Knowledge Base từ '{docs_dir}'...")
-        chunks, _ = load_and_process_documents(docs_dir)
-        vector_store = Chroma.from_documents(chunks, embedding=embeddings, persist_directory=db_path)
-        print(f"✅ Knowledge Base đã được tạo và lưu vào '{db_path}'.")
+    path = resolve_kb_path(db_path)
+    if os.path.exists(manifest_path_for(path)):
+        print(f"Đang load Knowledge Base từ '{path}'...")
+        vector_store = Chroma(persist_directory=path, embedding_function=get_embeddings(embedding_model))
+        if current_snapshot_path() is None:
+            publish_knowledge_update(vector_store)
+        return vector_store
 
+    print(f"Tạo mới Knowledge Base từ '{docs_dir}'...")
+    vector_store = rebuild_knowledge_base(db_path, embedding_model, docs_dir)
+    print(f"✅ Knowledge Base đã được tạo và lưu vào '{resolve_kb_path(db_path)}'.")
     return vector_store
 
 
+# === DỰNG LẠI TOÀN BỘ: PHIÊN BẢN MỚI + ĐỔI CON TRỎ ===
+def rebuild_knowledge_base(db_path: str = CHROMA_DB_PATH, embedding_model: str = EMBEDDING_MODEL,
+                           docs_dir: str = OLD_DOCS_DIR):
+    """
+    Dựng Knowledge Base từ `docs_dir` vào một thư mục phiên bản mới nằm cạnh bản đang phục vụ,
+    rồi mới đổi con trỏ. Trong lúc dựng, chatbot vẫn trả lời từ bản cũ; bản cũ không bị xóa.
+    Bản mới được sao từ bản đang phục vụ (Chroma + manifest + chỉ mục đoạn), nên chỉ các file đã thêm/sửa/xóa
+    trong `docs_dir` được đọc và embed lại; đoạn văn không đổi còn lại lấy embedding từ cache đĩa.
+    Lần dựng trước bị dừng giữa chừng (sập tiến trình, vượt trần bộ nhớ) thì đi tiếp trên thư mục dở đó.
+    """
+    with _kb_write_lock:
+        os.makedirs(db_path, exist_ok=True)
+        path = unfinished_kb_version(db_path)
+        if path:
+            print(f"⏯️ Tiếp tục dựng Knowledge Base dở: '{path}'.")
+        else:
+            live = resolve_kb_path(db_path)
+            seed = live if os.path.exists(manifest_path_for(live)) else None
+            path = new_kb_version(db_path, seed_from=seed)
+            if seed:
+                print(f"📋 Sao chép Knowledge Base đang phục vụ '{seed}' sang '{path}', chỉ đồng bộ phần khác biệt.")
+        try:
+            vector_store = Chroma(persist_directory=path, embedding_function=get_embeddings(embedding_model))
+            sync_docs_directory(vector_store, docs_dir, path, publish=False)
+        except MemoryError:
+            raise  # giữ thư mục dở để lần sau chạy tiếp từ checkpoint
+        except Exception:
+            discard_kb_version(db_path, path)
+            raise
+        activate_kb_version(db_path, path)
+        publish_knowledge_update(vector_store)
+        return vector_store
+
+
 # === CẬP NHẬT DATABASE (PHIÊN BẢN XÓA FILE LỖI/TRÙNG LẶP) ===
-def check_and_update_database(vector_store: Chroma, new_docs_dir: str, old_docs_dir: str):
+def _remove_file(path: str, reason: str):
+    try:
+        if os.path.exists(path):
+            os.remove(path)
+            print(f"🗑️ Đã xóa file {reason}: {os.path.basename(path)}")
+    except Exception as e:
+        print(f"⚠️ Lỗi khi xóa file {os.path.basename(path)}: {e}")
+
+def check_and_update_database(vector_store: Chroma, new_docs_dir: str, old_docs_dir: str,
+                              db_path: str = CHROMA_DB_PATH, progress=None):
     """
-    Cập nhật DB.
-    - File mới, hợp lệ -> Chuyển vào old_docs.
+    Cập nhật DB, xử lý từng file một.
+    - File mới, hợp lệ -> Thêm các đoạn chưa có, chuyển vào old_docs.
+    - File trùng tên với file đã có -> Thay thế các đoạn của file cũ.
     - File lỗi hoặc nội dung trùng lặp -> Xóa vĩnh viễn.
+    File lớn/CSV (ingest_pipeline.should_stream) được đọc dần theo trang/dòng và ghi theo lô có checkpoint;
+    trùng lặp được kiểm tra qua chỉ mục hash trên đĩa (ChunkIndex), không tải metadata từ Chroma.
+    `progress(tên_bộ_đếm, số_lượng)` (tùy chọn) nhận tiến độ cho job chạy nền.
     """
+    progress = progress or (lambda name, n=1: None)
     if not os.path.exists(new_docs_dir) or not os.listdir(new_docs_dir):
         print("📂 Không có file mới trong 'new_docs'.")
         return
 
-    new_chunks, processed_files = load_and_process_documents(new_docs_dir)
-    
-    # --- XỬ LÝ TRƯỜNG HỢP FILE BỊ LỖI, KHÔNG ĐỌC ĐƯỢC ---
-    if not new_chunks:
-        print("⚙️ Không có nội dung hợp lệ hoặc không thể đọc được file.")
-        for f in processed_files:
-            try:
-                if os.path.exists(f):
-                    os.remove(f)
-                    print(f"🗑️ Đã xóa file lỗi: {os.path.basename(f)}")
-            except Exception as e:
-                print(f"⚠️ Lỗi khi xóa file {os.path.basename(f)}: {e}")
-        return
+    manifest = SyncManifest(manifest_path_for(resolve_kb_path(db_path)))
+    os.makedirs(old_docs_dir, exist_ok=True)
+    timer = StageTimer()
+    guard = MemoryGuard()
+    moved = 0
+    streamed, pooled = partition_stream_files(list_doc_files(new_docs_dir))
 
-    # --- XỬ LÝ KIỂM TRA TRÙNG LẶP NỘI DUNG ---
-    existing_hashes = set()
-    try:
-        existing_docs = vector_store.get(include=["metadatas"])
-        for meta in existing_docs["metadatas"]:
-            if "hash" in meta:
-                existing_hashes.add(meta["hash"])
-    except Exception:
-        pass
-
-    unique_chunks = []
-    for chunk in new_chunks:
-        h = compute_hash(chunk.page_content)
-        if h not in existing_hashes:
-            chunk.metadata["hash"] = h
-            unique_chunks.append(chunk)
-            existing_hashes.add(h)
-
-    # --- QUYẾT ĐỊNH XÓA HAY DI CHUYỂN DỰA TRÊN KẾT QUẢ ---
-    
-    # Trường hợp 1: Có nội dung mới, hợp lệ
-    if unique_chunks:
-        print(f"🧠 Đang thêm {len(unique_chunks)} đoạn mới...")
-        vector_store.add_documents(unique_chunks)
-        
-        # Di chuyển file gốc vào old_docs để lưu trữ
-        os.makedirs(old_docs_dir, exist_ok=True)
-        for f in processed_files:
-            if os.path.exists(f):
-                shutil.move(f, os.path.join(old_docs_dir, os.path.basename(f)))
-        
-        print(f"🎉 Đã thêm tri thức mới và di chuyển {len(processed_files)} file gốc sang 'old_docs'.")
-
-    # Trường hợp 2: Toàn bộ nội dung đều đã tồn tại (trùng lặp)
-    else:
-        print("✅ Toàn bộ nội dung trong file đã tồn tại trong tri thức.")
-        for f in processed_files:
-            try:
-                if os.path.exists(f):
-                    os.remove(f)
-                    print(f"🗑️ Đã xóa file trùng lặp: {os.path.basename(f)}")
-            except Exception as e:
-                print(f"⚠️ Lỗi khi xóa file {os.path.basename(f)}: {e}")
+    for filename, path, chunks in iter_file_chunks(pooled, timer=timer):
+        guard.check(filename)
+        progress("files_parsed", 1)
+        # --- XỬ LÝ TRƯỜNG HỢP FILE BỊ LỖI, KHÔNG ĐỌC ĐƯỢC ---
+        if not chunks:
+            print(f"⚙️ Không có nội dung hợp lệ hoặc không thể đọc được file {filename}.")
+            _remove_file(path, "lỗi")
+            continue
+
+        target = os.path.join(old_docs_dir, filename)
+        # --- FILE THAY THẾ BẢN CŨ CÙNG TÊN: chỉ thêm/xóa các đoạn khác biệt ---
+        if filename in manifest.files:
+            shutil.move(path, target)
+            with timer.stage("embed+write"):
+                a, d = apply_file_chunks(vector_store, manifest, filename, target, chunks)
+            progress("chunks_written", a)
+            registry.inc("ptit_ingest_chunks_total", a, op="added")
+            registry.inc("ptit_ingest_chunks_total", d, op="deleted")
+            manifest.save()
+            print(f"🔄 Đã cập nhật {filename}: +{a} / -{d} đoạn.")
+            moved += 1
+            continue
+
+        # --- XỬ LÝ KIỂM TRA TRÙNG LẶP NỘI DUNG ---
+        with timer.stage("dedup"):
+            existing_hashes = manifest.chunks.existing_hashes([c.metadata["hash"] for c in chunks], filename)
+        unique_chunks = [c for c in chunks if c.metadata["hash"][:32] not in existing_hashes]
+
+        # Trường hợp 1: Có nội dung mới, hợp lệ
+        if unique_chunks:
+            print(f"🧠 Đang thêm {len(unique_chunks)} đoạn mới từ {filename}...")
+            shutil.move(path, target)
+            with timer.stage("embed+write"):
+                a, _ = apply_file_chunks(vector_store, manifest, filename, target, unique_chunks)
+            progress("chunks_written", a)
+            registry.inc("ptit_ingest_chunks_total", a, op="added")
+            manifest.save()
+            moved += 1
+        # Trường hợp 2: Toàn bộ nội dung đều đã tồn tại (trùng lặp)
+        else:
+            print(f"✅ Toàn bộ nội dung trong {filename} đã tồn tại trong tri thức.")
+            _remove_file(path, "trùng lặp")
+
+    # --- FILE LỚN/CSV: đọc dần, bỏ đoạn trùng theo chỉ mục hash trên đĩa, ghi theo lô có checkpoint ---
+    def on_batch(n, filename):
+        progress("chunks_written", n)
+        guard.check(filename)
+
+    interrupted = []
+    for filename, path in streamed:
+        replacing = filename in manifest.files
+        try:
+            with timer.stage("stream"):
+                a, d = apply_file_stream(
+                    vector_store, manifest, filename, path, iter_split_file(path, filename), stream_signature(path),
+                    skip_duplicates=not replacing, on_batch=lambda n, f=filename: on_batch(n, f),
+                )
+        except MemoryError:
+            raise
+        except SourceReadError as e:
+            # File hỏng: bỏ phần đã nạp và xóa file upload
+            print(f"⚠️ Lỗi đọc file {filename}: {e}")
+            if replacing:
+                manifest.forget(filename)  # nạp dở: lần đồng bộ sau đọc lại toàn bộ file cũ
+            else:
+                remove_file_chunks(vector_store, manifest, filename)
+            manifest.save()
+            _remove_file(path, "lỗi")
+            continue
+        except Exception as e:
+            # Lỗi embed/ghi (429, mạng...): giữ file trong new_docs và checkpoint, lần chạy sau nạp tiếp từ lô dở
+            print(f"⚠️ Lỗi khi ghi {filename} vào tri thức, sẽ nạp tiếp từ checkpoint ở lần sau: {e}")
+            manifest.save()
+            interrupted.append(filename)
+            continue
+        progress("files_parsed", 1)
+        registry.inc("ptit_ingest_chunks_total", a, op="added")
+        registry.inc("ptit_ingest_chunks_total", d, op="deleted")
+        if not replacing and not a:
+            print(f"✅ {filename} không có nội dung mới (trùng lặp hoặc rỗng).")
+            manifest.forget(filename)
+            manifest.save()
+            _remove_file(path, "trùng lặp")
+            continue
+        target = os.path.join(old_docs_dir, filename)
+        shutil.move(path, target)
+        manifest.record(filename, target)
+        manifest.save()
+        print(f"🔄 Đã nạp dần {filename}: +{a} / -{d} đoạn.")
+        moved += 1
+
+    manifest.save()
+    if moved:
+        publish_knowledge_update(vector_store)
+        print(f"🎉 Đã thêm tri thức mới và di chuyển {moved} file gốc sang 'old_docs'.")
+    print(f"⏱️ {timer.report()} | RSS đỉnh: {guard.peak_mb:.0f} MB")
+    if interrupted:
+        # Để job nền báo lỗi thay vì "hoàn tất" khi còn file nạp dở
+        raise RuntimeError(f"Chưa nạp xong {len(interrupted)} file (giữ lại để nạp tiếp): {', '.join(interrupted)}")
 
 
 # === HÀM GỌI TỪ FLASK ===
-def update_knowledge_base_auto():
-    """Hàm tự động cập nhật khi upload từ Flask"""
+def update_knowledge_base_auto(progress=None):
+    """Hàm tự động cập nhật khi upload từ Flask (chạy trong worker nền)"""
     os.makedirs(OLD_DOCS_DIR, exist_ok=True)
     os.makedirs(NEW_DOCS_DIR, exist_ok=True)
-    db = initialize_vector_store(CHROMA_DB_PATH, EMBEDDING_MODEL, OLD_DOCS_DIR)
-    check_and_update_database(db, NEW_DOCS_DIR, OLD_DOCS_DIR)
+    with _kb_write_lock:
+        db = initialize_vector_store(CHROMA_DB_PATH, EMBEDDING_MODEL, OLD_DOCS_DIR)
+        with report_embedded(db, progress or (lambda name, n=1: None)):
+            check_and_update_database(db, NEW_DOCS_DIR, OLD_DOCS_DIR, progress=progress)
 
 # === MAIN CHẠY ĐỘC LẬP ===
 if __name__ == "__main__":
     print("=== BẮT ĐẦU CẬP NHẬT CƠ SỞ TRI THỨC ===\n")
     os.makedirs(OLD_DOCS_DIR, exist_ok=True)
     os.makedirs(NEW_DOCS_DIR, exist_ok=True)
-    db = initialize_vector_store(CHROMA_DB_PATH, EMBEDDING_MODEL, OLD_DOCS_DIR)
-    check_and_update_database(db, NEW_DOCS_DIR, OLD_DOCS_DIR)
+    with _kb_write_lock:
+        db = initialize_vector_store(CHROMA_DB_PATH, EMBEDDING_MODEL, OLD_DOCS_DIR)
+        check_and_update_database(db, NEW_DOCS_DIR, OLD_DOCS_DIR)
     print("\n=== HOÀN TẤT ===")
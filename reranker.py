@@ -0,0 +1,202 @@
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from config import Settings, settings
+from lexical_index import tokenize
+from metrics import annotate, registry, timed
+
+# --- Cấu hình ---
+RERANKER = settings.reranker                              # "lexical", "cross-encoder" hoặc "off"
+RERANK_MODEL = settings.rerank_model
+RERANK_CANDIDATES = settings.rerank_candidates            # số ứng viên lấy dư trước khi chấm lại
+RERANK_BUDGET_MS = settings.rerank_budget_ms              # quá hạn thì dùng thứ tự truy hồi ban đầu
+RERANK_MIN_K = settings.rerank_min_k
+RERANK_MAX_K = settings.rerank_max_k
+RERANK_RELATIVE_CUTOFF = settings.rerank_relative_cutoff  # bỏ đoạn có điểm < 60% đoạn đầu
+RERANK_GAP = settings.rerank_gap                          # khoảng rơi điểm (thang 0-1) để cắt
+RERANK_WORKERS = settings.rerank_workers                  # số lượt cross-encoder chạy song song
+
+registry.describe("ptit_rerank_total", "Số lần chấm lại theo kết quả (ok, timeout, error, busy)")
+registry.describe("ptit_rerank_docs_total", "Số đoạn trước/sau khi chấm lại và chọn k")
+
+
+def choose_k(scores, min_k=RERANK_MIN_K, max_k=RERANK_MAX_K,
+             relative_cutoff=RERANK_RELATIVE_CUTOFF, gap=RERANK_GAP):
+    """
+    Chọn k từ dãy điểm (thang 0-1) đã xếp giảm dần: dừng ở khoảng rơi điểm lớn đầu tiên
+    hoặc khi điểm tụt dưới `relative_cutoff` lần điểm cao nhất. Câu hỏi dễ (một đoạn trội hẳn) lấy ít đoạn.
+    """
+    if not scores:
+        return 0
+    k = 1
+    while k < min(max_k, len(scores)):
+        if scores[k] < relative_cutoff * scores[0] or scores[k - 1] - scores[k] >= gap:
+            break
+        k += 1
+    return max(k, min(min_k, len(scores)))
+
+
+class LexicalScorer:
+    """
+    Chấm độ phủ từ khóa có trọng số idf: tổng idf các token của câu hỏi có trong đoạn / tổng idf của câu hỏi.
+    Token gồm cả bigram âm tiết (xem lexical_index.tokenize) nên cụm từ đứng liền nhau được cộng thêm.
+    `idf` lấy từ chỉ mục BM25 toàn kho nếu có, nếu không thì tính trên chính tập ứng viên.
+    """
+    name = "lexical"
+
+    def __init__(self, idf=None):
+        self.idf = idf
+
+    def score(self, question, docs, deadline=None):
+        query = set(tokenize(question))
+        doc_tokens = [set(tokenize(d.page_content)) for d in docs]
+        idf = self.idf or _local_idf(doc_tokens)
+        weights = {t: idf(t) for t in query}
+        total = sum(weights.values()) or 1.0
+        scores = []
+        for tokens in doc_tokens:
+            if deadline is not None and time.perf_counter() > deadline:
+                raise FutureTimeout()
+            scores.append(sum(w for t, w in weights.items() if t in tokens) / total)
+        return scores
+
+
+def _local_idf(doc_tokens):
+    n = len(doc_tokens)
+    df = {}
+    for tokens in doc_tokens:
+        for t in tokens:
+            df[t] = df.get(t, 0) + 1
+    return lambda t: math.log(1 + (n - df.get(t, 0) + 0.5) / (df.get(t, 0) + 0.5))
+
+
+class CrossEncoderScorer:
+    """Cross-encoder cục bộ (sentence-transformers, CPU). Nạp model ở thread nền; chưa nạp xong thì báo chưa sẵn sàng."""
+    name = "cross-encoder"
+
+    def __init__(self, model_name=RERANK_MODEL):
+        self.model_name = model_name
+        self.model = None
+        threading.Thread(target=self._load, daemon=True, name="reranker-load").start()
+
+    def _load(self):
+        try:
+            from sentence_transformers import CrossEncoder
+            self.model = CrossEncoder(self.model_name, device="cpu")
+            print(f"✅ Đã nạp reranker '{self.model_name}'.")
+        except Exception as e:
+            print(f"⚠️ Không nạp được reranker '{self.model_name}', dùng chấm điểm từ khóa: {e}")
+
+    @property
+    def ready(self):
+        return self.model is not None
+
+    def score(self, question, docs, deadline=None):
+        logits = self.model.predict([(question, d.page_content) for d in docs])
+        return [1.0 / (1.0 + math.exp(-float(x))) for x in logits]
+
+
+class Reranker:
+    """
+    Chấm lại các ứng viên đã truy hồi rồi chọn k thích ứng (choose_k), gói trong ngân sách độ trễ:
+    - Chấm từ khóa chạy ngay trong thread của request, tự kiểm tra hạn chót sau mỗi đoạn.
+    - Cross-encoder chạy trên pool `rerank_workers` thread, chờ tối đa `rerank_budget_ms`; pool còn bận với
+      các lượt đã quá hạn thì không xếp hàng thêm.
+    - Quá hạn, lỗi hoặc pool bận: trả về `fallback_k` đoạn đầu theo thứ tự truy hồi ban đầu.
+    - Cross-encoder chưa nạp xong (hoặc không cài sentence-transformers) thì dùng LexicalScorer.
+    - Chi phí từng request (ms, số đoạn vào/ra, kết quả) ghi vào /metrics, trace và stats().
+    Các ngưỡng (số ứng viên, ngân sách, choose_k, model) lấy từ `config`; `mode` truyền vào thì ghi đè `config.reranker`.
+    """
+
+    def __init__(self, mode=None, idf=None, config: Settings = settings):
+        self.config = config
+        self.mode = mode or config.reranker
+        self.budget = config.rerank_budget_ms / 1000.0
+        self.lexical = LexicalScorer(idf)
+        self.cross = CrossEncoderScorer(config.rerank_model) if self.mode == "cross-encoder" else None
+        self._pool = ThreadPoolExecutor(max_workers=config.rerank_workers, thread_name_prefix="reranker")
+        self._slots = threading.BoundedSemaphore(config.rerank_workers)
+        self._lock = threading.Lock()
+        self.counts = {"ok": 0, "timeout": 0, "error": 0, "busy": 0}
+        self.total_ms = 0.0
+        self.docs_in = 0
+        self.docs_out = 0
+
+    @property
+    def enabled(self):
+        return self.mode != "off"
+
+    @property
+    def candidates(self):
+        """Số ứng viên nên lấy từ bước truy hồi."""
+        return self.config.rerank_candidates if self.enabled else None
+
+    def _scorer(self):
+        if self.cross is not None and self.cross.ready:
+            return self.cross
+        return self.lexical
+
+    def rerank(self, question, docs, fallback_k):
+        """Trả về các đoạn đã chọn (xếp theo điểm mới); bị tắt hoặc quá hạn thì là `docs[:fallback_k]`."""
+        if not self.enabled or len(docs) <= 1:
+            return docs[:fallback_k]
+        scorer = self._scorer()
+        start = time.perf_counter()
+        deadline = start + self.budget
+        outcome, selected = "ok", docs[:fallback_k]
+        with timed("rerank"):
+            try:
+                scores = self._run(scorer, question, docs, deadline)
+                if scores is None:
+                    outcome = "busy"
+                else:
+                    ranked = sorted(zip(scores, range(len(docs))), key=lambda x: (-x[0], x[1]))
+                    k = choose_k([sc for sc, _ in ranked], self.config.rerank_min_k, self.config.rerank_max_k,
+                                 self.config.rerank_relative_cutoff, self.config.rerank_gap)
+                    selected = [docs[i] for _, i in ranked[:k]]
+            except FutureTimeout:
+                outcome = "timeout"
+            except Exception as e:
+                outcome = "error"
+                print(f"⚠️ Lỗi khi chấm lại ứng viên, dùng thứ tự truy hồi: {e}")
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        registry.inc("ptit_rerank_total", outcome=outcome, scorer=scorer.name)
+        registry.inc("ptit_rerank_docs_total", len(docs), stage="in")
+        registry.inc("ptit_rerank_docs_total", len(selected), stage="out")
+        annotate(rerank_ms=round(elapsed_ms, 3), rerank_outcome=outcome, rerank_scorer=scorer.name,
+                 rerank_in=len(docs), rerank_k=len(selected))
+        with self._lock:
+            self.counts[outcome] += 1
+            self.total_ms += elapsed_ms
+            self.docs_in += len(docs)
+            self.docs_out += len(selected)
+        return selected
+
+    def _run(self, scorer, question, docs, deadline):
+        """Điểm của từng đoạn; None nếu pool cross-encoder đang bận. Quá hạn thì ném FutureTimeout."""
+        if scorer is self.lexical:
+            return scorer.score(question, docs, deadline)
+        if not self._slots.acquire(blocking=False):
+            return None
+        future = self._pool.submit(self._score_in_pool, scorer, question, docs)
+        return future.result(timeout=max(0.0, deadline - time.perf_counter()))
+
+    def _score_in_pool(self, scorer, question, docs):
+        try:
+            return scorer.score(question, docs)
+        finally:
+            self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            requests = sum(self.counts.values())
+            return {
+                "mode": self.mode,
+                "scorer": self._scorer().name,
+                **self.counts,
+                "avg_ms": round(self.total_ms / requests, 3) if requests else 0.0,
+                "avg_candidates": round(self.docs_in / requests, 2) if requests else 0.0,
+                "avg_k": round(self.docs_out / requests, 2) if requests else 0.0,
+            }
@@ -0,0 +1,85 @@
+import threading
+
+from config import settings
+
+# --- Cấu hình ---
+MAX_CONCURRENT_LLM = settings.max_concurrent_llm  # số lời gọi LLM chạy cùng lúc
+MAX_QUEUED_CHATS = settings.max_queued_chats      # số request được phép xếp hàng chờ
+QUEUE_TIMEOUT = settings.queue_timeout            # giây tối đa chờ trong hàng
+
+
+class ServerBusy(Exception):
+    """Hàng đợi đã đầy hoặc chờ quá lâu: trả 503 thay vì để request dồn ứ."""
+
+    def __init__(self, retry_after: int = 5):
+        super().__init__("Máy chủ đang bận, vui lòng thử lại sau.")
+        self.retry_after = retry_after
+
+
+class ConcurrencyLimiter:
+    """
+    Giới hạn số lời gọi LLM đồng thời trong một tiến trình, có hàng đợi giới hạn.
+    - Tối đa `max_active` request chạy cùng lúc.
+    - Tối đa `max_waiting` request chờ; request thứ max_waiting + 1 bị từ chối ngay.
+    - Request chờ quá `timeout` giây cũng bị từ chối.
+    Chỉ bọc đúng lời gọi LLM (with limiter.slot()), không bọc cả request: câu trả lời lấy từ FAQ, cache
+    hay đường tắt BM25 không chiếm slot và không bao giờ nhận 503.
+    """
+
+    def __init__(self, max_active=MAX_CONCURRENT_LLM, max_waiting=MAX_QUEUED_CHATS, timeout=QUEUE_TIMEOUT):
+        self.max_active = max_active
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self._sem = threading.BoundedSemaphore(max_active)
+        self._lock = threading.Lock()
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+
+    def acquire(self):
+        if self._sem.acquire(blocking=False):  # còn slot trống thì không tính vào hàng chờ
+            with self._lock:
+                self.active += 1
+            return
+        with self._lock:
+            if self.waiting >= self.max_waiting:
+                self.rejected += 1
+                raise ServerBusy()
+            self.waiting += 1
+        ok = self._sem.acquire(timeout=self.timeout)
+        with self._lock:
+            self.waiting -= 1
+            if not ok:
+                self.rejected += 1
+                raise ServerBusy()
+            self.active += 1
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
+        self._sem.release()
+
+    def slot(self):
+        return _Slot(self)
+
+    def stats(self):
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+            "max_active": self.max_active,
+            "max_waiting": self.max_waiting,
+        }
+
+
+class _Slot:
+    def __init__(self, limiter):
+        self.limiter = limiter
+
+    def __enter__(self):
+        self.limiter.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.limiter.release()
+
@@ -0,0 +1,296 @@
+import os
+import re
+import zipfile
+from xml.etree import ElementTree
+
+from langchain_core.documents import Document
+
+from config import settings
+from embedding_cache import compute_hash
+
+# --- Cấu hình ---
+CHILD_CHUNK_SIZE = settings.child_chunk_size    # ký tự: đơn vị nhỏ dùng để so khớp
+PARENT_CHUNK_SIZE = settings.parent_chunk_size  # ký tự: mục cha trả về khi cần ngữ cảnh rộng
+HEADING_MAX_WORDS = 12
+
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_MD_HEADING = re.compile(r"^(#{1,6})\s+(.+)$")
+_NAMED_HEADING = re.compile(r"^(chương|phần|mục|điều)\s+[\dIVXLC]+\b", re.IGNORECASE)
+_NUMBERED_HEADING = re.compile(r"^((?:\d+\.)+\d*|[IVX]+\.)\s+\S")
+_LIST_ITEM = re.compile(r"^([-•+*–]|\d+\)|[a-zđ]\))\s+")
+_INLINE_LIST = re.compile(r"[:;]\s+-\s+")
+_END_PUNCT = ".,;:!?…"
+
+
+class Block:
+    """Một đơn vị cấu trúc của tài liệu: heading (có cấp), đoạn văn, mục danh sách hoặc dòng bảng."""
+    __slots__ = ("kind", "text", "level")
+
+    def __init__(self, kind, text, level=0):
+        self.kind = kind
+        self.text = text
+        self.level = level
+
+    def __repr__(self):
+        return f"Block({self.kind!r}, {self.text[:40]!r}, {self.level})"
+
+
+# === ĐỌC CẤU TRÚC TỪ FILE ===
+def extract_blocks(path: str):
+    """
+    Đọc tài liệu thành danh sách Block theo cấu trúc.
+    Trả về None với định dạng không hỗ trợ (để dùng cách tách ký tự cũ), [] khi file lỗi.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    try:
+        if ext == ".docx":
+            return _docx_blocks(path)
+        if ext == ".pdf":
+            from pypdf import PdfReader
+            lines = []
+            for page in PdfReader(path).pages:
+                lines.extend((page.extract_text() or "").splitlines())
+            return _text_blocks(lines)
+        if ext in (".txt", ".md"):
+            with open(path, "r", encoding="utf-8") as f:
+                return _text_blocks(f.read().splitlines())
+    except Exception as e:
+        print(f"⚠️ Lỗi đọc file {path}: {e}")
+        return []
+    return None
+
+
+def iter_block_groups(path: str, max_chars: int):
+    """
+    Như extract_blocks nhưng đọc dần: PDF theo trang, TXT/MD theo dòng, mỗi nhóm Block ứng với
+    khoảng `max_chars` ký tự văn bản thô nên bộ nhớ không tăng theo kích thước file.
+    DOCX (một file XML nén) vẫn đọc một lần. Trả về None với định dạng không hỗ trợ.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".docx":
+        return iter([extract_blocks(path)])
+    if ext == ".pdf":
+        from pypdf import PdfReader
+        lines = (line for page in PdfReader(path).pages for line in (page.extract_text() or "").splitlines())
+    elif ext in (".txt", ".md"):
+        lines = _read_lines(path, max_chars)
+    else:
+        return None
+    return _grouped_text_blocks(lines, max_chars)
+
+
+def _read_lines(path, max_chars):
+    with open(path, "r", encoding="utf-8") as f:
+        # readline có giới hạn: file không xuống dòng cũng không bị đọc cả vào bộ nhớ
+        for line in iter(lambda: f.readline(max_chars), ""):
+            yield line.rstrip("\n")
+
+
+def _grouped_text_blocks(lines, max_chars):
+    group, size = [], 0
+    for line in lines:
+        group.append(line)
+        size += len(line) + 1
+        # Chỉ cắt nhóm ở dòng trống để không tách đôi một đoạn văn
+        if size >= max_chars and not line.strip():
+            yield _text_blocks(group)
+            group, size = [], 0
+        elif size >= 2 * max_chars:
+            yield _text_blocks(group)
+            group, size = [], 0
+    if group:
+        yield _text_blocks(group)
+
+
+def _docx_blocks(path):
+    """Đọc word/document.xml: style Heading/Title -> heading, numPr -> danh sách, bảng -> từng dòng."""
+    with zipfile.ZipFile(path) as z:
+        root = ElementTree.fromstring(z.read("word/document.xml"))
+    blocks, paragraphs = [], []
+    for el in root.find(_W + "body"):
+        if el.tag == _W + "p":
+            text = "".join(t.text or "" for t in el.iter(_W + "t")).strip()
+            if not text:
+                continue
+            style, is_list = _docx_paragraph_style(el)
+            level = _style_heading_level(style)
+            if level:
+                blocks.append(Block("heading", text, level))
+            elif is_list:
+                blocks.append(Block("list_item", text))
+            else:
+                paragraphs.append(len(blocks))
+                blocks.append(Block("paragraph", text))
+        elif el.tag == _W + "tbl":
+            blocks.extend(_docx_table_rows(el))
+    # Tài liệu không dùng style heading: đoán heading từ đoạn ngắn đứng trước đoạn dài
+    for i in paragraphs:
+        nxt = blocks[i + 1].text if i + 1 < len(blocks) else ""
+        blocks[i] = _classify(blocks[i].text, nxt)
+    return _expand_inline_lists(blocks)
+
+
+def _docx_paragraph_style(el):
+    ppr = el.find(_W + "pPr")
+    if ppr is None:
+        return None, False
+    style = ppr.find(_W + "pStyle")
+    return (style.get(_W + "val") if style is not None else None), ppr.find(_W + "numPr") is not None
+
+
+def _style_heading_level(style):
+    if not style:
+        return 0
+    if style.lower() == "title":
+        return 1
+    m = re.match(r"(?i)heading\s*(\d)", style)
+    return int(m.group(1)) if m else 0
+
+
+def _docx_table_rows(tbl):
+    rows = []
+    for tr in tbl.iter(_W + "tr"):
+        cells = [" ".join("".join(t.text or "" for t in p.iter(_W + "t")) for p in tc.iter(_W + "p")).strip()
+                 for tc in tr.iter(_W + "tc")]
+        rows.append(cells)
+    if not rows:
+        return []
+    header, blocks = rows[0], []
+    for cells in rows[1:]:
+        # Mỗi dòng tự mang tên cột để vẫn hiểu được khi đứng một mình
+        pairs = [f"{h}: {c}" if h else c for h, c in zip(header, cells) if c]
+        blocks.append(Block("table_row", "; ".join(pairs)))
+    if len(rows) == 1:
+        blocks.append(Block("table_row", " | ".join(c for c in header if c)))
+    return blocks
+
+
+def _text_blocks(lines):
+    """Văn bản thuần/PDF: nối các dòng bị ngắt giữa câu, nhận diện heading và mục danh sách."""
+    merged = []
+    for raw in lines:
+        line = raw.strip()
+        if not line:
+            merged.append("")
+            continue
+        starts_block = (_LIST_ITEM.match(line) or _MD_HEADING.match(line) or _NAMED_HEADING.match(line)
+                        or _NUMBERED_HEADING.match(line))
+        prev = merged[-1] if merged else ""
+        if prev and not starts_block and prev[-1] not in _END_PUNCT and line[0].islower():
+            merged[-1] = f"{prev} {line}"
+        else:
+            merged.append(line)
+    texts = [t for t in merged if t]
+    blocks = [_classify(t, texts[i + 1] if i + 1 < len(texts) else "") for i, t in enumerate(texts)]
+    return _expand_inline_lists(blocks)
+
+
+def _classify(text, next_text):
+    m = _MD_HEADING.match(text)
+    if m:
+        return Block("heading", m.group(2).strip(), len(m.group(1)))
+    if _LIST_ITEM.match(text):
+        return Block("list_item", text)
+    short = len(text.split()) <= HEADING_MAX_WORDS and len(text) <= 120 and text[-1] not in _END_PUNCT
+    if short and _NAMED_HEADING.match(text):
+        return Block("heading", text, 2 if text.lower().startswith(("mục", "điều")) else 1)
+    if short and _NUMBERED_HEADING.match(text):
+        return Block("heading", text, text.split()[0].strip(".").count(".") + 1)
+    if short and text[0].isupper() and len(next_text) > len(text):
+        return Block("heading", text, 1 if text.isupper() else 2)
+    return Block("paragraph", text)
+
+
+def _expand_inline_lists(blocks):
+    """Đoạn văn kiểu "...là: - A; - B; - C" được tách thành câu dẫn + từng mục danh sách."""
+    out = []
+    for block in blocks:
+        if block.kind == "paragraph" and len(_INLINE_LIST.findall(block.text)) >= 2:
+            parts = _INLINE_LIST.split(block.text)
+            out.append(Block("paragraph", parts[0].strip() + ":"))
+            out.extend(Block("list_item", f"- {p.strip()}") for p in parts[1:] if p.strip())
+        else:
+            out.append(block)
+    return out
+
+
+# === CHIA ĐOẠN THEO CẤU TRÚC ===
+def _sections(blocks, stack):
+    """Gom block theo heading, trả về [(đường dẫn mục, [block nội dung])]. `stack` (cấp, heading) được cập nhật tại chỗ."""
+    sections, body = [], []
+    for block in blocks:
+        if block.kind == "heading":
+            if body:
+                sections.append((tuple(t for _, t in stack), body))
+                body = []
+            while stack and stack[-1][0] >= block.level:
+                stack.pop()
+            stack.append((block.level, block.text))
+        else:
+            body.append(block)
+    if body:
+        sections.append((tuple(t for _, t in stack), body))
+    return sections
+
+
+def _units(body):
+    """Đơn vị nhỏ nhất không bị cắt: mục danh sách, dòng bảng, câu (khi đoạn văn quá dài)."""
+    units = []
+    for block in body:
+        if block.kind == "paragraph" and len(block.text) > CHILD_CHUNK_SIZE:
+            units.extend(s for s in re.split(r"(?<=[.!?…])\s+", block.text) if s)
+        else:
+            units.append(block.text)
+    return units
+
+
+def _group(units, size):
+    groups, current, length = [], [], 0
+    for unit in units:
+        if current and length + len(unit) > size:
+            groups.append(current)
+            current, length = [], 0
+        current.append(unit)
+        length += len(unit) + 1
+    if current:
+        groups.append(current)
+    return groups
+
+
+def _with_heading(section, text):
+    return f"{section}\n{text}" if section else text
+
+
+def chunk_blocks(blocks, filename: str, headings=None):
+    """
+    Chia theo cấu trúc: mỗi mục (heading) thành các mục cha ≤ PARENT_CHUNK_SIZE ký tự,
+    mỗi mục cha thành các đoạn con ≤ CHILD_CHUNK_SIZE ký tự, không cắt ngang câu, mục danh sách hay dòng bảng.
+    Đoạn con mang theo đường dẫn mục (metadata "section", kèm ở đầu nội dung) và, nếu mục cha có
+    nhiều hơn một đoạn con, nội dung mục cha ("parent", "parent_id") để truy hồi cha/con.
+    Khi ghi vào Knowledge Base, "parent" được tách ra bằng pop_parents và lưu một lần theo parent_id.
+    Khi chia một file theo từng nhóm (iter_block_groups), truyền cùng một list `headings`
+    cho mọi lần gọi để đường dẫn mục được nối tiếp giữa các nhóm.
+    """
+    chunks = []
+    for path, body in _sections(blocks, headings if headings is not None else []):
+        section = " > ".join(path)
+        for parent_units in _group(_units(body), PARENT_CHUNK_SIZE):
+            children = _group(parent_units, CHILD_CHUNK_SIZE)
+            parent_text = _with_heading(section, "\n".join(parent_units))
+            parent_id = compute_hash(parent_text)[:16]
+            for child_units in children:
+                metadata = {"file_name": filename, "section": section}
+                if len(children) > 1:
+                    metadata.update(parent_id=parent_id, parent=parent_text)
+                chunks.append(Document(page_content=_with_heading(section, "\n".join(child_units)), metadata=metadata))
+    return chunks
+
+
+def pop_parents(chunks):
+    """Bỏ nội dung mục cha khỏi metadata các đoạn con (chỉ giữ "parent_id"), trả về {parent_id: nội dung}."""
+    parents = {}
+    for chunk in chunks:
+        text = chunk.metadata.pop("parent", None)
+        if text is not None:
+            parents[chunk.metadata["parent_id"]] = text
+    return parents
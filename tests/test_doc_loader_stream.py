@@ -0,0 +1,33 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from doc_loader import _iter_documents  # noqa: E402
+from structured_chunker import iter_block_groups  # noqa: E402
+
+MAX_CHARS = 10_000
+
+
+def test_txt_without_blank_lines_is_cut_into_bounded_batches(tmp_path):
+    path = tmp_path / "big.txt"
+    line = "Sinh viên cần hoàn thành học phí đúng hạn theo thông báo của Phòng Tài chính.\n"
+    path.write_text(line * 2000, encoding="utf-8")  # ~160 nghìn ký tự, không có dòng trống
+
+    docs = list(_iter_documents(str(path), MAX_CHARS))
+
+    assert len(docs) > 1
+    assert all(len(d.page_content) <= 2 * MAX_CHARS + len(line) for d in docs)
+    assert "".join(d.page_content for d in docs) == line * 2000
+
+
+def test_txt_without_newlines_is_read_in_pieces(tmp_path):
+    path = tmp_path / "one_line.txt"
+    path.write_text("x" * (10 * MAX_CHARS), encoding="utf-8")
+
+    docs = list(_iter_documents(str(path), MAX_CHARS))
+    groups = list(iter_block_groups(str(path), MAX_CHARS))
+
+    assert all(len(d.page_content) <= 2 * MAX_CHARS for d in docs)
+    assert sum(len(d.page_content) for d in docs) == 10 * MAX_CHARS
+    assert len(groups) > 1
@@ -0,0 +1,39 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from embedding_cache import EmbeddingCache  # noqa: E402
+
+
+def test_orphan_rows_are_truncated_on_load(tmp_path):
+    cache = EmbeddingCache("model", str(tmp_path))
+    cache.put_many([("a", [1.0, 1.0]), ("b", [2.0, 2.0])])
+
+    # Sập sau khi ghi vector nhưng trước khi ghi index.txt: hai hàng thừa ở cuối vectors.f32
+    with open(cache.vectors_path, "ab") as f:
+        f.write(np.asarray([[9.0, 9.0], [9.0, 9.0]], dtype=np.float32).tobytes())
+
+    reloaded = EmbeddingCache("model", str(tmp_path))
+    assert len(reloaded) == 2
+    assert os.path.getsize(reloaded.vectors_path) == 2 * 2 * 4
+
+    reloaded.put_many([("c", [5.0, 5.0])])
+    assert reloaded.get_many(["a", "b", "c"]) == {"a": [1.0, 1.0], "b": [2.0, 2.0], "c": [5.0, 5.0]}
+    assert EmbeddingCache("model", str(tmp_path)).get_many(["c"]) == {"c": [5.0, 5.0]}
+
+
+def test_partial_index_line_is_dropped(tmp_path):
+    cache = EmbeddingCache("model", str(tmp_path))
+    cache.put_many([("a", [1.0, 1.0])])
+    with open(cache.vectors_path, "ab") as f:
+        f.write(np.asarray([[9.0, 9.0]], dtype=np.float32).tobytes())
+    with open(cache.index_path, "a", encoding="utf-8") as f:
+        f.write("b")  # dòng index ghi dở, chưa có xuống dòng
+
+    reloaded = EmbeddingCache("model", str(tmp_path))
+    assert reloaded.get_many(["a", "b"]) == {"a": [1.0, 1.0]}
+    reloaded.put_many([("d", [4.0, 4.0])])
+    assert EmbeddingCache("model", str(tmp_path)).get_many(["a", "d"]) == {"a": [1.0, 1.0], "d": [4.0, 4.0]}
@@ -0,0 +1,102 @@
+import os
+import sys
+
+import pytest
+from langchain_core.documents import Document
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from kb_sync import SourceReadError, SyncManifest, apply_file_stream  # noqa: E402
+
+
+class FakeVectorStore:
+    """Chroma giả: lưu đoạn theo ID, có thể cho lỗi (như 429) ở lần ghi thứ `fail_on_call`."""
+
+    def __init__(self, fail_on_call=None):
+        self.docs = {}
+        self.calls = 0
+        self.fail_on_call = fail_on_call
+
+    def add_documents(self, docs, ids):
+        self.calls += 1
+        if self.calls == self.fail_on_call:
+            raise RuntimeError("429 Too Many Requests")
+        self.docs.update(zip(ids, docs))
+
+    def delete(self, ids):
+        for cid in ids:
+            self.docs.pop(cid, None)
+
+
+def make_batches(n_batches, per_batch=3):
+    return [
+        [Document(page_content=f"lô {b} đoạn {i}", metadata={"source": "big.csv"}) for i in range(per_batch)]
+        for b in range(n_batches)
+    ]
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    return SyncManifest(str(tmp_path / "sync_manifest.json"))
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / "big.csv"
+    path.write_text("cot\n1\n", encoding="utf-8")
+    return str(path)
+
+
+def test_write_error_keeps_checkpoint_and_resume_skips_written_batches(manifest, source):
+    batches = make_batches(4)
+    store = FakeVectorStore(fail_on_call=3)
+
+    with pytest.raises(RuntimeError):
+        apply_file_stream(store, manifest, "big.csv", source, batches, "sig-1", batch_size=100)
+
+    # Hai lô đầu đã ghi và được checkpoint; file chưa được ghi nhận là nạp xong
+    assert len(store.docs) == 6
+    assert manifest.chunks.checkpoint("big.csv")[:2] == ("sig-1", 2)
+    assert "big.csv" not in manifest.files
+
+    consumed = []
+
+    def tracked():
+        for i, batch in enumerate(make_batches(4)):
+            consumed.append(i)
+            yield batch
+
+    store.fail_on_call = None
+    calls_before = store.calls
+    added, deleted = apply_file_stream(store, manifest, "big.csv", source, tracked(), "sig-1", batch_size=100)
+
+    assert (added, deleted) == (6, 0)
+    assert store.calls - calls_before == 2  # chỉ embed/ghi lại hai lô còn thiếu
+    assert consumed == [0, 1, 2, 3]          # các lô đã ghi vẫn được đọc (để đếm) nhưng không ghi lại
+    assert len(store.docs) == 12
+    assert manifest.chunks.checkpoint("big.csv") is None
+    assert "big.csv" in manifest.files
+
+
+def test_changed_signature_restarts_from_first_batch(manifest, source):
+    store = FakeVectorStore(fail_on_call=2)
+    with pytest.raises(RuntimeError):
+        apply_file_stream(store, manifest, "big.csv", source, make_batches(3), "sig-1", batch_size=100)
+
+    store.fail_on_call = None
+    added, _ = apply_file_stream(store, manifest, "big.csv", source, make_batches(3), "sig-2", batch_size=100)
+
+    # Đoạn của lô đầu đã có sẵn trong chỉ mục nên không ghi lại, các lô còn lại được ghi
+    assert added == 6
+    assert len(store.docs) == 9
+
+
+def test_read_error_is_reported_as_source_error(manifest, source):
+    def broken():
+        yield make_batches(1)[0]
+        raise ValueError("PDF hỏng")
+
+    store = FakeVectorStore()
+    with pytest.raises(SourceReadError):
+        apply_file_stream(store, manifest, "big.csv", source, broken(), "sig-1", batch_size=100)
+    assert len(store.docs) == 3
@@ -0,0 +1,171 @@
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+from langchain_core.documents import Document
+
+from config import settings
+
+# --- Cấu hình ---
+SNAPSHOT_DIR = settings.snapshot_dir
+SNAPSHOT_QUANTIZED = settings.snapshot_quantized  # tìm trên ma trận int8
+KEEP_SNAPSHOTS = 2  # giữ lại bản cũ để tiến trình đang map nó không bị lỗi
+SCORE_BLOCK_ROWS = 2048  # số hàng int8 đổi sang float32 mỗi lần khi lọc thô (bộ nhớ tạm ~ 2048 x số chiều x 4 byte)
+
+
+# === XUẤT SNAPSHOT TỪ CHROMA ===
+def build_snapshot(vector_store, snapshot_dir=SNAPSHOT_DIR, page_size=1000):
+    """
+    Xuất toàn bộ embedding trong Chroma ra một thư mục snapshot mới:
+    - vectors.npy: ma trận float32 liên tục (đã chuẩn hóa), đọc bằng memory-map.
+    - vectors_i8.npy + scales.npy: bản lượng tử hóa int8 (mỗi hàng một hệ số).
+    - docs.json: id, nội dung và metadata theo đúng thứ tự hàng.
+    Sau khi ghi xong mới đổi con trỏ CURRENT (os.replace), nên không ai đọc phải bản dở dang.
+    """
+    # Ghi thẳng từng trang vào file .npy qua memory-map: bộ nhớ không tăng theo số vector
+    total = len(vector_store.get(include=[])["ids"])
+    stamp = str(time.time_ns())
+    target = os.path.join(snapshot_dir, stamp)
+    os.makedirs(target, exist_ok=True)
+    ids, texts, metas = [], [], []
+    matrix = quantized = scales = None
+    offset = 0
+    while offset < total:
+        res = vector_store.get(include=["embeddings", "documents", "metadatas"], limit=page_size, offset=offset)
+        if not len(res["ids"]):
+            break
+        page = np.asarray(res["embeddings"], dtype=np.float32)
+        if matrix is None:
+            matrix = _open_npy(target, "vectors.npy", np.float32, (total, page.shape[1]))
+            quantized = _open_npy(target, "vectors_i8.npy", np.int8, (total, page.shape[1]))
+            scales = _open_npy(target, "scales.npy", np.float32, (total,))
+        end = offset + len(page)
+        norms = np.linalg.norm(page, axis=1, keepdims=True)
+        page = page / np.where(norms == 0, 1, norms)
+        page_scales = np.abs(page).max(axis=1) / 127.0
+        matrix[offset:end] = page
+        quantized[offset:end] = np.round(page / np.where(page_scales == 0, 1, page_scales)[:, None]).astype(np.int8)
+        scales[offset:end] = page_scales
+        ids.extend(res["ids"])
+        texts.extend(res["documents"])
+        metas.extend(res["metadatas"])
+        offset = end
+
+    if matrix is None:
+        np.save(os.path.join(target, "vectors.npy"), np.zeros((0, 1), dtype=np.float32))
+        np.save(os.path.join(target, "vectors_i8.npy"), np.zeros((0, 1), dtype=np.int8))
+        np.save(os.path.join(target, "scales.npy"), np.zeros(0, dtype=np.float32))
+    else:
+        arrays = {"vectors.npy": matrix, "vectors_i8.npy": quantized, "scales.npy": scales}
+        for name, arr in arrays.items():
+            if offset < total:  # Chroma ít đoạn hơn lúc đếm: cắt bỏ các hàng trống ở cuối
+                trimmed = np.array(arr[:offset])
+                del arr
+                np.save(os.path.join(target, name), trimmed)
+            else:
+                arr.flush()
+        del matrix, quantized, scales, arrays
+    with open(os.path.join(target, "docs.json"), "w", encoding="utf-8") as f:
+        json.dump({"ids": ids, "documents": texts, "metadatas": metas}, f, ensure_ascii=False)
+
+    tmp = os.path.join(snapshot_dir, "CURRENT.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(stamp)
+    os.replace(tmp, os.path.join(snapshot_dir, "CURRENT"))
+    _cleanup(snapshot_dir)
+    print(f"📸 Đã xuất snapshot {len(ids)} vector vào '{target}'.")
+    return target
+
+
+def _open_npy(target, name, dtype, shape):
+    return np.lib.format.open_memmap(os.path.join(target, name), mode="w+", dtype=dtype, shape=shape)
+
+
+def current_snapshot_path(snapshot_dir=SNAPSHOT_DIR):
+    try:
+        with open(os.path.join(snapshot_dir, "CURRENT"), "r", encoding="utf-8") as f:
+            return os.path.join(snapshot_dir, f.read().strip())
+    except OSError:
+        return None
+
+
+def _cleanup(snapshot_dir):
+    stamps = sorted(d for d in os.listdir(snapshot_dir) if d.isdigit())
+    for old in stamps[:-KEEP_SNAPSHOTS]:
+        shutil.rmtree(os.path.join(snapshot_dir, old), ignore_errors=True)
+
+
+class VectorSnapshot:
+    """
+    Chỉ mục vector chỉ-đọc trong tiến trình, tìm top-k bằng NumPy trên ma trận memory-map.
+    Nhiều tiến trình cùng map một file nên dùng chung trang bộ nhớ của hệ điều hành, không sao chép.
+    """
+
+    def __init__(self, path, quantized=SNAPSHOT_QUANTIZED):
+        self.path = path
+        self.quantized = quantized
+        self.matrix = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        self.q8 = np.load(os.path.join(path, "vectors_i8.npy"), mmap_mode="r")
+        self.scales = np.load(os.path.join(path, "scales.npy"), mmap_mode="r")
+        with open(os.path.join(path, "docs.json"), "r", encoding="utf-8") as f:
+            data = json.load(f)
+        self.ids = data["ids"]
+        self.documents = data["documents"]
+        self.metadatas = data["metadatas"]
+
+    @classmethod
+    def load_current(cls, snapshot_dir=SNAPSHOT_DIR, quantized=SNAPSHOT_QUANTIZED):
+        path = current_snapshot_path(snapshot_dir)
+        if path is None or not os.path.exists(os.path.join(path, "docs.json")):
+            return None
+        return cls(path, quantized)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def search(self, query_vector, k=4):
+        """Trả về danh sách (Document, cosine) giảm dần."""
+        n = len(self.ids)
+        if n == 0:
+            return []
+        query = np.asarray(query_vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+
+        if self.quantized:
+            # Lọc thô trên int8 rồi chấm lại chính xác bằng float32 cho nhóm ứng viên
+            rough = self._rough_scores(query)
+            pool = min(n, k * 4)
+            candidates = np.argpartition(-rough, pool - 1)[:pool]
+            scores = self.matrix[candidates] @ query
+            order = candidates[np.argsort(-scores)][:k]
+            final = np.sort(scores)[::-1][:k]
+        else:
+            scores = self.matrix @ query
+            k = min(k, n)
+            top = np.argpartition(-scores, k - 1)[:k]
+            order = top[np.argsort(-scores[top])]
+            final = scores[order]
+
+        return [
+            (Document(page_content=self.documents[i] or "", metadata=self.metadatas[i] or {}, id=self.ids[i]), float(s))
+            for i, s in zip(order, final)
+        ]
+
+    def _rough_scores(self, query):
+        """
+        Điểm xấp xỉ trên ma trận int8, tính theo từng khối SCORE_BLOCK_ROWS hàng: chỉ một khối được đổi sang
+        float32 (dùng BLAS) tại một thời điểm, thay vì tạo bản float32 của cả ma trận ở mỗi câu hỏi.
+        """
+        n = len(self.ids)
+        query = np.asarray(query, dtype=np.float32)
+        rough = np.empty(n, dtype=np.float32)
+        block = np.empty((min(n, SCORE_BLOCK_ROWS), self.q8.shape[1]), dtype=np.float32)
+        for start in range(0, n, SCORE_BLOCK_ROWS):
+            end = min(n, start + SCORE_BLOCK_ROWS)
+            rows = block[:end - start]
+            rows[...] = self.q8[start:end]
+            np.dot(rows, query, out=rough[start:end])
+        rough *= self.scales
+        return rough